@@ -0,0 +1,189 @@
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+
+from ledger import Ledger
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("streak", "quizzes", "credits", "followers")
+
+
+class Rule:
+    __slots__ = ("name", "metric", "threshold", "credits")
+
+    # Awarded once, the first time `metric` reaches `threshold`
+    def __init__(self, name, metric, threshold, credits=0):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown achievement metric {metric}")
+        self.name = name
+        self.metric = metric
+        self.threshold = threshold
+        self.credits = credits
+
+    def __repr__(self):
+        return f"Rule({self.name}: {self.metric} >= {self.threshold}, +{self.credits})"
+
+
+# Credits-based rules grant nothing, so an award can't push a user over the next one
+DEFAULT_RULES = (
+    Rule("Quiz Streaker", "streak", 5, 50),
+    Rule("Unstoppable", "streak", 30, 300),
+    Rule("Quiz Rookie", "quizzes", 10, 25),
+    Rule("Quiz Master", "quizzes", 100, 100),
+    Rule("High Roller", "credits", 1000),
+    Rule("Crypto Whale", "credits", 10000),
+    Rule("Rising Star", "followers", 10, 50),
+    Rule("Influencer", "followers", 100, 200),
+)
+
+
+# Ledger ref of an award; the same (user, achievement) pair can only ever be granted once
+def award_ref(user_id, name):
+    return f"{user_id}:{name}"
+
+
+# Evaluates achievement rules from handler events against in-memory per-user counters.
+# A user's counters are loaded once (through `load(user_id)` -> (metrics, awarded names),
+# expected to reflect every change already made) and then moved by add()/set(), which only
+# look at the rules for the metrics that changed. Awards go through the write-behind buffer;
+# the unique (user_id, name) index and the ledger ref make them exactly-once even when two
+# workers race or a user is evicted and reloaded.
+class AchievementEngine:
+    def __init__(self, db, writes, load, rules=DEFAULT_RULES, capacity=10000):
+        self._db = db
+        self._writes = writes
+        self._load = load
+        self.rules = list(rules)
+        self.capacity = capacity
+        self._by_metric = defaultdict(list)
+        for rule in sorted(self.rules, key=lambda r: r.threshold):
+            self._by_metric[rule.metric].append(rule)
+        # user_id -> (metrics dict, awarded names)
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.awarded = 0
+        writes.unique_keys["achievements"] = "user_id, name"
+
+    # One event: counter deltas plus optional absolute values, e.g.
+    # add(user_id, {"streak": 3}, quizzes=1, credits=20). Returns the rules newly awarded.
+    def add(self, user_id, values=None, **deltas):
+        return self._event(user_id, deltas, values or {})
+
+    def forget(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _event(self, user_id, deltas, values):
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is not None:
+                self._users.move_to_end(user_id)
+        fresh = state is None
+        if fresh:
+            state = self._remember(user_id)
+            if state is None:
+                return []
+        awards = []
+        with self._lock:
+            counters, awarded = state
+            if fresh:
+                # A freshly loaded state already includes this event, so every rule is checked
+                # against it instead of applying the change on top
+                changed = set(METRICS)
+            else:
+                changed = set(deltas) | set(values)
+                for metric, delta in deltas.items():
+                    counters[metric] = counters.get(metric, 0) + delta
+                counters.update(values)
+            while changed:
+                metric = changed.pop()
+                for rule in self._by_metric.get(metric, ()):
+                    if counters.get(metric, 0) < rule.threshold:
+                        break
+                    if rule.name in awarded:
+                        continue
+                    awarded.add(rule.name)
+                    awards.append(rule)
+                    if rule.credits:
+                        counters["credits"] = counters.get("credits", 0) + rule.credits
+                        changed.add("credits")
+        for rule in awards:
+            self._award(user_id, rule)
+        return awards
+
+    def _remember(self, user_id):
+        loaded = self._load(user_id)
+        if loaded is None:
+            return None
+        counters, awarded = loaded
+        with self._lock:
+            # Another worker may have loaded the user meanwhile; keep the first copy
+            state = self._users.setdefault(user_id, (dict(counters), set(awarded)))
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.capacity:
+                self._users.popitem(last=False)
+        return state
+
+    def _award(self, user_id, rule):
+        self.awarded += 1
+        self._writes.record(user_id, rule.credits, "achievements",
+                            {"user_id": user_id, "name": rule.name, "credits": rule.credits, "created_at": datetime.now().isoformat()},
+                            reason="achievement", ref=award_ref(user_id, rule.name))
+        logger.info(f"User {user_id} earned achievement {rule.name}")
+
+    # Evaluate every user against the rules straight from the database, in keyset chunks with
+    # set-based queries: for existing users and whenever a rule is added. Writes directly, so
+    # run it with the bot stopped (or restart it afterwards so the leaderboard reloads).
+    def backfill(self, batch=500):
+        ledger = Ledger(self._db)
+        awarded = 0
+        after = -(1 << 62)
+        while True:
+            users = self._db.fetchall("SELECT user_id, streak, credits FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, batch))
+            if not users:
+                break
+            after = users[-1][0]
+            counters = {user_id: {"streak": streak or 0, "credits": credits or 0, "quizzes": 0, "followers": 0}
+                        for user_id, streak, credits in users}
+            names = defaultdict(set)
+            placeholders = ",".join("?" * len(users))
+            ids = tuple(counters)
+            for user_id, count in self._db.fetchall(f"SELECT user_id, COUNT(*) FROM dynamic_quizzes WHERE user_id IN ({placeholders}) GROUP BY user_id", ids):
+                counters[user_id]["quizzes"] += count
+            for user_id, count in self._db.fetchall(f"SELECT user_id, SUM(events) FROM daily_activity WHERE source = 'dynamic_quizzes' "
+                                                    f"AND user_id IN ({placeholders}) GROUP BY user_id", ids):
+                counters[user_id]["quizzes"] += count or 0
+            for user_id, followers in self._db.fetchall(f"SELECT user_id, followers FROM social_profiles WHERE user_id IN ({placeholders})", ids):
+                counters[user_id]["followers"] = followers or 0
+            for user_id, name in self._db.fetchall(f"SELECT user_id, name FROM achievements WHERE user_id IN ({placeholders})", ids):
+                names[user_id].add(name)
+            rows, grants = [], []
+            now = datetime.now().isoformat()
+            # Credits rules last, so they see what the other awards granted
+            rules = sorted(self.rules, key=lambda r: r.metric == "credits")
+            for user_id, values in counters.items():
+                for rule in rules:
+                    if rule.name not in names[user_id] and values[rule.metric] >= rule.threshold:
+                        values["credits"] += rule.credits
+                        rows.append((user_id, rule.name, rule.credits, now))
+                        grants.append((user_id, rule.credits, "achievement", award_ref(user_id, rule.name)))
+            if not rows:
+                continue
+            with self._db.transaction() as cur:
+                cur.executemany("INSERT INTO achievements (user_id, name, credits, created_at) VALUES (?,?,?,?) "
+                                "ON CONFLICT(user_id, name) DO NOTHING", rows)
+                skipped = ledger.grant_many(grants, cur)
+            awarded += len(rows) - len(skipped)
+        logger.info(f"Backfilled {awarded} achievements")
+        return awarded
+
+
+if __name__ == "__main__":
+    from db import Database
+    from write_behind import WriteBehindBuffer
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = Database.from_env()
+    AchievementEngine(db, WriteBehindBuffer(db, mode="sync"), lambda user_id: None).backfill()
+    db.close()
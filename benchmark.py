@@ -0,0 +1,437 @@
+"""Load test for the webhook with synthetic Telegram updates.
+
+Runs the app against local fake Telegram and OpenAI servers (with configurable latency),
+posts a seeded mix of commands from many synthetic users, and reports throughput plus
+p50/p95/p99 latency and DB statements per command. Results are written as JSON; pass
+--baseline to fail (exit 1) when a run regresses against an earlier one.
+
+    python benchmark.py --mode both --updates 2000 --users 200 --output bench.json
+    python benchmark.py --baseline bench.json --output bench-new.json
+
+"ack" latency is the webhook's HTTP response, "reply" latency runs until the first
+sendMessage answering that update reaches the fake Telegram server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Relative weights of the commands in the synthetic traffic
+COMMAND_MIX = {
+    "/start": 10,
+    "/profile": 25,
+    "/leaderboard": 15,
+    "/newquiz": 15,
+    "/dailyquiz": 5,
+    "/crypto": 5,
+    "/follow": 10,
+    "/unfollow": 5,
+    "/followers": 5,
+    "/setbio": 5,
+}
+
+# Application settings for the run; rate limits and outbound shaping are lifted so the
+# numbers measure the bot rather than the throttles. Override any of them with --env.
+BENCH_ENV = {
+    "BOT_TOKEN": "123456:benchmark",
+    "ADMIN_USER_ID": "1",
+    "WEBHOOK_URL": "https://benchmark.invalid",
+    "OPENAI_API_KEY": "benchmark",
+    "MINIAPP_URL": "https://benchmark.invalid/app",
+    "RATE_LIMITS": "",
+    "RATE_LIMIT_DEFAULT": "1000000/1",
+    "OUTBOX_GLOBAL_RATE": "100000",
+    "OUTBOX_CHAT_RATE": "100000",
+    "RETENTION_INTERVAL_HOURS": "0",
+    "FLOOD_USER_LIMIT": "1000000/1",
+    "FLOOD_CHAT_LIMIT": "1000000/1",
+    "FLOOD_DUPLICATE_LIMIT": "1000000/1",
+}
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(values[-1] * 1000, 3)}
+
+
+# Synthetic updates
+
+def make_update(update_id, user_id, text):
+    command = text.split()[0]
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": int(time.time()), "text": text,
+                        "chat": {"id": user_id, "type": "private", "first_name": f"Bench{user_id}"},
+                        "from": {"id": user_id, "is_bot": False, "first_name": f"Bench{user_id}", "username": f"bench{user_id}"},
+                        "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}]}}
+
+
+def command_text(command, user_id, users, rng):
+    if command in ("/follow", "/unfollow"):
+        other = rng.randint(1, users)
+        return f"{command} {other if other != user_id else other % users + 1}"
+    if command == "/newquiz":
+        return f"/newquiz {rng.choice(['python', 'roblox', 'minecraft'])} {rng.choice(['easy', 'medium', 'hard'])}"
+    if command == "/setbio":
+        return f"/setbio benchmark bio {rng.randint(1, 1000)}"
+    return command
+
+
+def generate_updates(count, users, seed, first_id):
+    rng = random.Random(seed)
+    commands, weights = zip(*COMMAND_MIX.items())
+    updates = []
+    for i in range(count):
+        user_id = rng.randint(1, users)
+        command = rng.choices(commands, weights)[0]
+        updates.append((command, make_update(first_id + i, user_id, command_text(command, user_id, users, rng))))
+    return updates
+
+
+# Fake Telegram Bot API and OpenAI server
+
+class FakeUpstream:
+    def __init__(self, telegram_latency, openai_latency):
+        self.telegram_latency = telegram_latency
+        self.openai_latency = openai_latency
+        self.replies = {}
+        self.calls = defaultdict(int)
+        # (time, chat_id, text) of every sendMessage accepted, in arrival order
+        self.messages = []
+        # retry_after values; each one answers the next sendMessage with a 429
+        self.rate_limits = deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="fake-upstream", daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+
+    def _record(self, method, body):
+        with self._lock:
+            self.calls[method] += 1
+            if method != "sendMessage":
+                return
+            self.messages.append((time.perf_counter(), int(body.get("chat_id", 0)), body.get("text")))
+            reply_to = body.get("reply_to_message_id")
+            params = body.get("reply_parameters")
+            if isinstance(params, str):
+                params = json.loads(params)
+            if params:
+                reply_to = params.get("message_id")
+            if reply_to is not None:
+                self.replies.setdefault(int(reply_to), time.perf_counter())
+
+    def _rate_limited(self, method):
+        with self._lock:
+            if method == "sendMessage" and self.rate_limits:
+                self.calls["sendMessage 429"] += 1
+                return self.rate_limits.popleft()
+        return None
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out as separate writes; don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                method = self.path.rsplit("/", 1)[-1].split("?")[0]
+                if method == "completions":
+                    time.sleep(upstream.openai_latency)
+                    upstream._record("chat/completions", {})
+                    content = (f"Question {time.time_ns()}: Which one is correct? A) one B) two C) three D) four. "
+                               f"Correct answer: A")
+                    result = {"choices": [{"message": {"role": "assistant", "content": content}}]}
+                else:
+                    time.sleep(upstream.telegram_latency)
+                    if self.headers.get("Content-Type", "").startswith("application/json"):
+                        body = json.loads(raw or b"{}")
+                    else:
+                        body = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+                    retry_after = upstream._rate_limited(method)
+                    if retry_after is not None:
+                        data = json.dumps({"ok": False, "error_code": 429, "description": "Too Many Requests: retry later",
+                                           "parameters": {"retry_after": retry_after}}).encode()
+                        self.send_response(429)
+                        self.send_header("Content-Type", "application/json")
+                        self.send_header("Content-Length", str(len(data)))
+                        self.end_headers()
+                        self.wfile.write(data)
+                        return
+                    upstream._record(method, body)
+                    if method == "getWebhookInfo":
+                        payload = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+                    elif method in ("setWebhook", "deleteWebhook"):
+                        payload = True
+                    else:
+                        payload = {"message_id": 1, "date": int(time.time()), "chat": {"id": int(body.get("chat_id", 0)), "type": "private"}}
+                    result = {"ok": True, "result": payload}
+                data = json.dumps(result).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+        return Handler
+
+
+# DB statement accounting, attributed to the handler running on the current thread
+
+class StatementCounter:
+    def __init__(self):
+        self.total = 0
+        self.seconds = 0.0
+        self.by_command = defaultdict(lambda: [0, 0.0, 0])
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __call__(self, sql, seconds):
+        with self._lock:
+            self.total += 1
+            self.seconds += seconds
+        current = getattr(self._local, "current", None)
+        if current is not None:
+            current[0] += 1
+            current[1] += seconds
+
+    def wrap(self, command, function):
+        def wrapped(*args, **kwargs):
+            self._local.current = current = [0, 0.0]
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.current = None
+                with self._lock:
+                    stats = self.by_command[command]
+                    stats[0] += current[0]
+                    stats[1] += current[1]
+                    stats[2] += 1
+        return wrapped
+
+    def reset(self):
+        with self._lock:
+            self.total = 0
+            self.seconds = 0.0
+            self.by_command.clear()
+
+
+# One run: import the app against the fakes, warm every user up, then measure
+
+async def post_all(client, updates, concurrency, acks, statuses):
+    pending = iter(updates)
+    sent_at = {}
+
+    async def worker():
+        for command, update in pending:
+            started = time.perf_counter()
+            sent_at[update["update_id"]] = (command, started)
+            response = await client.post("/", json=update)
+            acks[command].append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return sent_at
+
+
+async def wait_for_replies(upstream, ids, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and not all(i in upstream.replies for i in ids):
+        await asyncio.sleep(0.02)
+
+
+async def drive(base_url, transport, args, upstream, counter):
+    import httpx
+    warmup = [("/start", make_update(user_id, user_id, "/start")) for user_id in range(1, args.users + 1)]
+    updates = generate_updates(args.updates, args.users, args.seed, len(warmup) + 1)
+    acks = defaultdict(list)
+    statuses = defaultdict(int)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60) as client:
+        await post_all(client, warmup, args.concurrency, defaultdict(list), defaultdict(int))
+        await wait_for_replies(upstream, [u["update_id"] for _, u in warmup], args.drain_timeout)
+        counter.reset()
+        upstream.calls.clear()
+        started = time.perf_counter()
+        sent_at = await post_all(client, updates, args.concurrency, acks, statuses)
+        await wait_for_replies(upstream, list(sent_at), args.drain_timeout)
+        elapsed = time.perf_counter() - started
+    replies = defaultdict(list)
+    unanswered = defaultdict(int)
+    for update_id, (command, at) in sent_at.items():
+        answered = upstream.replies.get(update_id)
+        if answered is None:
+            unanswered[command] += 1
+        else:
+            replies[command].append(answered - at)
+    commands = {}
+    for command in sorted(acks):
+        stmts, stmt_seconds, calls = counter.by_command.get(command, (0, 0.0, 0))
+        commands[command] = {
+            "count": len(acks[command]),
+            "unanswered": unanswered[command],
+            "ack_ms": percentiles(acks[command]),
+            "reply_ms": percentiles(replies[command]),
+            "db_statements": round(stmts / calls, 2) if calls else 0,
+            "db_ms": round(stmt_seconds / calls * 1000, 3) if calls else 0,
+        }
+    return {
+        "updates": len(updates),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(updates) / elapsed, 1),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "unanswered": sum(unanswered.values()),
+        "ack_ms": percentiles([v for values in acks.values() for v in values]),
+        "reply_ms": percentiles([v for values in replies.values() for v in values]),
+        # Everything the process ran (handlers plus background flushes) divided by updates
+        "db_statements_per_update": round(counter.total / len(updates), 2),
+        "db_ms_per_update": round(counter.seconds / len(updates) * 1000, 3),
+        "upstream_calls": dict(upstream.calls),
+        "commands": commands,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_single(args):
+    upstream = FakeUpstream(args.telegram_latency_ms / 1000, args.openai_latency_ms / 1000)
+    upstream.start()
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    env = dict(BENCH_ENV, SQLITE_PATH=os.path.join(workdir, "bench.db"),
+               TELEGRAM_API_URL=upstream.url, OPENAI_API_URL=upstream.url + "/v1")
+    env.update(item.split("=", 1) for item in args.env)
+    os.environ.update(env)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import httpx
+    import main
+
+    counter = StatementCounter()
+    main.db.listeners.append(counter)
+    for handler in main.bot.message_handlers:
+        for command in handler["filters"].get("commands") or ():
+            handler["function"] = counter.wrap("/" + command, handler["function"])
+            break
+
+    if args.mode == "http":
+        import uvicorn
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+        try:
+            result = asyncio.run(drive(f"http://127.0.0.1:{port}", None, args, upstream, counter))
+        finally:
+            server.should_exit = True
+            thread.join()
+    else:
+        async def in_process():
+            async with main.app.router.lifespan_context(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                return await drive("http://bench", transport, args, upstream, counter)
+        result = asyncio.run(in_process())
+    upstream.stop()
+    result["mode"] = args.mode
+    return result
+
+
+# Comparison against an earlier run
+
+def regressions(current, baseline, tolerance, slack_ms=2.0):
+    problems = []
+    for mode, run in current["runs"].items():
+        base = baseline.get("runs", {}).get(mode)
+        if base is None:
+            continue
+        if run["throughput"] < base["throughput"] * (1 - tolerance):
+            problems.append(f"{mode}: throughput {run['throughput']}/s vs {base['throughput']}/s")
+        for command, stats in run["commands"].items():
+            before = base["commands"].get(command, {}).get("reply_ms", {}).get("p95")
+            after = stats["reply_ms"]["p95"]
+            if before is not None and after is not None and after > before * (1 + tolerance) + slack_ms:
+                problems.append(f"{mode} {command}: reply p95 {after}ms vs {before}ms")
+            before = base["commands"].get(command, {}).get("db_statements")
+            if before is not None and stats["db_statements"] > before * (1 + tolerance):
+                problems.append(f"{mode} {command}: {stats['db_statements']} statements vs {before}")
+    return problems
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("inprocess", "http", "both"), default="both")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--telegram-latency-ms", type=float, default=30)
+    parser.add_argument("--openai-latency-ms", type=float, default=500)
+    parser.add_argument("--drain-timeout", type=float, default=60, help="seconds to wait for outstanding replies")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app setting, repeatable")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        json.dump(run_single(args), sys.stdout)
+        return 0
+
+    # Each mode runs in a fresh interpreter: the app wires its globals at import time
+    runs = {}
+    for mode in (("inprocess", "http") if args.mode == "both" else (args.mode,)):
+        cmd = [sys.executable, os.path.abspath(__file__), *(sys.argv[1:] if argv is None else argv), "--mode", mode, "--child"]
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+        runs[mode] = json.loads(out.decode().strip().splitlines()[-1])
+        print(f"{mode}: {runs[mode]['throughput']} updates/s, reply p95 {runs[mode]['reply_ms']['p95']}ms, "
+              f"{runs[mode]['db_statements_per_update']} statements/update, {runs[mode]['unanswered']} unanswered")
+
+    result = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "config": {k: v for k, v in vars(args).items() if k not in ("child", "baseline", "output")},
+              "runs": runs}
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = regressions(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
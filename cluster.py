@@ -0,0 +1,184 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+# Coordinates the workers of a multi-process (gunicorn) or multi-node deployment through a
+# shared state backend (shared_state.py):
+# - Updates are sharded by chat id. Each worker leases one shard; an update that arrives at
+#   another worker is forwarded through the shard's queue, so one chat is always processed
+#   by one worker. The owner drains that queue before it dispatches an update it received
+#   itself, so forwarded updates are never overtaken by later local ones.
+# - publish(kind, *args) fans a cache change out to every other worker, where the handlers
+#   registered with subscribe(kind, fn) apply it. Outgoing events are batched.
+# With one shard and the in-process backend every update is local and nothing is published.
+class Cluster:
+    def __init__(self, state, shards=1, lease_ttl=15.0, poll_interval=0.2):
+        self.state = state
+        self.shards = max(1, shards) if state.shared else 1
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.shard = None if state.shared else 0
+        self._submit = None
+        self._prepare = None
+        self._subscribers = defaultdict(list)
+        self._outgoing = []
+        self._lock = threading.Lock()
+        # Held while updates are handed to the dispatcher, so queued and local ones stay in order
+        self._order = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = []
+        self.forwarded = 0
+        self.received = 0
+
+    @property
+    def active(self):
+        return self.state.shared
+
+    def subscribe(self, kind, handler):
+        self._subscribers[kind].append(handler)
+
+    # Queue an event for the other workers; cheap enough to call under other locks
+    def publish(self, kind, *args):
+        if not self.state.shared:
+            return
+        with self._lock:
+            self._outgoing.append((self.worker_id, kind, list(args)))
+
+    # `prepare(payload)` turns a forwarded update (raw JSON) into the item to process, or None
+    # to drop it; it runs once per update. `submit(item)` hands the item to the local
+    # dispatcher and returns False while it is full, and is retried until it has room.
+    # Without `submit` the worker takes no shard and only fans out cache events.
+    def start(self, submit=None, prepare=None):
+        self._submit = submit
+        self._prepare = prepare
+        if not self.state.shared:
+            return
+        self._stopped.clear()
+        loops = [("cluster-events", self._event_loop)]
+        if submit is not None:
+            self._claim_shard()
+            loops += [("cluster-lease", self._renew_loop), ("cluster-updates", self._update_loop)]
+        for name, target in loops:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._flush_events()
+
+    def shard_of(self, key):
+        return key % self.shards
+
+    # True when updates with this key are processed here
+    def owns(self, key):
+        return not self.state.shared or self.shard_of(key) == self.shard
+
+    # Hand an update to whoever owns its shard: `payload` (raw JSON) is forwarded to another
+    # worker, `item` is submitted here. False only when the local dispatcher is full.
+    def dispatch(self, key, payload, item):
+        if not self.state.shared:
+            return self._submit(item)
+        shard = self.shard_of(key)
+        if shard != self.shard:
+            self.state.push(f"updates:{shard}", [payload])
+            self.forwarded += 1
+            return True
+        with self._order:
+            # Anything still queued for this shard arrived before this update
+            try:
+                self._drain(shard)
+            except Exception as e:
+                logger.error(f"Reading shard {shard} queue failed: {e}")
+            return self._submit(item)
+
+    def _claim_shard(self):
+        # Start the scan at a pid-dependent slot so workers booting together don't all race for shard 0
+        offset = os.getpid() % self.shards
+        for i in range(self.shards):
+            shard = (offset + i) % self.shards
+            if self.state.lease(f"shard:{shard}", self.worker_id, self.lease_ttl):
+                self.shard = shard
+                logger.info(f"Worker {self.worker_id} owns shard {shard} of {self.shards}")
+                return True
+        self.shard = None
+        logger.warning(f"Worker {self.worker_id} found no free shard; it will only forward updates")
+        return False
+
+    def _renew_loop(self):
+        while not self._stopped.wait(self.lease_ttl / 3):
+            try:
+                if self.shard is None or not self.state.lease(f"shard:{self.shard}", self.worker_id, self.lease_ttl):
+                    if self.shard is not None:
+                        logger.error(f"Worker {self.worker_id} lost shard {self.shard}")
+                    self._claim_shard()
+            except Exception as e:
+                logger.error(f"Shard lease renewal failed: {e}")
+
+    def _update_loop(self):
+        while not self._stopped.is_set():
+            shard = self.shard
+            if shard is None:
+                self._stopped.wait(self.poll_interval)
+                continue
+            try:
+                with self._order:
+                    drained = self._drain(shard)
+            except Exception as e:
+                logger.error(f"Reading shard {shard} queue failed: {e}")
+                drained = 0
+            if not drained:
+                self._stopped.wait(self.poll_interval)
+
+    # Submit every update queued for the shard, without waiting for more; call with _order held
+    def _drain(self, shard):
+        payloads = self.state.pop(f"updates:{shard}", 0)
+        for payload in payloads:
+            self.received += 1
+            item = payload if self._prepare is None else self._prepare(payload)
+            if item is None:
+                continue
+            # Wait for room rather than drop: the update was already acknowledged to Telegram
+            while not self._submit(item) and not self._stopped.is_set():
+                time.sleep(0.05)
+        return len(payloads)
+
+    def _flush_events(self):
+        with self._lock:
+            events, self._outgoing = self._outgoing, []
+        if not events:
+            return
+        try:
+            self.state.publish(events)
+        except Exception as e:
+            logger.error(f"Publishing {len(events)} cache events failed: {e}")
+
+    def _event_loop(self):
+        cursor = None
+        while not self._stopped.is_set():
+            self._flush_events()
+            try:
+                cursor, events = self.state.events(cursor, self.poll_interval)
+            except Exception as e:
+                logger.error(f"Reading cache events failed: {e}")
+                self._stopped.wait(self.poll_interval)
+                continue
+            for origin, kind, args in events:
+                if origin == self.worker_id:
+                    continue
+                for handler in self._subscribers.get(kind, ()):
+                    try:
+                        handler(*args)
+                    except Exception as e:
+                        logger.error(f"Cache event {kind} failed: {e}")
@@ -0,0 +1,250 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Applied to every SQLite connection when it is opened
+SQLITE_PRAGMAS = (
+    # Only takes effect on a new database; Retention converts existing ones with a one-off VACUUM
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=OFF",
+)
+
+# Size of sqlite3's per-connection prepared statement cache
+STATEMENT_CACHE_SIZE = 256
+
+_DDL_REWRITES = (
+    # Foreign keys are not enforced on SQLite either
+    (re.compile(r",\s*FOREIGN KEY \([^)]*\) REFERENCES \w+\([^)]*\)", re.I), ""),
+    (re.compile(r"\bINTEGER PRIMARY KEY AUTOINCREMENT\b", re.I), "BIGSERIAL PRIMARY KEY"),
+    (re.compile(r"\bINTEGER\b", re.I), "BIGINT"),
+    (re.compile(r"\bREAL\b", re.I), "DOUBLE PRECISION"),
+    # Timestamps are written as ISO strings by the app, keep them as text like SQLite does
+    (re.compile(r"\bTIMESTAMP\b", re.I), "TEXT"),
+)
+
+
+# Rewrite SQLite-flavoured SQL for psycopg2; cached so each statement shape is translated once
+@lru_cache(maxsize=1024)
+def _to_postgres(sql):
+    if sql.lstrip().upper().startswith("CREATE TABLE"):
+        for pattern, replacement in _DDL_REWRITES:
+            sql = pattern.sub(replacement, sql)
+    return sql.replace("%", "%%").replace("?", "%s")
+
+
+# psycopg2 cursor that accepts "?" placeholders
+class _PostgresCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(_to_postgres(sql), params)
+        return self
+
+    def executemany(self, sql, seq):
+        self._cursor.executemany(_to_postgres(sql), seq)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+# Cursor wrapper that reports (sql, seconds) for every statement to the database's listeners
+class _TracedCursor:
+    def __init__(self, cursor, listeners):
+        self._cursor = cursor
+        self._listeners = listeners
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(sql, params)
+        finally:
+            self._report(sql, started)
+        return self
+
+    def executemany(self, sql, seq):
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq)
+        finally:
+            self._report(sql, started)
+        return self
+
+    def _report(self, sql, started):
+        elapsed = time.perf_counter() - started
+        for listener in self._listeners:
+            listener(sql, elapsed)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+# Database access layer. SQLite gets one connection per thread (WAL, tuned pragmas,
+# statement cache); PostgreSQL goes through a SQLAlchemy connection pool.
+# Both expose the same API and accept "?" placeholders.
+class Database:
+    def __init__(self, path="bot.db", url=None, pool_size=5):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._engine = None
+        # Called with (sql, seconds) after every statement; used by metrics and the benchmark
+        self.listeners = []
+        if url and not url.startswith("sqlite"):
+            from sqlalchemy import create_engine
+            if url.startswith("postgres://"):
+                url = "postgresql://" + url[len("postgres://"):]
+            self._engine = create_engine(url, pool_size=pool_size, max_overflow=pool_size, pool_pre_ping=True)
+            self.dialect = "postgresql"
+        else:
+            self.dialect = "sqlite"
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv("SQLITE_PATH", "bot.db"), os.getenv("DATABASE_URL"), int(os.getenv("DB_POOL_SIZE", "5")))
+
+    def _sqlite_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=5, check_same_thread=False,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+            for pragma in SQLITE_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _trace(self, cursor):
+        return _TracedCursor(cursor, self.listeners) if self.listeners else cursor
+
+    # Yields a cursor inside a transaction: commit on success, rollback on error.
+    # Nested calls on the same thread join the outer transaction.
+    @contextmanager
+    def transaction(self):
+        cursor = getattr(self._local, "tx_cursor", None)
+        if cursor is not None:
+            yield cursor
+            return
+        if self._engine is not None:
+            conn = self._engine.raw_connection()
+            cursor = self._trace(_PostgresCursor(conn.cursor()))
+            self._local.tx_cursor = cursor
+            try:
+                yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self._local.tx_cursor = None
+                cursor.close()
+                conn.close()
+            return
+        conn = self._sqlite_connection()
+        cursor = self._trace(conn.cursor())
+        cursor.execute("BEGIN IMMEDIATE")
+        self._local.tx_cursor = cursor
+        try:
+            yield cursor
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            self._local.tx_cursor = None
+            cursor.close()
+
+    # Single statements outside an explicit transaction run in autocommit mode
+    @contextmanager
+    def _cursor(self):
+        cursor = getattr(self._local, "tx_cursor", None)
+        if cursor is not None:
+            yield cursor
+        elif self._engine is not None:
+            with self.transaction() as cursor:
+                yield cursor
+        else:
+            cursor = self._trace(self._sqlite_connection().cursor())
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def execute(self, sql, params=()):
+        with self._cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def executemany(self, sql, seq):
+        with self._cursor() as cursor:
+            cursor.executemany(sql, seq)
+            return cursor.rowcount
+
+    def fetchone(self, sql, params=()):
+        with self._cursor() as cursor:
+            return cursor.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        with self._cursor() as cursor:
+            return cursor.execute(sql, params).fetchall()
+
+    # First column of the first row, or `default` when there is no row
+    def fetchval(self, sql, params=(), default=None):
+        row = self.fetchone(sql, params)
+        return row[0] if row else default
+
+    # Stream rows in chunks without loading the whole result set
+    def iterate(self, sql, params=(), size=500):
+        with self._cursor() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    return
+                yield from rows
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.error(f"Error closing database connection: {e}")
+            self._connections = []
+        self._local = threading.local()
+        if self._engine is not None:
+            self._engine.dispose()
@@ -0,0 +1,99 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+# Pick the key used to shard an update so that everything from one chat lands on the same worker
+def update_shard_key(update):
+    for attr in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        msg = getattr(update, attr, None)
+        if msg is not None:
+            return msg.chat.id
+    callback = getattr(update, "callback_query", None)
+    if callback is not None:
+        if callback.message is not None:
+            return callback.message.chat.id
+        return callback.from_user.id
+    for attr in ("inline_query", "chosen_inline_result", "pre_checkout_query", "shipping_query"):
+        query = getattr(update, attr, None)
+        if query is not None:
+            return query.from_user.id
+    return update.update_id
+
+
+# Bounded worker pool that drains Telegram updates off the event loop.
+# Each worker owns one queue and a chat is always routed to the same queue,
+# so updates from one chat are processed in the order they arrived.
+class UpdateDispatcher:
+    def __init__(self, process, workers=4, max_queue=1000):
+        self._process = process
+        self._workers = max(1, workers)
+        per_worker = max(1, max_queue // self._workers)
+        self._queues = [queue.Queue(maxsize=per_worker) for _ in range(self._workers)]
+        self._threads = []
+        self._running = False
+        self._accepting = False
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def accepting(self):
+        return self._accepting
+
+    # Queue updates before the workers run (e.g. while caches warm up); start() drains them
+    def accept(self):
+        self._accepting = True
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._accepting = True
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(q,), name=f"update-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Update dispatcher started with {self._workers} workers")
+
+    # Returns False when the target queue is full or the dispatcher is not accepting updates
+    def submit(self, update, key):
+        if not self._accepting:
+            return False
+        try:
+            self._queues[key % self._workers].put_nowait(update)
+        except queue.Full:
+            return False
+        return True
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def stop(self, timeout=10.0):
+        self._accepting = False
+        if not self._running:
+            return
+        self._running = False
+        for q in self._queues:
+            q.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        logger.info("Update dispatcher stopped")
+
+    def _run(self, q):
+        while True:
+            update = q.get()
+            try:
+                if update is _STOP:
+                    return
+                self._process([update])
+            except Exception as e:
+                logger.error(f"Error processing update {getattr(update, 'update_id', '?')}: {e}")
+            finally:
+                q.task_done()
@@ -0,0 +1,165 @@
+import logging
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+
+from rate_limiter import MemoryRateLimiter, RateLimit
+
+logger = logging.getLogger(__name__)
+
+ALLOWED = "allowed"
+MUTED = "muted"
+USER_FLOOD = "user"
+CHAT_FLOOD = "chat"
+DUPLICATE = "duplicate"
+
+
+# Mute lengths in seconds for the 1st, 2nd, ... strike; "30,300,1800"
+def parse_mutes(spec):
+    return tuple(float(item) for item in (spec or "").split(",") if item.strip()) or (30.0,)
+
+
+# What Telegram marks as a bot_command entity at the start of a message: /name or /name@bot
+_COMMAND = re.compile(r"/[A-Za-z0-9_]{1,64}(@\w+)?(\s|$)")
+
+
+# Hash of a message for the duplicate rule; None for bot commands, which users legitimately
+# repeat and which have their own per-command limits
+def _text_key(text):
+    if not text or _COMMAND.match(text):
+        return None
+    return hash(" ".join(text.lower().split()))
+
+
+# Pre-dispatch flood filter: decides on every incoming message from in-memory state only,
+# before any handler or SQL runs. Messages are counted per user and per chat in sliding
+# windows, repeated texts (bot commands aside) are spotted by the hashes of each user's recent messages, and every
+# violation is a strike that mutes the user for the next, longer step of `mutes`. Dropped
+# messages are counted and written to spam_logs as one row per user every `log_interval`
+# seconds, through the write-behind buffer; check() never writes itself, logs_due() tells
+# the caller when to call flush_logs() from somewhere that may block.
+class FloodFilter:
+    def __init__(self, writes=None, user_limit=RateLimit(20, 10), chat_limit=RateLimit(60, 10),
+                 duplicate_limit=RateLimit(4, 60), mutes=(30, 300, 1800, 7200), strike_ttl=86400,
+                 log_interval=60, history=8, exempt=()):
+        self._writes = writes
+        self.user_limit = user_limit
+        self.chat_limit = chat_limit
+        self.duplicate_limit = duplicate_limit
+        self.mutes = tuple(mutes)
+        self.strike_ttl = strike_ttl
+        self.log_interval = log_interval
+        self.exempt = set(exempt)
+        self._counters = MemoryRateLimiter()
+        # user_id -> recent (text hash, time)
+        self._recent = defaultdict(lambda: deque(maxlen=history))
+        # user_id -> (strikes, time of last strike)
+        self._strikes = {}
+        # user_id -> muted until
+        self._muted = {}
+        # user_id -> messages dropped since the last spam_logs write
+        self._dropped = defaultdict(int)
+        self._lock = threading.Lock()
+        self._logged = time.time()
+        self._checks = 0
+        self.dropped = defaultdict(int)
+
+    # Returns (verdict, mute seconds); the mute is non-zero only for the message that caused it
+    def check(self, user_id, chat_id, text=None, now=None):
+        if user_id in self.exempt:
+            return ALLOWED, 0
+        now = time.time() if now is None else now
+        with self._lock:
+            verdict, mute = self._check(user_id, chat_id, text, now)
+            if verdict != ALLOWED:
+                self._dropped[user_id] += 1
+                self.dropped[verdict] += 1
+            self._checks += 1
+            if self._checks % 10000 == 0:
+                self._sweep(now)
+        return verdict, mute
+
+    # True for one caller once every `log_interval`; that caller then runs flush_logs()
+    def logs_due(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            if now - self._logged < self.log_interval:
+                return False
+            self._logged = now
+            return True
+
+    def _check(self, user_id, chat_id, text, now):
+        until = self._muted.get(user_id)
+        if until is not None:
+            if until > now:
+                return MUTED, 0
+            del self._muted[user_id]
+        key = _text_key(text)
+        if key is not None:
+            recent = self._recent[user_id]
+            recent.append((key, now))
+            repeats = sum(1 for other, seen in recent if other == key and now - seen < self.duplicate_limit.period)
+            if repeats > self.duplicate_limit.limit:
+                return DUPLICATE, self._strike(user_id, now)
+        if not self._counters.hit(("user", user_id), self.user_limit.limit, self.user_limit.period, now)[0]:
+            return USER_FLOOD, self._strike(user_id, now)
+        if chat_id != user_id and not self._counters.hit(("chat", chat_id), self.chat_limit.limit, self.chat_limit.period, now)[0]:
+            # A busy group isn't the sender's fault unless they are flooding too; drop without a strike
+            return CHAT_FLOOD, 0
+        return ALLOWED, 0
+
+    # Take back an allowed message that was not processed (a redelivery, or rejected with a
+    # 429 that Telegram will retry), so it isn't counted twice
+    def refund(self, user_id, chat_id, text=None, now=None):
+        if user_id in self.exempt:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            key = _text_key(text)
+            if key is not None:
+                recent = self._recent.get(user_id)
+                for i in range(len(recent or ()) - 1, -1, -1):
+                    if recent[i][0] == key:
+                        del recent[i]
+                        break
+        self._counters.unhit(("user", user_id), now)
+        if chat_id != user_id:
+            self._counters.unhit(("chat", chat_id), now)
+
+    def _strike(self, user_id, now):
+        strikes, last = self._strikes.get(user_id, (0, now))
+        strikes = 1 if now - last > self.strike_ttl else strikes + 1
+        self._strikes[user_id] = (strikes, now)
+        mute = self.mutes[min(strikes, len(self.mutes)) - 1]
+        self._muted[user_id] = now + mute
+        logger.warning(f"Muted user {user_id} for {mute:.0f}s (strike {strikes})")
+        return mute
+
+    def is_muted(self, user_id, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._muted.get(user_id, 0) > now
+
+    # One spam_logs row per user with the number of messages dropped since the last write
+    def flush_logs(self, now=None):
+        with self._lock:
+            dropped, self._dropped = self._dropped, defaultdict(int)
+            self._logged = time.time() if now is None else now
+        if not dropped or self._writes is None:
+            return
+        created_at = datetime.now().isoformat()
+        for user_id, count in dropped.items():
+            self._writes.record(user_id, table="spam_logs", row={"user_id": user_id, "count": count, "created_at": created_at})
+        logger.info(f"Logged {sum(dropped.values())} dropped messages from {len(dropped)} users")
+
+    # Forget users whose state can no longer affect a decision
+    def _sweep(self, now):
+        window = self.duplicate_limit.period
+        for user_id in [u for u, recent in self._recent.items() if not recent or now - recent[-1][1] >= window]:
+            del self._recent[user_id]
+        for user_id in [u for u, (_, last) in self._strikes.items() if now - last > self.strike_ttl]:
+            del self._strikes[user_id]
+        for user_id in [u for u, until in self._muted.items() if until <= now]:
+            del self._muted[user_id]
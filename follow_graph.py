@@ -0,0 +1,121 @@
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MAX_PAGE = 100
+
+
+# Follow graph on the follows table. Counters in social_profiles only move when an edge
+# actually changes, and listings use keyset pagination on user ids so deep pages cost
+# the same as the first one.
+class FollowGraph:
+    def __init__(self, db):
+        self._db = db
+
+    # True when a new edge was created, False when it already existed, None when followed_id
+    # isn't a registered user (so no profile is made up for an arbitrary id)
+    def follow(self, follower_id, followed_id):
+        with self._db.transaction() as cur:
+            if cur.execute("SELECT 1 FROM users WHERE user_id = ?", (followed_id,)).fetchone() is None:
+                return None
+            cur.execute("INSERT INTO follows (follower_id, followed_id, created_at) VALUES (?,?,?) ON CONFLICT DO NOTHING",
+                        (follower_id, followed_id, datetime.now().isoformat()))
+            if cur.rowcount != 1:
+                return False
+            cur.execute("INSERT INTO social_profiles (user_id, followers) VALUES (?, 1) "
+                        "ON CONFLICT(user_id) DO UPDATE SET followers = social_profiles.followers + 1", (followed_id,))
+        return True
+
+    # True when an existing edge was removed
+    def unfollow(self, follower_id, followed_id):
+        with self._db.transaction() as cur:
+            cur.execute("DELETE FROM follows WHERE follower_id = ? AND followed_id = ?", (follower_id, followed_id))
+            if cur.rowcount != 1:
+                return False
+            cur.execute("UPDATE social_profiles SET followers = MAX(followers - 1, 0) WHERE user_id = ?"
+                        if self._db.dialect == "sqlite" else
+                        "UPDATE social_profiles SET followers = GREATEST(followers - 1, 0) WHERE user_id = ?", (followed_id,))
+        return True
+
+    def is_following(self, follower_id, followed_id):
+        return self._db.fetchone("SELECT 1 FROM follows WHERE follower_id = ? AND followed_id = ?", (follower_id, followed_id)) is not None
+
+    # (followers, following); followers is the maintained counter, following is counted on
+    # the primary key prefix
+    def counts(self, user_id):
+        followers = self._db.fetchval("SELECT followers FROM social_profiles WHERE user_id = ?", (user_id,), 0) or 0
+        following = self._db.fetchval("SELECT COUNT(*) FROM follows WHERE follower_id = ?", (user_id,), 0)
+        return followers, following
+
+    # Pages return (user_ids, next_cursor); pass next_cursor back as `after` for the next page
+    def followers(self, user_id, limit=20, after=None):
+        return self._page("SELECT follower_id FROM follows WHERE followed_id = ? AND follower_id > ? ORDER BY follower_id LIMIT ?",
+                          user_id, limit, after)
+
+    def following(self, user_id, limit=20, after=None):
+        return self._page("SELECT followed_id FROM follows WHERE follower_id = ? AND followed_id > ? ORDER BY followed_id LIMIT ?",
+                          user_id, limit, after)
+
+    # Users that `user_id` follows and who follow back
+    def mutuals(self, user_id, limit=20, after=None):
+        return self._page("SELECT f.followed_id FROM follows f "
+                          "JOIN follows g ON g.follower_id = f.followed_id AND g.followed_id = f.follower_id "
+                          "WHERE f.follower_id = ? AND f.followed_id > ? ORDER BY f.followed_id LIMIT ?",
+                          user_id, limit, after)
+
+    # People `viewer_id` follows who also follow `target_id` ("followed by ...")
+    def followed_by_followees(self, viewer_id, target_id, limit=3):
+        rows = self._db.fetchall("SELECT f.followed_id FROM follows f "
+                                 "JOIN follows g ON g.follower_id = f.followed_id AND g.followed_id = ? "
+                                 "WHERE f.follower_id = ? ORDER BY f.followed_id LIMIT ?",
+                                 (target_id, viewer_id, limit))
+        return [row[0] for row in rows]
+
+    # Recompute follower counters from the edges, `batch` profiles per transaction.
+    # With no user_ids every social profile is reconciled.
+    def reconcile(self, user_ids=None, batch=500):
+        fixed = 0
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            chunks = (user_ids[i:i + batch] for i in range(0, len(user_ids), batch))
+        else:
+            chunks = self._profile_chunks(batch)
+        for chunk in chunks:
+            placeholders = ",".join("?" * len(chunk))
+            with self._db.transaction() as cur:
+                cur.execute(f"UPDATE social_profiles SET followers = (SELECT COUNT(*) FROM follows WHERE followed_id = social_profiles.user_id) "
+                            f"WHERE user_id IN ({placeholders}) AND followers <> (SELECT COUNT(*) FROM follows WHERE followed_id = social_profiles.user_id)",
+                            tuple(chunk))
+                fixed += max(cur.rowcount, 0)
+        if fixed:
+            logger.info(f"Reconciled follower counters for {fixed} profiles")
+        return fixed
+
+    def _profile_chunks(self, batch):
+        after = None
+        while True:
+            if after is None:
+                rows = self._db.fetchall("SELECT user_id FROM social_profiles ORDER BY user_id LIMIT ?", (batch,))
+            else:
+                rows = self._db.fetchall("SELECT user_id FROM social_profiles WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, batch))
+            if not rows:
+                return
+            chunk = [row[0] for row in rows]
+            after = chunk[-1]
+            yield chunk
+
+    def _page(self, sql, user_id, limit, after):
+        limit = max(1, min(limit, MAX_PAGE))
+        # Telegram ids can be negative (groups), so start below any of them
+        rows = self._db.fetchall(sql, (user_id, -(1 << 62) if after is None else after, limit + 1))
+        ids = [row[0] for row in rows[:limit]]
+        return ids, (ids[-1] if len(rows) > limit else None)
+
+
+if __name__ == "__main__":
+    from db import Database
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = Database.from_env()
+    FollowGraph(db).reconcile()
+    db.close()
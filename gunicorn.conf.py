@@ -0,0 +1,37 @@
+# gunicorn -c gunicorn.conf.py main:app
+# Each worker is a full copy of the app (its own caches, write-behind buffer and dispatcher).
+# With more than one worker, updates are sharded by chat id through the shared state backend
+# and cache changes are fanned out to the other workers (see cluster.py).
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Workers build their state after the fork; nothing useful can be shared before it
+preload_app = False
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+# Long enough for the write-behind buffer and outbox to drain on shutdown
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Inherited by the workers: one shard per worker, and several processes need shared state
+os.environ.setdefault("CLUSTER_SHARDS", str(workers))
+if workers > 1:
+    os.environ.setdefault("STATE_BACKEND", "sqlite")
+
+# OUTBOX_GLOBAL_RATE and OPENAI_MAX_CONCURRENCY are budgets for the whole deployment, but every
+# worker runs its own outbox and LLM client; give each worker its share. The totals are kept
+# aside so a config reload doesn't divide them again.
+os.environ.setdefault("OUTBOX_GLOBAL_RATE_TOTAL", os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+os.environ.setdefault("OPENAI_MAX_CONCURRENCY_TOTAL", os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+os.environ["OUTBOX_GLOBAL_RATE"] = str(float(os.environ["OUTBOX_GLOBAL_RATE_TOTAL"]) / workers)
+os.environ["OPENAI_MAX_CONCURRENCY"] = str(max(1, int(os.environ["OPENAI_MAX_CONCURRENCY_TOTAL"]) // workers))
+
+
+def on_starting(server):
+    if workers > 1 and os.environ.get("STATE_BACKEND") == "memory":
+        raise RuntimeError("STATE_BACKEND=memory only works with a single worker")
+    server.log.info(f"Starting {workers} workers, {os.environ['CLUSTER_SHARDS']} shards, "
+                    f"state backend {os.environ.get('STATE_BACKEND', 'memory')}; per worker: "
+                    f"{os.environ['OUTBOX_GLOBAL_RATE']} msg/s, {os.environ['OPENAI_MAX_CONCURRENCY']} LLM requests")
@@ -0,0 +1,45 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Bounded LRU of users already present in the users table, with the names we stored for them.
+# Lets register_user skip SQL entirely for returning users whose names haven't changed.
+class KnownUsers:
+    def __init__(self, capacity=50000):
+        self.capacity = capacity
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users)
+
+    # Load the most recently active users
+    def warm(self, db):
+        rows = db.fetchall("SELECT user_id, username, first_name FROM users ORDER BY last_login DESC LIMIT ?", (self.capacity,))
+        with self._lock:
+            for user_id, username, first_name in reversed(rows):
+                self._users[user_id] = (username, first_name)
+        logger.info(f"Warmed known users with {len(rows)} entries")
+
+    # True when the user is known with exactly these names
+    def matches(self, user_id, username, first_name):
+        with self._lock:
+            names = self._users.get(user_id)
+            if names is None:
+                return False
+            self._users.move_to_end(user_id)
+            return names == (username, first_name)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def remember(self, user_id, username, first_name):
+        with self._lock:
+            self._users[user_id] = (username, first_name)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.capacity:
+                self._users.popitem(last=False)
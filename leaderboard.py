@@ -0,0 +1,157 @@
+import logging
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = ("all", "weekly")
+
+# Log tables whose credit column counts toward the weekly board
+_EARNINGS = (
+    ("dynamic_quizzes", "credits"),
+    ("crypto_hacks", "credits_earned"),
+    ("achievements", "credits"),
+)
+
+
+def week_start(now=None):
+    now = now or datetime.now()
+    return (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# Scores kept in a list sorted by (-score, user_id): lookups and slices are bisections,
+# inserts are a single memmove of the pointer array.
+class RankedSet:
+    def __init__(self):
+        self._order = []
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._order)
+
+    def set(self, user_id, score):
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old, user_id))]
+        self._scores[user_id] = score
+        insort(self._order, (-score, user_id))
+
+    def add(self, user_id, delta):
+        self.set(user_id, self._scores.get(user_id, 0) + delta)
+
+    def score(self, user_id):
+        return self._scores.get(user_id)
+
+    def top(self, n, offset=0):
+        return [(user_id, -neg) for neg, user_id in self._order[offset:offset + n]]
+
+    # 1-based rank, ties broken by user id
+    def rank_of(self, user_id):
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return bisect_left(self._order, (-score, user_id)) + 1
+
+    def clear(self):
+        self._order = []
+        self._scores = {}
+
+
+# In-memory leaderboard kept in step with every credit change
+class Leaderboard:
+    def __init__(self, db):
+        self._db = db
+        self._boards = {"all": RankedSet(), "weekly": RankedSet()}
+        self._names = {}
+        self._week = week_start()
+        self._lock = threading.Lock()
+        # Called with (method name, args) after every change, so other workers can replay it
+        self.listeners = []
+        self._replaying = threading.local()
+
+    def load(self):
+        boards = {"all": RankedSet(), "weekly": RankedSet()}
+        names = {}
+        for user_id, username, credits in self._db.iterate("SELECT user_id, username, credits FROM users"):
+            boards["all"].set(user_id, credits or 0)
+            names[user_id] = username
+        week = week_start()
+        for table, column in _EARNINGS:
+            rows = self._db.fetchall(f"SELECT user_id, SUM({column}) FROM {table} WHERE created_at >= ? GROUP BY user_id", (week.isoformat(),))
+            for user_id, earned in rows:
+                boards["weekly"].add(user_id, earned or 0)
+        with self._lock:
+            self._boards, self._names, self._week = boards, names, week
+        logger.info(f"Leaderboard loaded with {len(boards['all'])} users")
+
+    # `earned` deltas also count toward the weekly board; spending only lowers the all-time balance
+    def apply_delta(self, user_id, delta, earned=True):
+        with self._lock:
+            self._roll_week()
+            self._boards["all"].add(user_id, delta)
+            if earned and delta > 0:
+                self._boards["weekly"].add(user_id, delta)
+        self._notify("apply_delta", user_id, delta, earned)
+
+    # Take back earned credits that turned out to be a duplicate grant
+    def revoke(self, user_id, credits):
+        with self._lock:
+            self._boards["all"].add(user_id, -credits)
+            if self._boards["weekly"].score(user_id) is not None:
+                self._boards["weekly"].add(user_id, -credits)
+        self._notify("revoke", user_id, credits)
+
+    def set_user(self, user_id, username):
+        with self._lock:
+            if self._names.get(user_id) == username and self._boards["all"].score(user_id) is not None:
+                return
+            self._names[user_id] = username
+            if self._boards["all"].score(user_id) is None:
+                self._boards["all"].set(user_id, 0)
+        self._notify("set_user", user_id, username)
+
+    # Apply a change another worker made, without notifying the listeners again
+    def replay(self, method, args):
+        if method not in ("apply_delta", "revoke", "set_user"):
+            raise ValueError(f"Unknown leaderboard change {method}")
+        self._replaying.active = True
+        try:
+            getattr(self, method)(*args)
+        finally:
+            self._replaying.active = False
+
+    def _notify(self, method, *args):
+        if self.listeners and not getattr(self._replaying, "active", False):
+            for listener in self.listeners:
+                listener(method, args)
+
+    def top(self, n=5, offset=0, window="all"):
+        with self._lock:
+            self._roll_week()
+            return [(user_id, self._names.get(user_id), score) for user_id, score in self._boards[window].top(n, offset)]
+
+    # Live all-time balance, including credits not yet flushed to the database
+    def score(self, user_id):
+        with self._lock:
+            return self._boards["all"].score(user_id)
+
+    # (rank, score) or None when the user isn't on the board
+    def rank_of(self, user_id, window="all"):
+        with self._lock:
+            self._roll_week()
+            board = self._boards[window]
+            rank = board.rank_of(user_id)
+            return (rank, board.score(user_id)) if rank else None
+
+    def size(self, window="all"):
+        with self._lock:
+            return len(self._boards[window])
+
+    def _roll_week(self):
+        week = week_start()
+        if week != self._week:
+            self._week = week
+            self._boards["weekly"].clear()
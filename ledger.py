@@ -0,0 +1,138 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+APPLIED = "applied"
+DUPLICATE = "duplicate"
+INSUFFICIENT = "insufficient"
+
+
+# Every credit change is a row in credit_ledger and an atomic update of users.credits in the
+# same transaction. (reason, ref) is unique, so a grant or debit tied to a ref (a message
+# key, an order id, ...) can only ever apply once. users.credits stays the fast read path;
+# verify()/rebuild() check it against the ledger.
+class Ledger:
+    def __init__(self, db):
+        self._db = db
+
+    # Returns (status, balance). Debits only apply while the balance covers them, so
+    # concurrent purchases can't overdraw; balance is None unless the delta applied.
+    # Joins the caller's transaction when there is one.
+    def apply(self, user_id, delta, reason, ref=None):
+        with self._db.transaction() as cur:
+            if delta < 0:
+                row = cur.execute("UPDATE users SET credits = credits + ? WHERE user_id = ? AND credits >= ? RETURNING credits",
+                                  (delta, user_id, -delta)).fetchone()
+            else:
+                row = cur.execute("UPDATE users SET credits = credits + ? WHERE user_id = ? RETURNING credits",
+                                  (delta, user_id)).fetchone()
+            if row is None:
+                return INSUFFICIENT, None
+            cur.execute("INSERT INTO credit_ledger (user_id, delta, reason, ref, created_at) VALUES (?,?,?,?,?) "
+                        "ON CONFLICT(reason, ref) DO NOTHING",
+                        (user_id, delta, reason, ref, datetime.now().isoformat()))
+            if cur.rowcount != 1:
+                # Already applied; undo the update within the same transaction
+                cur.execute("UPDATE users SET credits = credits - ? WHERE user_id = ?", (delta, user_id))
+                return DUPLICATE, None
+            return APPLIED, row[0]
+
+    # Batched grants [(user_id, delta, reason, ref)] inside the caller's transaction (or a new
+    # one): one ledger row each, one users update per user. Returns the grants skipped as duplicates.
+    def grant_many(self, grants, cur=None):
+        if cur is None:
+            with self._db.transaction() as cur:
+                return self.grant_many(grants, cur)
+        now = datetime.now().isoformat()
+        sql = "INSERT INTO credit_ledger (user_id, delta, reason, ref, created_at) VALUES (?,?,?,?,?)"
+        skipped = []
+        unkeyed = []
+        for grant in grants:
+            user_id, delta, reason, ref = grant
+            if ref is None:
+                unkeyed.append((user_id, delta, reason, None, now))
+                continue
+            cur.execute(sql + " ON CONFLICT(reason, ref) DO NOTHING", (user_id, delta, reason, ref, now))
+            if cur.rowcount != 1:
+                skipped.append(grant)
+        if unkeyed:
+            cur.executemany(sql, unkeyed)
+        totals = defaultdict(int)
+        for user_id, delta, _, _ in grants:
+            totals[user_id] += delta
+        for user_id, delta, _, _ in skipped:
+            totals[user_id] -= delta
+        deltas = [(delta, user_id) for user_id, delta in totals.items() if delta]
+        if deltas:
+            cur.executemany("UPDATE users SET credits = credits + ? WHERE user_id = ?", deltas)
+        return skipped
+
+    def history(self, user_id, limit=20):
+        return self._db.fetchall("SELECT delta, reason, ref, created_at FROM credit_ledger WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                                 (user_id, limit))
+
+    # [(user_id, users.credits, ledger total)] for every user whose balance disagrees with the ledger
+    def verify(self, batch=1000):
+        mismatches = []
+        for chunk in self._user_chunks(batch):
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._db.fetchall(f"SELECT u.user_id, u.credits, COALESCE(SUM(l.delta), 0) FROM users u "
+                                     f"LEFT JOIN credit_ledger l ON l.user_id = u.user_id "
+                                     f"WHERE u.user_id IN ({placeholders}) GROUP BY u.user_id, u.credits", tuple(chunk))
+            mismatches.extend((user_id, credits or 0, total) for user_id, credits, total in rows if (credits or 0) != total)
+        return mismatches
+
+    # Reset users.credits to the ledger totals. Run offline: buffered grants that are not
+    # flushed yet are in neither table.
+    def rebuild(self, batch=1000):
+        fixed = 0
+        for chunk in self._user_chunks(batch):
+            placeholders = ",".join("?" * len(chunk))
+            with self._db.transaction() as cur:
+                cur.execute(f"UPDATE users SET credits = (SELECT COALESCE(SUM(delta), 0) FROM credit_ledger WHERE user_id = users.user_id) "
+                            f"WHERE user_id IN ({placeholders}) "
+                            f"AND COALESCE(credits, 0) <> (SELECT COALESCE(SUM(delta), 0) FROM credit_ledger WHERE user_id = users.user_id)",
+                            tuple(chunk))
+                fixed += max(cur.rowcount, 0)
+        logger.info(f"Rebuilt credits for {fixed} users from the ledger")
+        return fixed
+
+    # One "opening" entry per user for the balance they had before the ledger existed
+    def open_balances(self):
+        with self._db.transaction() as cur:
+            cur.execute("INSERT INTO credit_ledger (user_id, delta, reason, ref, created_at) "
+                        "SELECT user_id, credits, 'opening', CAST(user_id AS TEXT), ? FROM users WHERE credits <> 0 "
+                        "ON CONFLICT(reason, ref) DO NOTHING", (datetime.now().isoformat(),))
+            opened = max(cur.rowcount, 0)
+        logger.info(f"Opened ledger balances for {opened} users")
+        return opened
+
+    def _user_chunks(self, batch):
+        after = -(1 << 62)
+        while True:
+            rows = self._db.fetchall("SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, batch))
+            if not rows:
+                return
+            chunk = [row[0] for row in rows]
+            after = chunk[-1]
+            yield chunk
+
+
+if __name__ == "__main__":
+    import sys
+    from db import Database
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = Database.from_env()
+    ledger = Ledger(db)
+    if "--rebuild" in sys.argv:
+        ledger.rebuild()
+    else:
+        mismatches = ledger.verify()
+        for user_id, credits, total in mismatches[:100]:
+            logger.warning(f"User {user_id}: users.credits={credits}, ledger={total}")
+        logger.info(f"{len(mismatches)} balances disagree with the ledger")
+        db.close()
+        sys.exit(1 if mismatches else 0)
+    db.close()
@@ -0,0 +1,99 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single worker, which is always the leader
+    fcntl = None
+
+
+# Non-blocking exclusive lock on `path`; the returned file keeps it held until closed.
+# None when another process on this host holds it.
+def acquire_lock(path):
+    handle = open(path, "a+")
+    if fcntl is None:
+        return handle
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+# Register the webhook only when Telegram has a different URL; True when it was changed
+def ensure_webhook(bot, url):
+    if not url:
+        logger.warning("WEBHOOK_URL is not set, leaving the webhook alone")
+        return False
+    info = bot.get_webhook_info()
+    if info.url == url:
+        logger.info(f"Webhook already set to {url}")
+        return False
+    bot.set_webhook(url=url)
+    logger.info(f"Webhook set to {url} (was {info.url or 'unset'})")
+    return True
+
+
+# Process startup in two phases: the caller does the cheap, required work inline, then
+# warm() runs the slow steps on a background thread so the server can bind its port at
+# once. One worker per host wins the leader lock and also runs the leader-only steps
+# (webhook registration, maintenance jobs).
+class Lifecycle:
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self.ready = threading.Event()
+        self.steps = {}
+        self.errors = {}
+        self._lock_handle = None
+        self._thread = None
+
+    @property
+    def leader(self):
+        return self._lock_handle is not None
+
+    def elect(self):
+        if self._lock_handle is None:
+            self._lock_handle = acquire_lock(self.lock_path)
+        logger.info(f"Worker {os.getpid()} is {'the leader' if self.leader else 'a follower'}")
+        return self.leader
+
+    # Run (name, function, leader_only) steps in order on a background thread, then set ready.
+    # A failing step is logged and recorded but doesn't stop the others.
+    def warm(self, steps):
+        self.ready.clear()
+
+        def run():
+            started = time.monotonic()
+            for name, function, leader_only in steps:
+                if leader_only and not self.leader:
+                    continue
+                step_started = time.monotonic()
+                try:
+                    function()
+                except Exception as e:
+                    self.errors[name] = str(e)
+                    logger.error(f"Startup step {name} failed: {e}")
+                self.steps[name] = round(time.monotonic() - step_started, 3)
+            self.ready.set()
+            logger.info(f"Ready after {time.monotonic() - started:.2f}s of warmup: {self.steps}")
+
+        self._thread = threading.Thread(target=run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def status(self):
+        return {"ready": self.ready.is_set(), "leader": self.leader, "pid": os.getpid(),
+                "steps": dict(self.steps), "errors": dict(self.errors)}
+
+    def stop(self, timeout=10.0):
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.ready.clear()
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    pass
+
+
+# Async OpenAI chat client sharing one pooled keep-alive connection set.
+# A semaphore caps concurrent requests so bursts queue here instead of at the API.
+class AsyncLLMClient:
+    def __init__(self, api_key, base_url="https://api.openai.com/v1", model="gpt-4o-mini",
+                 timeout=20.0, max_concurrency=8, max_retries=3, max_connections=20):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_retries = max_retries
+        self._timeout = httpx.Timeout(timeout, connect=min(5.0, timeout))
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = None
+        # Called with (method, seconds, ok) after every HTTP attempt
+        self.listeners = []
+
+    # Created lazily so it binds to the loop that actually uses it
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+                timeout=self._timeout,
+                limits=self._limits,
+            )
+        return self._client
+
+    async def chat(self, messages, **options):
+        payload = {"model": self.model, "messages": messages, **options}
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                started = time.perf_counter()
+                try:
+                    response = await self._get_client().post("/chat/completions", json=payload)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    self._report(started, False)
+                    if attempt >= self.max_retries:
+                        raise LLMError(f"OpenAI request failed: {e}") from e
+                    delay = self._backoff(attempt)
+                else:
+                    self._report(started, response.status_code < 400)
+                    if response.status_code not in RETRYABLE_STATUS:
+                        if response.status_code >= 400:
+                            raise LLMError(f"OpenAI returned {response.status_code}: {response.text[:200]}")
+                        return response.json()["choices"][0]["message"]["content"]
+                    if attempt >= self.max_retries:
+                        raise LLMError(f"OpenAI returned {response.status_code} after {attempt + 1} attempts")
+                    delay = self._retry_after(response) or self._backoff(attempt)
+                logger.warning(f"OpenAI request failed (attempt {attempt + 1}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    def _report(self, started, ok):
+        elapsed = time.perf_counter() - started
+        for listener in self.listeners:
+            listener("chat/completions", elapsed, ok)
+
+    # Exponential backoff with full jitter, capped at 10s
+    def _backoff(self, attempt):
+        return random.uniform(0, min(10.0, 0.5 * 2 ** attempt))
+
+    def _retry_after(self, response):
+        try:
+            return min(30.0, float(response.headers.get("retry-after", "")))
+        except ValueError:
+            return None
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Runs an event loop on a background thread so synchronous telebot handlers can await the async client
+class LLMBridge:
+    def __init__(self, client):
+        self.client = client
+        self._loop = None
+        self._thread = None
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-loop", daemon=True)
+        self._thread.start()
+
+    # Schedule a coroutine without waiting for it
+    def submit(self, coro):
+        if self._loop is None:
+            coro.close()
+            raise LLMError("LLM bridge is not running")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    # Block the calling thread until the coroutine finishes
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+    def stop(self, timeout=5.0):
+        if self._thread is None:
+            return
+        try:
+            self.run(self.client.close(), timeout)
+        except Exception as e:
+            logger.error(f"Error closing LLM client: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._loop.close()
+        self._loop = None
+        self._thread = None
@@ -1,15 +1,39 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import BackgroundTasks, FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 import telebot
 import os
 from dotenv import load_dotenv
-import requests
 import json
 import random
 import time
 from datetime import datetime, timedelta
 import logging
-import sqlite3
+import tempfile
+from contextlib import asynccontextmanager
+from functools import partial
+from db import Database
+from migrations import check_query_plans, run_migrations, schema_is_current
+from lifecycle import Lifecycle, ensure_webhook
+from dispatcher import UpdateDispatcher, update_shard_key
+from llm_client import AsyncLLMClient, LLMBridge
+from quiz_pool import QuizPool
+from rate_limiter import MemoryRateLimiter, RateLimiter, RedisRateLimiter, SQLiteRateLimiter, parse_limits
+from write_behind import WriteBehindBuffer
+from leaderboard import WINDOWS, Leaderboard
+from profile_cache import ProfileCache
+from known_users import KnownUsers
+from follow_graph import FollowGraph
+from outbox import Outbox
+from retention import Retention, parse_policies
+from metrics import Metrics
+from update_dedup import UpdateDeduplicator, message_key
+from ledger import APPLIED, DUPLICATE, Ledger
+from achievements import AchievementEngine
+from shared_state import create_state
+from cluster import Cluster
+from flood_filter import ALLOWED, FloodFilter, parse_mutes
+from responses import FastJSONResponse, add_compression, conditional_json
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,56 +46,247 @@ ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID"))
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MINIAPP_URL = os.getenv("MINIAPP_URL")
+# "queue" acks updates immediately and processes them on worker threads, "inline" processes them in the request
+WEBHOOK_DISPATCH_MODE = os.getenv("WEBHOOK_DISPATCH_MODE","queue")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS","4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE","1000"))
+OPENAI_API_URL = os.getenv("OPENAI_API_URL","https://api.openai.com/v1")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL","gpt-4o-mini")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT","20"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY","8"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES","3"))
+QUIZ_POOL_LOW = int(os.getenv("QUIZ_POOL_LOW","3"))
+QUIZ_POOL_HIGH = int(os.getenv("QUIZ_POOL_HIGH","10"))
+# State shared between workers: "memory" for a single process, "sqlite" (the app database,
+# so PostgreSQL when DATABASE_URL is set) or "redis" for several processes or nodes
+STATE_BACKEND = os.getenv("STATE_BACKEND","memory")
+REDIS_URL = os.getenv("REDIS_URL","redis://localhost:6379/0")
+# Updates are sharded by chat id over this many workers (gunicorn.conf.py sets it to the worker count)
+CLUSTER_SHARDS = int(os.getenv("CLUSTER_SHARDS","1"))
+# "memory" for a single process, "sqlite" or "redis" to share counters between processes
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", STATE_BACKEND)
+# Per-command limits as "command=count/seconds,..."; unlisted commands get RATE_LIMIT_DEFAULT
+RATE_LIMITS = os.getenv("RATE_LIMITS","newquiz=5/3600,crypto=5/3600")
+RATE_LIMIT_DEFAULT = os.getenv("RATE_LIMIT_DEFAULT","5/3600")
+# "buffered" batches credit updates and activity logs, "sync" writes each one through immediately
+WRITE_BEHIND_MODE = os.getenv("WRITE_BEHIND_MODE","buffered")
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_INTERVAL_MS","500"))
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS","200"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE","10000"))
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL","300"))
+KNOWN_USERS_SIZE = int(os.getenv("KNOWN_USERS_SIZE","50000"))
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL","https://api.telegram.org")
+# "queue" sends replies through the rate-shaped outbox, "direct" calls the Bot API from the handler
+SEND_MODE = os.getenv("SEND_MODE","queue")
+OUTBOX_SENDERS = int(os.getenv("OUTBOX_SENDERS","4"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE","30"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE","1"))
+# Per-table retention overrides as "table=days,..."; 0 disables the periodic retention job
+RETENTION_DAYS = os.getenv("RETENTION_DAYS")
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS","6"))
+# Flood filter ahead of the handlers: "count/seconds" per user and per group chat, identical
+# texts per user, and escalating mute lengths in seconds. FLOOD_FILTER=off disables it.
+FLOOD_FILTER = os.getenv("FLOOD_FILTER","on")
+FLOOD_USER_LIMIT = os.getenv("FLOOD_USER_LIMIT","20/10")
+FLOOD_CHAT_LIMIT = os.getenv("FLOOD_CHAT_LIMIT","60/10")
+FLOOD_DUPLICATE_LIMIT = os.getenv("FLOOD_DUPLICATE_LIMIT","4/60")
+FLOOD_MUTES = os.getenv("FLOOD_MUTES","30,300,1800,7200")
+# Recently accepted update ids kept in memory for dropping Telegram redeliveries
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE","10000"))
+# Workers on one host compete for this lock; the winner registers the webhook and runs maintenance jobs
+LEADER_LOCK_PATH = os.getenv("LEADER_LOCK_PATH", os.path.join(tempfile.gettempdir(),"bot-leader.lock"))
+# Responses smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES","500"))
+
+# Startup and shutdown are start_app/stop_app below
+@asynccontextmanager
+async def lifespan(app):
+    start_app()
+    try:
+        yield
+    finally:
+        stop_app()
 
 # Initialize FastAPI and Telebot
-app = FastAPI()
-bot = telebot.TeleBot(BOT_TOKEN)
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+lifecycle = Lifecycle(LEADER_LOCK_PATH)
+telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip("/") +"/bot{0}/{1}"
+# In queue mode our own workers run the handlers, so telebot must not hand them to its thread pool
+bot = telebot.TeleBot(BOT_TOKEN, threaded=WEBHOOK_DISPATCH_MODE !="queue")
+dispatcher = UpdateDispatcher(bot.process_new_updates, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE) if WEBHOOK_DISPATCH_MODE =="queue" else None
+llm = LLMBridge(AsyncLLMClient(OPENAI_API_KEY, OPENAI_API_URL, OPENAI_MODEL, OPENAI_TIMEOUT, OPENAI_MAX_CONCURRENCY, OPENAI_MAX_RETRIES))
+
+# Database: SQLite (bot.db) by default, PostgreSQL when DATABASE_URL is set
+db = Database.from_env()
+writes = WriteBehindBuffer(db, WRITE_BEHIND_INTERVAL_MS / 1000, WRITE_BEHIND_MAX_ROWS, WRITE_BEHIND_MODE)
+leaderboard = Leaderboard(db)
+writes.listeners.append(leaderboard.apply_delta)
+profile_cache = ProfileCache(db, writes, PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+known_users = KnownUsers(KNOWN_USERS_SIZE)
+follow_graph = FollowGraph(db)
+retention = Retention(db, parse_policies(RETENTION_DAYS))
+# The leader recomputes drifted follower counters on every retention pass
+retention.jobs.append(("follower_counters", follow_graph.reconcile))
+state = create_state(STATE_BACKEND, db, REDIS_URL)
+cluster = Cluster(state, CLUSTER_SHARDS)
+dedup = UpdateDeduplicator(db, UPDATE_DEDUP_SIZE, state=state)
+writes.flush_listeners.append(dedup.save_if_due)
+ledger = Ledger(db)
+# Achievement counters start from the cached profile and the live leaderboard balance
+def achievement_state(user_id):
+    profile = profile_cache.get(user_id)
+    if profile is None:
+        return None
+    social = profile["social"]
+    counters = {"streak": profile["streak"] or 0,"quizzes": profile["quiz_count"],"credits": leaderboard.score(user_id) or 0,
+                "followers": social["followers"] if social else 0}
+    return counters, profile["achievements"]
+
+achievements = AchievementEngine(db, writes, achievement_state, capacity=PROFILE_CACHE_SIZE)
+
+# Multi-worker mode: the other workers replay leaderboard changes and drop their cached copies
+def drop_profile(user_id):
+    profile_cache.evict(user_id)
+    achievements.forget(user_id)
+
+leaderboard.listeners.append(partial(cluster.publish,"leaderboard"))
+cluster.subscribe("leaderboard", leaderboard.replay)
+profile_cache.listeners.append(partial(cluster.publish,"profile"))
+cluster.subscribe("profile", drop_profile)
+cluster.subscribe("known_user", known_users.forget)
+flood_filter = FloodFilter(
+    writes,
+    parse_limits(f"user={FLOOD_USER_LIMIT}")["user"],
+    parse_limits(f"chat={FLOOD_CHAT_LIMIT}")["chat"],
+    parse_limits(f"duplicate={FLOOD_DUPLICATE_LIMIT}")["duplicate"],
+    parse_mutes(FLOOD_MUTES),
+    exempt=(ADMIN_USER_ID,),
+) if FLOOD_FILTER !="off" else None
+outbox = Outbox(BOT_TOKEN, TELEGRAM_API_URL, OUTBOX_SENDERS, OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE) if SEND_MODE =="queue" else None
+
+# Metrics: SQL timings, outbound API latency and queue depths, scraped from /metrics
+metrics = Metrics()
+db.listeners.append(metrics.on_statement)
+llm.client.listeners.append(partial(metrics.on_upstream,"openai"))
+if outbox:
+    outbox.listeners.append(partial(metrics.on_upstream,"telegram"))
+metrics.instrument_telebot(telebot.apihelper)
+metrics.instrument_app(app)
+add_compression(app, COMPRESS_MIN_BYTES)
+duplicate_updates = metrics.counter("webhook_duplicate_updates_total","Redelivered updates dropped before processing")
+flood_dropped = metrics.counter("flood_dropped_total","Messages dropped by the flood filter", ("reason",))
+metrics.gauge("webhook_queue_depth","Updates waiting for a dispatcher worker", lambda: dispatcher.depth() if dispatcher else 0)
+metrics.gauge("outbox_queue_depth","Messages waiting for an outbox sender", lambda: outbox.depth() if outbox else 0)
+metrics.gauge("write_behind_pending","Buffered rows and credit updates not yet flushed", writes.depth)
+metrics.gauge("profile_cache_hits","Profile lookups served from the cache", lambda: profile_cache.hits)
+metrics.gauge("profile_cache_misses","Profile lookups that had to read the database", lambda: profile_cache.misses)
+metrics.gauge("profile_cache_evictions","Profiles dropped from the cache to stay within capacity", lambda: profile_cache.evictions)
+metrics.gauge("cluster_forwarded_updates","Updates this worker forwarded to the owner of their shard", lambda: cluster.forwarded)
+metrics.gauge("cluster_received_updates","Updates other workers forwarded to this worker", lambda: cluster.received)
+
+# A redelivered update got past the dedup ring and its grant was skipped at flush time;
+# take back what the in-memory caches already counted
+def revoke_duplicate(reason, user_id, credits):
+    if credits:
+        leaderboard.revoke(user_id, credits)
+    profile_cache.invalidate(user_id)
+    achievements.forget(user_id)
+
+writes.duplicate_listeners.append(revoke_duplicate)
+
+# Helper function to reply to a message, queued through the outbox when enabled
+def reply(message, text, **kwargs):
+    if outbox:
+        outbox.reply(message, text, **kwargs)
+    else:
+        bot.reply_to(message, text, **kwargs)
 
-# SQLite connection
-conn = sqlite3.connect("bot.db", check_same_thread=False)
-cur = conn.cursor()
+# Helper function to stream every user id in pages, for broadcasts
+def iter_user_ids(batch=500):
+    after = -(1 << 62)
+    while True:
+        rows = db.fetchall("SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, batch))
+        if not rows:
+            return
+        for row in rows:
+            yield row[0]
+        after = rows[-1][0]
 
 # Available quiz topics
 QUIZ_TOPICS = ["roblox","minecraft","python","hacking","general knowledge"]
-
-# Set webhook
-try:
-    bot.remove_webhook()
-    bot.set_webhook(url=WEBHOOK_URL)
-    logger.info(f"Webhook set to {WEBHOOK_URL}")
-except Exception as e:
-    logger.error(f"Error setting webhook: {e}")
+QUIZ_DIFFICULTIES = ["easy","medium","hard"]
 
 # Helper function to call OpenAI for quiz generation
 async def generate_quiz(topic, difficulty):
     try:
-        headers = {"Authorization": f"Bearer {OPENAI_API_KEY}","Content-Type":"application/json"}
-        payload = {"model":"gpt-4o-mini","messages": [
-                {"role":"user","content": f"Generate a {difficulty} quiz question about {topic} with 4 answer options and the correct answer."}
-            ]}        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        return await llm.client.chat([
+            {"role":"user","content": f"Generate a {difficulty} quiz question about {topic} with 4 answer options and the correct answer."}
+        ])
+    except Exception as e:
+        logger.error(f"Error generating quiz: {e}")
+        return None
+
+# Sync bridge for telebot handlers, which run on worker threads
+def generate_quiz_sync(topic, difficulty):
+    try:
+        return llm.run(generate_quiz(topic, difficulty), timeout=OPENAI_TIMEOUT * (OPENAI_MAX_RETRIES + 1) + 5)
     except Exception as e:
         logger.error(f"Error generating quiz: {e}")
-        return f"Error generating quiz: {str(e)}"
+        return None
+
+quiz_pool = QuizPool(db, generate_quiz, llm.submit, QUIZ_TOPICS, QUIZ_DIFFICULTIES, QUIZ_POOL_LOW, QUIZ_POOL_HIGH,
+                     leader=lambda: lifecycle.leader)
+quiz_pool.listeners.append(partial(cluster.publish,"quiz_pool"))
+cluster.subscribe("quiz_pool", quiz_pool.replay)
+
+# Helper function to get a quiz: served from the pool, generated on demand when the pool can't help
+def get_quiz(user_id, topic, difficulty):
+    quiz = quiz_pool.take(user_id, topic, difficulty)
+    if quiz is None:
+        quiz = generate_quiz_sync(topic, difficulty)
+        if quiz is not None:
+            quiz_pool.mark_seen(user_id, quiz)
+    return quiz
+
+def create_rate_limit_backend(backend):
+    if backend =="sqlite":
+        return SQLiteRateLimiter(db)
+    if backend =="redis":
+        return RedisRateLimiter(state.client if STATE_BACKEND =="redis" else create_state("redis", url=REDIS_URL).client)
+    return MemoryRateLimiter()
+
+rate_limiter = RateLimiter(
+    create_rate_limit_backend(RATE_LIMIT_BACKEND),
+    parse_limits(RATE_LIMITS),
+    parse_limits(f"default={RATE_LIMIT_DEFAULT}")["default"],
+)
 
 # Helper function to check rate limit
 def check_rate_limit(user_id, command):
-    cur.execute("SELECT COUNT(*) FROM rate_limits WHERE user_id =? AND command =? AND created_at > ?", 
-                (user_id, command, (datetime.now() - timedelta(hours=1)).isoformat()))
-    count = cur.fetchone()[0]
-    if count >= 5:
-        return False,"Rate limit exceeded. Try again in an hour."
-    cur.execute("INSERT INTO rate_limits (user_id, command, created_at) VALUES (?,?,?)", 
-                (user_id, command, datetime.now().isoformat()))
-    conn.commit()
-    return True, ""
-
-# Helper function to register user
+    return rate_limiter.check(user_id, command)
+
+# Helper function to parse a Telegram user id argument
+def parse_user_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+# Helper function to register user. Returning users with unchanged names cost no SQL:
+# their last_login is coalesced and written by the write-behind buffer.
 def register_user(user):
-    cur.execute("INSERT OR IGNORE INTO users (user_id, username, first_name, credits, last_login) VALUES (?,?,?,?,?)",
-                (user.id, user.username or"Unknown", user.first_name, 0, datetime.now().isoformat()))
-    conn.commit()
+    username = user.username or"Unknown"
+    now = datetime.now().isoformat()
+    if known_users.matches(user.id, username, user.first_name):
+        writes.touch(user.id, now)
+        return
+    db.execute("INSERT INTO users (user_id, username, first_name, credits, last_login) VALUES (?,?,?,?,?) "
+               "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username, first_name = excluded.first_name, last_login = excluded.last_login",
+               (user.id, username, user.first_name, 0, now))
+    known_users.remember(user.id, username, user.first_name)
+    cluster.publish("known_user", user.id)
+    leaderboard.set_user(user.id, username)
+    profile_cache.update(user.id, username=username)
 
 # Handle /start command
 @bot.message_handler(commands=['start'])
@@ -81,7 +296,7 @@ def handle_start(message):
     keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
     webapp_button = telebot.types.KeyboardButton("Open Mini App", web_app=telebot.types.WebAppInfo(url=MINIAPP_URL))
     keyboard.add(webapp_button)
-    bot.reply_to(message, f"Welcome, {user.username}! Click below to open the Mini App or use /help for commands.", reply_markup=keyboard)
+    reply(message, f"Welcome, {user.username}! Click below to open the Mini App or use /help for commands.", reply_markup=keyboard)
     logger.info(f"User {user.id} started bot")
 
 # Handle /newquiz command
@@ -91,20 +306,21 @@ def handle_newquiz(message):
     register_user(message.from_user)
     can_proceed, error_msg = check_rate_limit(user_id,"newquiz")
     if not can_proceed:
-        bot.reply_to(message, error_msg)
+        reply(message, error_msg)
         return
     args = message.text.split()[1:]
     topic = args[0].lower() if len(args) > 0 else"roblox"
     difficulty = args[1].lower() if len(args) > 1 else"hard"
     if topic not in QUIZ_TOPICS:
-        bot.reply_to(message, f"Invalid topic. Use /categories to see available topics.")
+        reply(message, f"Invalid topic. Use /categories to see available topics.")
+        return
+    quiz = get_quiz(user_id, topic, difficulty)
+    if quiz is None:
+        reply(message,"Quiz generation is unavailable right now. Please try again later.")
         return
-    quiz = generate_quiz(topic, difficulty)
-    cur.execute("INSERT INTO dynamic_quizzes (user_id, questions, category, difficulty, credits, created_at) VALUES (?,?,?,?,?,?)",
-                (user_id, quiz, topic, difficulty, 10, datetime.now().isoformat()))
-    cur.execute("UPDATE users SET credits = credits + 10 WHERE user_id = ?", (user_id,))
-    conn.commit()
-    bot.reply_to(message, f"Quiz: {quiz}\nEarned 10 credits!")
+    writes.record(user_id, 10,"dynamic_quizzes", {"user_id": user_id,"questions": quiz,"category": topic,"difficulty": difficulty,"credits": 10,"created_at": datetime.now().isoformat(),"message_key": message_key(message)})
+    achievements.add(user_id, quizzes=1, credits=10)
+    reply(message, f"Quiz: {quiz}\nEarned 10 credits!")
     logger.info(f"User {user_id} requested quiz: {topic}, {difficulty}")
 
 # Handle /profile command
@@ -112,22 +328,19 @@ def handle_newquiz(message):
 def handle_profile(message):
     user_id = message.from_user.id
     register_user(message.from_user)
-    cur.execute("SELECT username, credits, streak, premium_tier FROM users WHERE user_id = ?", (user_id,))
-    user_data = cur.fetchone()
-    cur.execute("SELECT COUNT(*) FROM dynamic_quizzes WHERE user_id = ?", (user_id,))
-    quiz_count = cur.fetchone()[0]
-    cur.execute("SELECT name FROM achievements WHERE user_id = ?", (user_id,))
-    achievements = [row[0] for row in cur.fetchall()]
+    profile = profile_cache.get(user_id)
+    # The leaderboard holds the live balance, including credits still in the write-behind buffer
+    credits = leaderboard.score(user_id) or 0
     response = (
-        f"👤 Profile: {user_data[0]}\n"
+        f"👤 Profile: {profile['username']}\n"
         f"🆔 Telegram ID: {user_id}\n"
-        f"💰 Credits: {user_data[1]}\n"
-        f"🔥 Streak: {user_data[2]}\n"
-        f"🏆 Quizzes Completed: {quiz_count}\n"
-        f"🎖 Achievements: {', '.join(achievements) or 'None'}\n"
-        f"🌟 Premium: {user_data[3] or 'None'}"
+        f"💰 Credits: {credits}\n"
+        f"🔥 Streak: {profile['streak']}\n"
+        f"🏆 Quizzes Completed: {profile['quiz_count']}\n"
+        f"🎖 Achievements: {', '.join(profile['achievements']) or 'None'}\n"
+        f"🌟 Premium: {profile['premium_tier'] or 'None'}"
     )
-    bot.reply_to(message, response)
+    reply(message, response)
     logger.info(f"User {user_id} accessed /profile")
 
 # Handle /dailyquiz command
@@ -135,23 +348,42 @@ def handle_profile(message):
 def handle_dailyquiz(message):
     user_id = message.from_user.id
     register_user(message.from_user)
-    cur.execute("SELECT created_at FROM dynamic_quizzes WHERE user_id =? AND category = 'daily' ORDER BY created_at DESC LIMIT 1", (user_id,))
-    last_quiz = cur.fetchone()
+    last_quiz = db.fetchone("SELECT created_at FROM dynamic_quizzes WHERE user_id =? AND category = 'daily' ORDER BY created_at DESC LIMIT 1", (user_id,))
     if last_quiz and datetime.fromisoformat(last_quiz[0]).date() == datetime.now().date():
-        bot.reply_to(message,"You've already taken today's daily quiz! Try again tomorrow.")
+        reply(message,"You've already taken today's daily quiz! Try again tomorrow.")
         return
     topic = random.choice(QUIZ_TOPICS)
-    difficulty = random.choice(["easy","medium","hard"])
-    quiz = generate_quiz(topic, difficulty)
-    cur.execute("INSERT INTO dynamic_quizzes (user_id, questions, category, difficulty, credits, created_at) VALUES (?,?,?,?,?,?)",
-                (user_id, quiz,"daily", difficulty, 20, datetime.now().isoformat()))
-    cur.execute("UPDATE users SET credits = credits + 20, streak = streak + 1 WHERE user_id = ?", (user_id,))
-    if cur.execute("SELECT streak FROM users WHERE user_id = ?", (user_id,)).fetchone()[0] >= 5:
-        cur.execute("INSERT INTO achievements (user_id, name, credits, created_at) VALUES (?,?,?,?)",
-                    (user_id,"Quiz Streaker", 50, datetime.now().isoformat()))
-        cur.execute("UPDATE users SET credits = credits + 50 WHERE user_id = ?", (user_id,))
-    conn.commit()
-    bot.reply_to(message, f"📅 Daily Quiz ({topic}, {difficulty}): {quiz}\nEarned 20 credits!")
+    difficulty = random.choice(QUIZ_DIFFICULTIES)
+    quiz = get_quiz(user_id, topic, difficulty)
+    if quiz is None:
+        reply(message,"Quiz generation is unavailable right now. Please try again later.")
+        return
+    # Quiz row, streak and credits commit together; the daily check is repeated under the write
+    # lock and the message key makes a redelivered update a no-op
+    streak = None
+    with db.transaction() as cur:
+        last_quiz = cur.execute("SELECT created_at FROM dynamic_quizzes WHERE user_id =? AND category = 'daily' ORDER BY created_at DESC LIMIT 1", (user_id,)).fetchone()
+        last_date = datetime.fromisoformat(last_quiz[0]).date() if last_quiz else None
+        taken = last_date == datetime.now().date()
+        if not taken:
+            cur.execute("INSERT INTO dynamic_quizzes (user_id, questions, category, difficulty, credits, created_at, message_key) VALUES (?,?,?,?,?,?,?) ON CONFLICT(message_key) DO NOTHING",
+                        (user_id, quiz,"daily", difficulty, 20, datetime.now().isoformat(), message_key(message)))
+            if cur.rowcount == 1:
+                # A missed day starts the streak over
+                continued = last_date == datetime.now().date() - timedelta(days=1)
+                streak = cur.execute("UPDATE users SET streak = streak + 1 WHERE user_id = ? RETURNING streak" if continued else
+                                     "UPDATE users SET streak = 1 WHERE user_id = ? RETURNING streak", (user_id,)).fetchone()[0]
+                ledger.apply(user_id, 20,"daily_quiz", message_key(message))
+    if taken:
+        reply(message,"You've already taken today's daily quiz! Try again tomorrow.")
+        return
+    if streak is None:
+        logger.info(f"Ignoring redelivered /dailyquiz from user {user_id}")
+        return
+    leaderboard.apply_delta(user_id, 20)
+    profile_cache.invalidate(user_id)
+    achievements.add(user_id, {"streak": streak}, quizzes=1, credits=20)
+    reply(message, f"📅 Daily Quiz ({topic}, {difficulty}): {quiz}\nEarned 20 credits!")
     logger.info(f"User {user_id} accessed /dailyquiz")
 
 # Handle /scriptmarket command
@@ -159,13 +391,12 @@ def handle_dailyquiz(message):
 def handle_scriptmarket(message):
     user_id = message.from_user.id
     register_user(message.from_user)
-    cur.execute("SELECT id, title, description, price FROM script_market WHERE approved = 1 LIMIT 5")
-    scripts = cur.fetchall()
+    scripts = db.fetchall("SELECT id, title, description, price FROM script_market WHERE approved = 1 LIMIT 5")
     response ="📜 Script Market (Top 5):\n"
     for script in scripts:
         response += f"ID: {script[0]} | {script[1]} - {script[2][:50]}... | Price: {script[3]} credits\n"
     response +="Use /buy_script <id> to purchase."
-    bot.reply_to(message, response)
+    reply(message, response)
     logger.info(f"User {user_id} accessed /scriptmarket")
 
 # Handle /buy_script command
@@ -175,22 +406,24 @@ def handle_buy_script(message):
     register_user(message.from_user)
     args = message.text.split()[1:]
     if not args:
-        bot.reply_to(message,"Usage: /buy_script <script_id>")
+        reply(message,"Usage: /buy_script <script_id>")
         return
     script_id = args[0]
-    cur.execute("SELECT price, script FROM script_market WHERE id =? AND approved = 1", (script_id,))
-    script = cur.fetchone()
+    script = db.fetchone("SELECT price, script FROM script_market WHERE id =? AND approved = 1", (script_id,))
     if not script:
-        bot.reply_to(message,"Invalid script ID or not approved.")
+        reply(message,"Invalid script ID or not approved.")
         return
-    cur.execute("SELECT credits FROM users WHERE user_id = ?", (user_id,))
-    user_credits = cur.fetchone()[0]
-    if user_credits < script[0]:
-        bot.reply_to(message,"Not enough credits!")
+    # Buffered grants must be in users.credits before the conditional debit sees them
+    if writes.pending_credits(user_id):
+        writes.flush()
+    status, _ = ledger.apply(user_id, -script[0],"script_purchase", message_key(message))
+    if status not in (APPLIED, DUPLICATE):
+        reply(message,"Not enough credits!")
         return
-    cur.execute("UPDATE users SET credits = credits -? WHERE user_id = ?", (script[0], user_id))
-    conn.commit()
-    bot.reply_to(message, f"Purchased script:\n```{script[1]}```")
+    if status == APPLIED:
+        leaderboard.apply_delta(user_id, -script[0], earned=False)
+        achievements.add(user_id, credits=-script[0])
+    reply(message, f"Purchased script:\n```{script[1]}```")
     logger.info(f"User {user_id} purchased script {script_id}")
 
 # Handle /setbio command
@@ -200,13 +433,14 @@ def handle_setbio(message):
     register_user(message.from_user)
     args = message.text.split(maxsplit=1)[1:]
     if not args:
-        bot.reply_to(message,"Usage: /setbio <bio>")
+        reply(message,"Usage: /setbio <bio>")
         return
     bio = args[0][:200]  # Limit to 200 chars
-    cur.execute("INSERT OR REPLACE INTO social_profiles (user_id, social_username, bio) VALUES (?,?,?)",
-                (user_id, message.from_user.username or"Unknown", bio))
-    conn.commit()
-    bot.reply_to(message,"Bio updated!")
+    db.execute("INSERT INTO social_profiles (user_id, social_username, bio) VALUES (?,?,?) "
+               "ON CONFLICT(user_id) DO UPDATE SET social_username = excluded.social_username, bio = excluded.bio",
+               (user_id, message.from_user.username or"Unknown", bio))
+    profile_cache.invalidate(user_id)
+    reply(message,"Bio updated!")
     logger.info(f"User {user_id} updated bio")
 
 # Handle /setavatar command
@@ -216,12 +450,12 @@ def handle_setavatar(message):
     register_user(message.from_user)
     args = message.text.split()[1:]
     if not args:
-        bot.reply_to(message,"Usage: /setavatar <url>")
+        reply(message,"Usage: /setavatar <url>")
         return
     avatar = args[0]
-    cur.execute("UPDATE social_profiles SET avatar =? WHERE user_id = ?", (avatar, user_id))
-    conn.commit()
-    bot.reply_to(message,"Avatar updated!")
+    db.execute("UPDATE social_profiles SET avatar =? WHERE user_id = ?", (avatar, user_id))
+    profile_cache.update_social(user_id, avatar=avatar)
+    reply(message,"Avatar updated!")
     logger.info(f"User {user_id} updated avatar")
 
 # Handle /follow command
@@ -231,16 +465,57 @@ def handle_follow(message):
     register_user(message.from_user)
     args = message.text.split()[1:]
     if not args:
-        bot.reply_to(message,"Usage: /follow <user_id>")
+        reply(message,"Usage: /follow <user_id>")
+        return
+    followed_id = parse_user_id(args[0])
+    if followed_id is None or followed_id == user_id:
+        reply(message,"Please give a valid user ID other than your own.")
         return
-    followed_id = args[0]
-    cur.execute("INSERT OR IGNORE INTO follows (follower_id, followed_id, created_at) VALUES (?,?,?)",
-                (user_id, followed_id, datetime.now().isoformat()))
-    cur.execute("UPDATE social_profiles SET followers = followers + 1 WHERE user_id = ?", (followed_id,))
-    conn.commit()
-    bot.reply_to(message, f"Now following user {followed_id}!")
+    followed = follow_graph.follow(user_id, followed_id)
+    if followed is None:
+        reply(message, f"Unknown user {followed_id}.")
+        return
+    if not followed:
+        reply(message, f"You already follow user {followed_id}.")
+        return
+    profile_cache.invalidate(followed_id)
+    achievements.add(followed_id, followers=1)
+    reply(message, f"Now following user {followed_id}!")
     logger.info(f"User {user_id} followed {followed_id}")
 
+# Handle /unfollow command
+@bot.message_handler(commands=['unfollow'])
+def handle_unfollow(message):
+    user_id = message.from_user.id
+    register_user(message.from_user)
+    args = message.text.split()[1:]
+    followed_id = parse_user_id(args[0]) if args else None
+    if followed_id is None:
+        reply(message,"Usage: /unfollow <user_id>")
+        return
+    if not follow_graph.unfollow(user_id, followed_id):
+        reply(message, f"You don't follow user {followed_id}.")
+        return
+    profile_cache.invalidate(followed_id)
+    achievements.add(followed_id, followers=-1)
+    reply(message, f"Unfollowed user {followed_id}.")
+    logger.info(f"User {user_id} unfollowed {followed_id}")
+
+# Handle /followers command
+@bot.message_handler(commands=['followers'])
+def handle_followers(message):
+    user_id = message.from_user.id
+    register_user(message.from_user)
+    follower_ids, next_cursor = follow_graph.followers(user_id, limit=20)
+    if not follower_ids:
+        reply(message,"You don't have any followers yet.")
+        return
+    response ="👥 Your followers:\n" +"\n".join(f"- {fid}" for fid in follower_ids)
+    if next_cursor is not None:
+        response +="\n...and more in the Mini App."
+    reply(message, response)
+    logger.info(f"User {user_id} accessed /followers")
+
 # Handle /crypto command
 @bot.message_handler(commands=['crypto'])
 def handle_crypto(message):
@@ -248,15 +523,13 @@ def handle_crypto(message):
     register_user(message.from_user)
     can_proceed, error_msg = check_rate_limit(user_id,"crypto")
     if not can_proceed:
-        bot.reply_to(message, error_msg)
+        reply(message, error_msg)
         return
     difficulty = random.choice(["easy","medium","hard"])
     credits = {"easy": 50,"medium": 100,"hard": 200}[difficulty]
-    cur.execute("INSERT INTO crypto_hacks (user_id, credits_earned, difficulty, created_at) VALUES (?,?,?,?)",
-                (user_id, credits, difficulty, datetime.now().isoformat()))
-    cur.execute("UPDATE users SET credits = credits +? WHERE user_id = ?", (credits, user_id))
-    conn.commit()
-    bot.reply_to(message, f"💸 Crypto Hack ({difficulty}): Success! Earned {credits} credits!")
+    writes.record(user_id, credits,"crypto_hacks", {"user_id": user_id,"credits_earned": credits,"difficulty": difficulty,"created_at": datetime.now().isoformat(),"message_key": message_key(message)})
+    achievements.add(user_id, credits=credits)
+    reply(message, f"💸 Crypto Hack ({difficulty}): Success! Earned {credits} credits!")
     logger.info(f"User {user_id} played crypto hack")
 
 # Handle /fling command (FE Fling Script)
@@ -290,62 +563,338 @@ for_, player in ipairs(Players:GetPlayers()) do
 end
 print("FE Fling activated! Use in private servers only.")
 """
-    cur.execute("INSERT INTO exploit_requests (user_id, exploit_type, created_at) VALUES (?,?,?)",
-                (user_id,"fling", datetime.now().isoformat()))
-    conn.commit()
-    bot.reply_to(message, f"💥 FE Fling Script (Test in private servers only):\n```{fling_script}```")
+    db.execute("INSERT INTO exploit_requests (user_id, exploit_type, created_at) VALUES (?,?,?)",
+               (user_id,"fling", datetime.now().isoformat()))
+    reply(message, f"💥 FE Fling Script (Test in private servers only):\n```{fling_script}```")
     logger.info(f"User {user_id} requested /fling")
 
 # Handle /leaderboard command
 @bot.message_handler(commands=['leaderboard'])
 def handle_leaderboard(message):
-    cur.execute("SELECT user_id, credits, username FROM users ORDER BY credits DESC LIMIT 5")
-    leaders = cur.fetchall()
-$response ="🏆 Leaderboard (Top 5):\n"$
-    for user_id, credits, username in leaders:
-$response += f"- {username}: {credits} credits\n"$
-    bot.reply_to(message, response)
+    leaders = leaderboard.top(5)
+    response ="🏆 Leaderboard (Top 5):\n"
+    for user_id, username, credits in leaders:
+        response += f"- {username}: {credits} credits\n"
+    reply(message, response)
     logger.info(f"User {message.from_user.id} accessed /leaderboard")
 
+# Handle /broadcast command (admin only)
+@bot.message_handler(commands=['broadcast'])
+def handle_broadcast(message):
+    if message.from_user.id != ADMIN_USER_ID:
+        reply(message,"This command is for admins only.")
+        return
+    args = message.text.split(maxsplit=1)[1:]
+    if not args:
+        reply(message,"Usage: /broadcast <message>")
+        return
+    if not outbox:
+        reply(message,"Broadcasts need SEND_MODE=queue.")
+        return
+    outbox.broadcast(args[0], iter_user_ids())
+    reply(message,"📣 Broadcast started.")
+    logger.info(f"Admin {message.from_user.id} started a broadcast")
+
 # Handle /categories, /hack, /robloxmeme, /admindash, /getwebhookinfo (unchanged from previous)
 # ... (Add these from the previous main.py if needed)
 
+# Latency, error and SQL accounting for every handler registered above
+metrics.instrument_bot(bot)
+
+# (user id, chat id, text) the flood filter judges an update by, or None when it doesn't apply
+def flood_subject(update):
+    message = update.message or update.edited_message
+    if flood_filter is None or message is None or message.from_user is None:
+        return None
+    return message.from_user.id, message.chat.id, message.text or message.caption
+
+# Flood check for an incoming update, from memory only. Returns (admitted, work): work is
+# None or the blocking part of the decision (the notice for the message that earned a mute,
+# everything after it being dropped silently, and the periodic spam_logs write), for the
+# caller to run where blocking is allowed.
+def admit(update):
+    subject = flood_subject(update)
+    if subject is None:
+        return True, None
+    verdict, mute = flood_filter.check(*subject)
+    work = []
+    if flood_filter.logs_due():
+        work.append(flood_filter.flush_logs)
+    if verdict != ALLOWED:
+        flood_dropped.inc(verdict)
+    if mute:
+        message = update.message or update.edited_message
+        wait = f"{mute:.0f} seconds" if mute < 120 else f"{mute / 60:.0f} minutes"
+        work.append(partial(reply, message, f"⏳ You're sending messages too fast. Muted for {wait}."))
+    return verdict == ALLOWED, partial(run_all, work) if work else None
+
+# Runs admit()'s follow-up work in order
+def run_all(work):
+    for fn in work:
+        fn()
+
+# Undo admit() for an update that was not accepted after all
+def unadmit(update):
+    subject = flood_subject(update)
+    if subject is not None:
+        flood_filter.refund(*subject)
+
+# Updates forwarded by other workers, as raw JSON. The flood check runs once per update;
+# only the hand-over to the dispatcher is retried while it is full.
+def prepare_forwarded(payload):
+    try:
+        update = telebot.types.Update.de_json(payload)
+    except Exception as e:
+        logger.error(f"Dropping unreadable forwarded update: {e}")
+        return None
+    admitted, work = admit(update)
+    if work:
+        work()
+    return update if admitted else None
+
+def submit_forwarded(update):
+    return dispatcher.submit(update, update_shard_key(update))
+
+def log_query_plans():
+    for name, detail in check_query_plans(db):
+        logger.warning(f"Query plan regression in {name}: {detail}")
+
+def start_retention():
+    if RETENTION_INTERVAL_HOURS > 0:
+        retention.start(RETENTION_INTERVAL_HOURS * 3600)
+
+# Only what every request needs runs before the port is bound; caches warm in the background
+# while the webhook already queues updates, and /ready flips once the dispatcher is running
+def start_app():
+    lifecycle.elect()
+    if not schema_is_current(db):
+        run_migrations(db)
+    dedup.load()
+    writes.start()
+    llm.start()
+    if outbox:
+        outbox.start()
+    if dispatcher:
+        dispatcher.accept()
+    elif cluster.active:
+        logger.warning("Inline dispatch mode doesn't shard updates; every worker processes what it receives")
+    cluster.start(submit_forwarded if dispatcher else None, prepare_forwarded)
+    lifecycle.warm([
+        ("webhook", lambda: ensure_webhook(bot, WEBHOOK_URL), True),
+        ("leaderboard", leaderboard.load, False),
+        ("known_users", lambda: known_users.warm(db), False),
+        ("quiz_pool", quiz_pool.load, False),
+        ("dispatcher", dispatcher.start if dispatcher else lambda: None, False),
+        ("quiz_refill", quiz_pool.refill_all, True),
+        ("query_plans", log_query_plans, True),
+        ("retention", start_retention, True),
+    ])
+
+def stop_app():
+    lifecycle.stop()
+    cluster.stop()
+    if dispatcher:
+        dispatcher.stop()
+    dedup.save()
+    if flood_filter:
+        flood_filter.flush_logs()
+    if outbox:
+        outbox.stop()
+    llm.stop()
+    retention.stop()
+    writes.stop()
+    db.close()
+
 # FastAPI endpoint for webhook
 @app.post("/")
-async def webhook(request: Request):
+async def webhook(request: Request, background: BackgroundTasks):
     try:
         json_str = await request.json()
         update = telebot.types.Update.de_json(json_str)
-        bot.process_new_updates([update])
-        return JSONResponse(content={"ok": True})
     except Exception as e:
-        logger.error(f"Webhook error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Webhook error: invalid update: {e}")
+        raise HTTPException(status_code=400, detail="Invalid update")
+    if update is None:
+        raise HTTPException(status_code=400, detail="Invalid update")
+    ready = dispatcher.accepting if dispatcher else lifecycle.ready.is_set()
+    if not ready:
+        dedup.defer(update.update_id)
+        return JSONResponse(status_code=503, content={"ok": False,"description":"Not ready"}, headers={"Retry-After":"5"})
+    # Telegram redelivers updates it thinks failed; acknowledge those without processing them
+    # again. This worker's recent ids are checked first, from memory, so redeliveries and
+    # retries never reach the flood counters.
+    if dedup.seen(update.update_id):
+        duplicate_updates.inc()
+        logger.info(f"Dropping duplicate update {update.update_id}")
+        return JSONResponse(content={"ok": True})
+    # Floods are judged where the chat's whole traffic is seen, before any SQL; dropped updates
+    # are acknowledged so Telegram doesn't redeliver them. An admitted update that ends up not
+    # accepted below is taken back out of the counters. Mute notices and spam_logs writes can
+    # block, so they run on the threadpool once the response is sent.
+    key = update_shard_key(update)
+    admitted = dispatcher is None or cluster.owns(key)
+    if admitted:
+        allowed, work = admit(update)
+        if work:
+            background.add_task(work)
+        if not allowed:
+            return JSONResponse(content={"ok": True})
+    # Shared state is a database or network round trip, so it stays off the event loop
+    claimed = await run_in_threadpool(dedup.claim, update.update_id) if cluster.active else dedup.claim(update.update_id)
+    if not claimed:
+        if admitted:
+            unadmit(update)
+        duplicate_updates.inc()
+        logger.info(f"Dropping duplicate update {update.update_id}")
+        return JSONResponse(content={"ok": True})
+    if dispatcher is None:
+        try:
+            bot.process_new_updates([update])
+            return JSONResponse(content={"ok": True})
+        except Exception as e:
+            dedup.release(update.update_id)
+            unadmit(update)
+            logger.error(f"Webhook error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    # The shard owner processes the chat, in order: another worker's shard gets the update
+    # through its queue, and this worker's own queue is drained before the update is submitted.
+    # Back-pressure: ask Telegram to redeliver later instead of buffering without bound
+    if cluster.active:
+        accepted = await run_in_threadpool(cluster.dispatch, key, json.dumps(json_str), update)
+    else:
+        accepted = dispatcher.submit(update, key)
+    if not accepted:
+        dedup.release(update.update_id)
+        unadmit(update)
+        logger.warning(f"Update queue full, rejecting update {update.update_id}")
+        return JSONResponse(status_code=429, content={"ok": False,"description":"Too many pending updates"}, headers={"Retry-After":"1"})
+    return JSONResponse(content={"ok": True})
 
 # FastAPI endpoint for leaderboard
 @app.get("/leaderboard")
-async def get_leaderboard():
+async def get_leaderboard(request: Request, limit: int = 5, offset: int = 0, window: str ="all", user_id: int = None):
+    if window not in WINDOWS:
+        raise HTTPException(status_code=400, detail=f"window must be one of {', '.join(WINDOWS)}")
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
     try:
-        cur.execute("SELECT username, credits FROM users ORDER BY credits DESC LIMIT 5")
-        leaders = [{"username": row[0],"count": row[1]} for row in cur.fetchall()]
-        return {"leaders": leaders}
+        # The ETag hashes the body, so every worker gives the same one for the same board
+        leaders = [{"user_id": uid,"username": username,"count": credits,"rank": offset + i + 1}
+                   for i, (uid, username, credits) in enumerate(leaderboard.top(limit, offset, window))]
+        content = {"leaders": leaders,"total": leaderboard.size(window),"window": window}
+        if user_id is None:
+            return conditional_json(request, content,"public, max-age=5")
+        position = leaderboard.rank_of(user_id, window)
+        content["me"] = {"rank": position[0],"count": position[1]} if position else None
+        return conditional_json(request, content)
     except Exception as e:
         logger.error(f"Error fetching leaderboard: {e}")
         raise HTTPException(status_code=500, detail="Error fetching leaderboard")
 
-# FastAPI endpoint for quiz history
+# Keyset cursor for quiz history: "created_at,id" of the last item already shown
+def parse_history_cursor(before):
+    created_at, _, quiz_id = before.rpartition(",")
+    try:
+        return created_at, int(quiz_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="before must be created_at,id")
+
+# One page of quiz history, newest first; next_before is None on the last page
+def quiz_history_page(user_id, limit=10, before=None):
+    limit = max(1, min(limit, 50))
+    sql ="SELECT id, questions, category, difficulty, created_at FROM dynamic_quizzes WHERE user_id = ?"
+    params = (user_id,)
+    if before is not None:
+        sql +=" AND (created_at, id) < (?, ?)"
+        params += parse_history_cursor(before)
+    rows = db.fetchall(sql +" ORDER BY created_at DESC, id DESC LIMIT ?", params + (limit + 1,))
+    history = [{"id": row[0],"question": row[1],"category": row[2],"difficulty": row[3],"created_at": row[4]} for row in rows[:limit]]
+    next_before = f"{history[-1]['created_at']},{history[-1]['id']}" if len(rows) > limit else None
+    return history, next_before
+
+# FastAPI endpoint for quiz history (keyset pagination: pass next_before back as before)
+# Endpoints that run SQL are plain functions, so FastAPI calls them on its thread pool
+# rather than blocking the event loop
 @app.get("/quiz_history")
-async def get_quiz_history(user_id: int):
+def get_quiz_history(request: Request, user_id: int, before: str = None, limit: int = 10):
     try:
-        cur.execute("SELECT questions, category, difficulty, created_at FROM dynamic_quizzes WHERE user_id =? ORDER BY created_at DESC LIMIT 10", (user_id,))
-        history = [{"question": row[0],"category": row[1],"difficulty": row[2],"created_at": row[3]} for row in cur.fetchall()]
-        return {"history": history}
+        history, next_before = quiz_history_page(user_id, limit, before)
+        return conditional_json(request, {"history": history,"next_before": next_before})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching quiz history: {e}")
         raise HTTPException(status_code=500, detail="Error fetching quiz history")
 
 # FastAPI endpoint for social profile
 @app.get("/social_profile")
-async def get_social_profile(user_id: int):
+def get_social_profile(request: Request, user_id: int):
     try:
-        cur.execute("SELECT social_username, bio, avatar, followers
+        profile = profile_cache.get(user_id)
+        if not profile or not profile["social"]:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return conditional_json(request, profile["social"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching social profile: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching social profile")
+
+# FastAPI endpoints for the follow graph (keyset pagination: pass next_cursor back as after)
+@app.get("/followers")
+def get_followers(user_id: int, after: int = None, limit: int = 20):
+    ids, next_cursor = follow_graph.followers(user_id, limit, after)
+    return {"followers": ids,"next_cursor": next_cursor}
+
+@app.get("/following")
+def get_following(user_id: int, after: int = None, limit: int = 20):
+    ids, next_cursor = follow_graph.following(user_id, limit, after)
+    return {"following": ids,"next_cursor": next_cursor}
+
+@app.get("/mutuals")
+def get_mutuals(user_id: int, after: int = None, limit: int = 20, viewer_id: int = None):
+    ids, next_cursor = follow_graph.mutuals(user_id, limit, after)
+    content = {"mutuals": ids,"next_cursor": next_cursor}
+    if viewer_id is not None:
+        content["followed_by"] = follow_graph.followed_by_followees(viewer_id, user_id)
+    return content
+
+# Everything the Mini App needs on launch in one round trip: profile, recent quizzes,
+# follow counts and leaderboard positions
+@app.get("/bootstrap")
+def get_bootstrap(request: Request, user_id: int, quizzes: int = 5):
+    try:
+        profile = profile_cache.get(user_id)
+        if profile is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        history, next_before = quiz_history_page(user_id, quizzes)
+        followers, following = follow_graph.counts(user_id)
+        ranks = {}
+        for window in WINDOWS:
+            position = leaderboard.rank_of(user_id, window)
+            ranks[window] = {"rank": position[0],"count": position[1]} if position else None
+        content = {
+            "user_id": user_id,
+            "profile": dict(profile, credits=leaderboard.score(user_id)),
+            "quizzes": {"history": history,"next_before": next_before},
+            "follows": {"followers": followers,"following": following},
+            "leaderboard": ranks,
+        }
+        return conditional_json(request, content)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error building bootstrap for {user_id}: {e}")
+        raise HTTPException(status_code=500, detail="Error loading user data")
+
+# Readiness probe: 503 until startup warmup has finished
+@app.get("/ready")
+async def get_ready():
+    status = lifecycle.status()
+    status["shard"] = cluster.shard
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+# Prometheus scrape endpoint
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,229 @@
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# (statements, seconds) for the handler or HTTP request running in the current context
+_request_db = ContextVar("request_db", default=None)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+# Each thread writes only to its own shard, so the hot path takes no lock; shards are
+# summed when /metrics is scraped.
+class _Sharded:
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshot(self):
+        with self._shards_lock:
+            return [dict(shard) for shard in self._shards]
+
+
+class Counter(_Sharded):
+    def inc(self, *labels, value=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + value
+
+    def render(self):
+        totals = {}
+        for shard in self._snapshot():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(totals.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram(_Sharded):
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    # Per label set: one count per bucket (non-cumulative) plus +Inf, then the sum
+    def observe(self, value, *labels):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self):
+        totals = {}
+        for shard in self._snapshot():
+            for labels, counts in shard.items():
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = list(counts)
+                else:
+                    for i, c in enumerate(counts):
+                        total[i] += c
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        for labels, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+# Value read at scrape time, e.g. a queue depth
+class Gauge:
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self._read = read
+
+    def render(self):
+        try:
+            value = self._read()
+        except Exception as e:
+            logger.error(f"Failed to read gauge {self.name}: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Metrics:
+    def __init__(self):
+        self._metrics = []
+        self.handler_seconds = self.histogram("bot_handler_duration_seconds", "Bot command handler latency", ("command",))
+        self.handler_errors = self.counter("bot_handler_errors_total", "Bot command handlers that raised", ("command",))
+        self.http_seconds = self.histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+        self.http_requests = self.counter("http_requests_total", "HTTP responses by status", ("method", "route", "status"))
+        self.db_seconds = self.histogram("db_statement_duration_seconds", "Time per SQL statement")
+        self.request_statements = self.histogram("request_db_statements", "SQL statements per handler or HTTP request",
+                                                  ("kind", "name"), STATEMENT_BUCKETS)
+        self.request_db_seconds = self.counter("request_db_seconds_total", "Time spent in SQL per handler or HTTP route",
+                                               ("kind", "name"))
+        self.upstream_seconds = self.histogram("upstream_request_duration_seconds", "Outbound API call latency",
+                                               ("service", "method"))
+        self.upstream_errors = self.counter("upstream_errors_total", "Outbound API calls that failed or returned an error",
+                                            ("service", "method"))
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, read):
+        return self._add(Gauge(name, help, read))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    # Database listener: every statement, attributed to the current request when there is one
+    def on_statement(self, sql, seconds):
+        self.db_seconds.observe(seconds)
+        current = _request_db.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += seconds
+
+    # Outbox / LLM client listener
+    def on_upstream(self, service, method, seconds, ok):
+        self.upstream_seconds.observe(seconds, service, method)
+        if not ok:
+            self.upstream_errors.inc(service, method)
+
+    def _finish_request(self, kind, name, token, current):
+        _request_db.reset(token)
+        self.request_statements.observe(current[0], kind, name)
+        if current[1]:
+            self.request_db_seconds.inc(kind, name, value=current[1])
+
+    # Wrap every registered command handler with latency, error and SQL accounting
+    def instrument_bot(self, bot):
+        for handler in bot.message_handlers:
+            commands = handler["filters"].get("commands")
+            name = "/" + commands[0] if commands else getattr(handler["function"], "__name__", "handler")
+            handler["function"] = self._wrap_handler(name, handler["function"])
+
+    def _wrap_handler(self, name, function):
+        @functools.wraps(function)
+        def wrapped(*args, **kwargs):
+            current = [0, 0.0]
+            token = _request_db.set(current)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                self.handler_errors.inc(name)
+                raise
+            finally:
+                self.handler_seconds.observe(time.perf_counter() - started, name)
+                self._finish_request("handler", name, token, current)
+        return wrapped
+
+    # Time Bot API calls telebot makes itself (direct send mode, webhook setup)
+    def instrument_telebot(self, apihelper):
+        make_request = apihelper._make_request
+
+        @functools.wraps(make_request)
+        def timed(token, method_name, *args, **kwargs):
+            started = time.perf_counter()
+            ok = False
+            try:
+                result = make_request(token, method_name, *args, **kwargs)
+                ok = True
+                return result
+            finally:
+                self.on_upstream("telegram", method_name, time.perf_counter() - started, ok)
+        apihelper._make_request = timed
+
+    # ASGI middleware for FastAPI: latency and status per route template, plus SQL per request
+    def instrument_app(self, app):
+        @app.middleware("http")
+        async def record(request, call_next):
+            current = [0, 0.0]
+            token = _request_db.set(current)
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await call_next(request)
+                status = response.status_code
+                return response
+            finally:
+                route = request.scope.get("route")
+                name = route.path if route is not None else "unmatched"
+                self.http_seconds.observe(time.perf_counter() - started, request.method, name)
+                self.http_requests.inc(request.method, name, str(status))
+                self._finish_request("http", name, token, current)
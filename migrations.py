@@ -0,0 +1,187 @@
+import logging
+import sys
+from datetime import datetime
+
+from database_setup import setup_database
+from ledger import Ledger
+
+logger = logging.getLogger(__name__)
+
+
+# Keep the first of any repeated achievement, then make (user_id, name) unique. Awards made
+# before grants were keyed get a zero-delta ledger entry under their ref, so the engine
+# can never grant their credits a second time.
+def _unique_achievements(db):
+    with db.transaction() as cur:
+        cur.execute("DELETE FROM achievements WHERE id NOT IN (SELECT MIN(id) FROM achievements GROUP BY user_id, name)")
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_achievements_user_name ON achievements(user_id, name)")
+        cur.execute("INSERT INTO credit_ledger (user_id, delta, reason, ref, created_at) "
+                    "SELECT user_id, 0, 'achievement', CAST(user_id AS TEXT) || ':' || name, ? FROM achievements "
+                    "WHERE user_id IS NOT NULL AND name IS NOT NULL "
+                    "ON CONFLICT(reason, ref) DO NOTHING", (datetime.now().isoformat(),))
+
+
+def _create_ledger(db):
+    with db.transaction() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS credit_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            ref TEXT,
+            created_at TIMESTAMP,
+            UNIQUE (reason, ref)
+        )""")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_credit_ledger_user ON credit_ledger(user_id, id)")
+        Ledger(db).open_balances()
+
+
+# Versioned schema changes, applied in order and recorded in schema_migrations.
+# Each entry is (version, name, statements) where statements is a list of SQL strings or a
+# callable taking the database (its transactions join the migration's).
+# Never edit an applied migration; add a new one.
+MIGRATIONS = [
+    (1, "baseline schema", setup_database),
+    (2, "indexes for actual query shapes", [
+        # /dailyquiz: WHERE user_id = ? AND category = 'daily' ORDER BY created_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_dynamic_quizzes_user_category_created ON dynamic_quizzes(user_id, category, created_at DESC)",
+        # /quiz_history: WHERE user_id = ? ORDER BY created_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_dynamic_quizzes_user_created ON dynamic_quizzes(user_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_rate_limits_user_command_created ON rate_limits(user_id, command, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_script_market_approved ON script_market(approved, id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_credits ON users(credits DESC)",
+        # Known-users warmup: ORDER BY last_login DESC LIMIT ?
+        "CREATE INDEX IF NOT EXISTS idx_users_last_login ON users(last_login DESC)",
+        # Redundant: duplicates of UNIQUE/PRIMARY KEY indexes or prefixes of the composites above
+        "DROP INDEX IF EXISTS idx_users_email",
+        "DROP INDEX IF EXISTS idx_users_phone_number",
+        "DROP INDEX IF EXISTS idx_referrals_code",
+        "DROP INDEX IF EXISTS idx_roblox_links_user_id",
+        "DROP INDEX IF EXISTS idx_social_profiles_user_id",
+        "DROP INDEX IF EXISTS idx_user_themes_user_id",
+        "DROP INDEX IF EXISTS idx_follows_follower_id",
+        "DROP INDEX IF EXISTS idx_follows_followed_id",
+        "DROP INDEX IF EXISTS idx_dynamic_quizzes_user_id",
+        "DROP INDEX IF EXISTS idx_rate_limits_user_id",
+    ]),
+    (3, "idempotent credit grants and update high-water mark", [
+        "ALTER TABLE dynamic_quizzes ADD COLUMN message_key TEXT",
+        "ALTER TABLE crypto_hacks ADD COLUMN message_key TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_dynamic_quizzes_message_key ON dynamic_quizzes(message_key)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_crypto_hacks_message_key ON crypto_hacks(message_key)",
+        "CREATE TABLE IF NOT EXISTS bot_state (key TEXT PRIMARY KEY, value INTEGER)",
+    ]),
+    (4, "credit ledger with opening balances", _create_ledger),
+    (5, "keyset index for quiz history pages", [
+        # /quiz_history and /bootstrap: WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC
+        "CREATE INDEX IF NOT EXISTS idx_dynamic_quizzes_user_created_id ON dynamic_quizzes(user_id, created_at DESC, id DESC)",
+        "DROP INDEX IF EXISTS idx_dynamic_quizzes_user_created",
+    ]),
+    (6, "exactly-once achievements", _unique_achievements),
+    (7, "state shared between workers", [
+        "CREATE TABLE IF NOT EXISTS shared_claims (key TEXT PRIMARY KEY, expires REAL)",
+        "CREATE TABLE IF NOT EXISTS shared_leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL)",
+        "CREATE TABLE IF NOT EXISTS shared_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, payload TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_shared_queue_name ON shared_queue(name, id)",
+        "CREATE TABLE IF NOT EXISTS shared_events (id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, kind TEXT, payload TEXT, created REAL)",
+        "CREATE INDEX IF NOT EXISTS idx_shared_events_created ON shared_events(created)",
+    ]),
+    (8, "drop indexes for queries the app no longer runs", [
+        # Rate limits are counted in rate_limit_counters, memory or Redis, and the leaderboard
+        # ranks in memory; idx_users_credits only slowed down every credit update
+        "DROP INDEX IF EXISTS idx_rate_limits_user_command_created",
+        "DROP INDEX IF EXISTS idx_users_credits",
+    ]),
+]
+
+
+# Query shapes the app relies on; none of them may fall back to a full scan or a sort
+QUERY_SHAPES = [
+    ("daily quiz check", "SELECT created_at FROM dynamic_quizzes WHERE user_id = ? AND category = 'daily' ORDER BY created_at DESC LIMIT 1", (1,)),
+    ("quiz history", "SELECT id, questions, category, difficulty, created_at FROM dynamic_quizzes WHERE user_id = ? "
+                     "ORDER BY created_at DESC, id DESC LIMIT ?", (1, 11)),
+    ("quiz history page", "SELECT id, questions, category, difficulty, created_at FROM dynamic_quizzes WHERE user_id = ? "
+                          "AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?", (1, "", 0, 11)),
+    ("quiz count", "SELECT COUNT(*) FROM dynamic_quizzes WHERE user_id = ?", (1,)),
+    ("script market", "SELECT id, title, description, price FROM script_market WHERE approved = 1 LIMIT 5", ()),
+    ("script lookup", "SELECT price, script FROM script_market WHERE id = ? AND approved = 1", (1,)),
+    ("known users warmup", "SELECT user_id, username, first_name FROM users ORDER BY last_login DESC LIMIT ?", (10,)),
+    ("achievements", "SELECT name FROM achievements WHERE user_id = ? ORDER BY id", (1,)),
+    ("following count", "SELECT COUNT(*) FROM follows WHERE follower_id = ?", (1,)),
+    ("followers page", "SELECT follower_id FROM follows WHERE followed_id = ? AND follower_id > ? ORDER BY follower_id LIMIT ?", (1, 0, 20)),
+    ("following page", "SELECT followed_id FROM follows WHERE follower_id = ? AND followed_id > ? ORDER BY followed_id LIMIT ?", (1, 0, 20)),
+    ("shard queue", "SELECT id, payload FROM shared_queue WHERE name = ? ORDER BY id LIMIT ?", ("updates:0", 100)),
+    ("cache events", "SELECT id, origin, kind, payload FROM shared_events WHERE id > ? ORDER BY id LIMIT 1000", (0,)),
+    ("quiz seen", "SELECT question_hash FROM quiz_seen WHERE user_id = ? AND question_hash IN (?, ?)", (1, "", "")),
+    ("quiz pool stock", "SELECT COUNT(*) FROM quiz_pool WHERE category = ? AND difficulty = ?", ("python", "easy")),
+]
+
+
+# Cheap startup check: one query when the schema is already current
+def schema_is_current(db, migrations=MIGRATIONS):
+    try:
+        version = db.fetchval("SELECT MAX(version) FROM schema_migrations")
+    except Exception:
+        return False
+    return version is not None and version >= migrations[-1][0]
+
+
+def applied_versions(db):
+    with db.transaction() as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT)")
+    return {row[0] for row in db.fetchall("SELECT version FROM schema_migrations")}
+
+
+# Apply pending migrations, one transaction each. Safe to call from several workers at once:
+# the version is re-checked inside the transaction that applies it.
+def run_migrations(db, migrations=MIGRATIONS):
+    done = applied_versions(db)
+    applied = []
+    for version, name, statements in migrations:
+        if version in done:
+            continue
+        with db.transaction() as cur:
+            if db.dialect != "sqlite":
+                # SQLite's BEGIN IMMEDIATE already serializes writers
+                cur.execute("LOCK TABLE schema_migrations IN EXCLUSIVE MODE")
+            if cur.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)).fetchone():
+                continue
+            if callable(statements):
+                statements(db)
+            else:
+                for sql in statements:
+                    cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (?,?,?)",
+                        (version, name, datetime.now().isoformat()))
+        applied.append(version)
+        logger.info(f"Applied migration {version}: {name}")
+    return applied
+
+
+# EXPLAIN QUERY PLAN every known query shape; returns [(name, plan detail)] for full scans and sorts
+def check_query_plans(db, shapes=QUERY_SHAPES):
+    if db.dialect != "sqlite":
+        return []
+    problems = []
+    for name, sql, params in shapes:
+        for row in db.fetchall(f"EXPLAIN QUERY PLAN {sql}", params):
+            detail = row[-1]
+            full_scan = detail.startswith("SCAN") and "INDEX" not in detail
+            if full_scan or "TEMP B-TREE" in detail:
+                problems.append((name, detail))
+    return problems
+
+
+if __name__ == "__main__":
+    from db import Database
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = Database.from_env()
+    run_migrations(db)
+    if "--check" in sys.argv:
+        problems = check_query_plans(db)
+        for name, detail in problems:
+            logger.error(f"Query plan regression in {name}: {detail}")
+        db.close()
+        sys.exit(1 if problems else 0)
+    db.close()
@@ -0,0 +1,244 @@
+import heapq
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class OutboundMessage:
+    __slots__ = ("chat_id", "method", "payload", "attempts")
+
+    def __init__(self, chat_id, method, payload):
+        self.chat_id = chat_id
+        self.method = method
+        self.payload = payload
+        self.attempts = 0
+
+
+class BroadcastJob:
+    def __init__(self, text):
+        self.text = text
+        self.queued = 0
+        self.done = threading.Event()
+        self.error = None
+
+
+# Outbound Telegram message scheduler. Handlers enqueue messages; sender threads drain them
+# over one keep-alive session, shaped by a global token bucket and one bucket per chat.
+# A chat is always handled by the same sender, so its messages go out in order.
+class Outbox:
+    def __init__(self, token, api_url="https://api.telegram.org", senders=4, global_rate=30.0,
+                 chat_rate=1.0, chat_burst=3, group_rate=20 / 60, max_queue=10000, timeout=10.0, max_attempts=3):
+        self._base = f"{api_url.rstrip('/')}/bot{token}"
+        self._senders = max(1, senders)
+        self._queues = [queue.Queue(maxsize=max(1, max_queue // self._senders)) for _ in range(self._senders)]
+        self._global = TokenBucket(global_rate, global_rate)
+        self._global_lock = threading.Lock()
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._timeout = timeout
+        self._max_attempts = max_attempts
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._senders)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._threads = []
+        self._running = False
+        self.sent = 0
+        self.failed = 0
+        # Called with (method, seconds, ok) after every Bot API call
+        self.listeners = []
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(q,), name=f"outbox-sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Outbox started with {self._senders} senders")
+
+    # Lets queued messages go out (up to `timeout` seconds), then stops the senders
+    def stop(self, timeout=10.0):
+        if not self._running:
+            return
+        for q in self._queues:
+            q.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._running = False
+        self._threads = []
+        self._session.close()
+        logger.info("Outbox stopped")
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    # Queue a sendMessage; returns False when the chat's sender queue is full
+    def send(self, chat_id, text, reply_to_message_id=None, reply_markup=None, parse_mode=None, block=False, **extra):
+        payload = {"chat_id": chat_id, "text": text, **extra}
+        if reply_to_message_id is not None:
+            payload["reply_parameters"] = {"message_id": reply_to_message_id, "allow_sending_without_reply": True}
+        if reply_markup is not None:
+            payload["reply_markup"] = json.loads(reply_markup.to_json()) if hasattr(reply_markup, "to_json") else reply_markup
+        if parse_mode is not None:
+            payload["parse_mode"] = parse_mode
+        return self._enqueue(OutboundMessage(chat_id, "sendMessage", payload), block)
+
+    # Drop-in for bot.reply_to
+    def reply(self, message, text, **kwargs):
+        if not self.send(message.chat.id, text, reply_to_message_id=message.message_id, **kwargs):
+            logger.warning(f"Outbox full, dropping reply to chat {message.chat.id}")
+
+    # Send `text` to every user id produced by `recipients` (an iterable, consumed lazily).
+    # Runs on its own thread and blocks on full queues, so memory stays bounded.
+    def broadcast(self, text, recipients):
+        job = BroadcastJob(text)
+
+        def run():
+            try:
+                for chat_id in recipients:
+                    if not self._running:
+                        break
+                    self.send(chat_id, text, block=True)
+                    job.queued += 1
+            except Exception as e:
+                job.error = e
+                logger.error(f"Broadcast failed after {job.queued} recipients: {e}")
+            finally:
+                job.done.set()
+                logger.info(f"Broadcast queued for {job.queued} recipients")
+
+        threading.Thread(target=run, name="outbox-broadcast", daemon=True).start()
+        return job
+
+    def _enqueue(self, item, block):
+        q = self._queues[item.chat_id % self._senders]
+        try:
+            q.put(item, block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def _chat_bucket(self, chat_id):
+        # Groups and channels have negative ids and a much lower limit
+        if chat_id < 0:
+            return TokenBucket(self._group_rate, 1)
+        return TokenBucket(self._chat_rate, self._chat_burst)
+
+    def _take_global(self):
+        with self._global_lock:
+            return self._global.take()
+
+    # One sender: per-chat FIFOs plus a heap of (ready_at, chat_id) for chats with pending messages
+    def _run(self, q):
+        pending = {}
+        buckets = {}
+        ready = []
+        stopping = False
+        while True:
+            if stopping and not pending:
+                return
+            if ready:
+                timeout = max(0.0, ready[0][0] - time.monotonic())
+            else:
+                timeout = 0.05 if stopping else None
+            # Take in new messages, bounded so a busy queue can't starve sending
+            for _ in range(100):
+                try:
+                    item = q.get(timeout=timeout) if timeout != 0 else q.get_nowait()
+                except queue.Empty:
+                    break
+                timeout = 0
+                if item is _STOP:
+                    stopping = True
+                elif item.chat_id in pending:
+                    pending[item.chat_id].append(item)
+                else:
+                    pending[item.chat_id] = deque([item])
+                    heapq.heappush(ready, (time.monotonic(), item.chat_id))
+            if not ready or ready[0][0] > time.monotonic():
+                continue
+            _, chat_id = heapq.heappop(ready)
+            bucket = buckets.get(chat_id)
+            if bucket is None:
+                bucket = buckets[chat_id] = self._chat_bucket(chat_id)
+            wait = bucket.take()
+            if not wait:
+                wait = self._take_global()
+                if wait:
+                    # Only the global budget is short; keep the chat's token for the retry
+                    bucket.refund()
+            if wait:
+                heapq.heappush(ready, (time.monotonic() + wait, chat_id))
+                continue
+            chat = pending[chat_id]
+            try:
+                retry_after = self._deliver(chat[0])
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Dropping message to chat {chat_id}: {e}")
+                retry_after = None
+            if retry_after is None:
+                chat.popleft()
+            if chat:
+                heapq.heappush(ready, (time.monotonic() + (retry_after or 0), chat_id))
+            else:
+                del pending[chat_id]
+            # Idle chats' buckets would have refilled anyway; don't keep them around
+            if len(buckets) > 10000:
+                for idle in [c for c in buckets if c not in pending]:
+                    del buckets[idle]
+
+    # Returns None when the message is finished (sent or given up), else seconds to wait before retrying
+    def _deliver(self, item):
+        item.attempts += 1
+        started = time.perf_counter()
+        try:
+            response = self._session.post(f"{self._base}/{item.method}", json=item.payload, timeout=self._timeout)
+        except requests.RequestException as e:
+            self._report(item.method, started, False)
+            if item.attempts >= self._max_attempts:
+                self.failed += 1
+                logger.error(f"Giving up on message to chat {item.chat_id}: {e}")
+                return None
+            return min(30.0, 0.5 * 2 ** item.attempts)
+        self._report(item.method, started, response.status_code < 400)
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.json().get("parameters", {}).get("retry_after", 1))
+            except ValueError:
+                retry_after = 1.0
+            logger.warning(f"Telegram rate limited chat {item.chat_id}, retrying in {retry_after}s")
+            return retry_after
+        if response.status_code >= 500 and item.attempts < self._max_attempts:
+            return min(30.0, 0.5 * 2 ** item.attempts)
+        if response.status_code >= 400:
+            self.failed += 1
+            logger.error(f"Telegram rejected message to chat {item.chat_id}: {response.status_code} {response.text[:200]}")
+            return None
+        self.sent += 1
+        return None
+
+    def _report(self, method, started, ok):
+        elapsed = time.perf_counter() - started
+        for listener in self.listeners:
+            listener(method, elapsed, ok)
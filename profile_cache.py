@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Read-through cache of user profiles (users row, quiz count, achievements, social profile)
+# with LRU + TTL eviction. Counters are maintained incrementally from buffered writes
+# instead of being recounted; other mutations invalidate or patch the entry.
+class ProfileCache:
+    def __init__(self, db, writes, capacity=10000, ttl=300):
+        self._db = db
+        self._writes = writes
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # user_id -> True while a load is in flight; set to False when the user changes mid-load
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Called with user_id whenever an entry is dropped or patched, so other workers can drop theirs
+        self.listeners = []
+        writes.row_listeners.append(self._on_row)
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(user_id)
+            if item is not None and item[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return _copy(item[1])
+            if item is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            self._loading[user_id] = True
+        try:
+            entry = self._load(user_id)
+        finally:
+            with self._lock:
+                clean = self._loading.pop(user_id, False)
+        # A write landed while loading: the entry may or may not include it, so don't keep it
+        if entry is not None and clean:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, entry)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return None if entry is None else _copy(entry)
+
+    def invalidate(self, user_id):
+        self.evict(user_id)
+        self._notify(user_id)
+
+    # Drop an entry without notifying the listeners (the change came from another worker)
+    def evict(self, user_id):
+        with self._lock:
+            self.invalidations += 1
+            self._entries.pop(user_id, None)
+            if user_id in self._loading:
+                self._loading[user_id] = False
+
+    # Patch fields of a cached entry after a write that is already committed
+    def update(self, user_id, **fields):
+        with self._lock:
+            item = self._entries.get(user_id)
+            if item is not None:
+                item[1].update(fields)
+            if user_id in self._loading:
+                self._loading[user_id] = False
+        self._notify(user_id)
+
+    def update_social(self, user_id, **fields):
+        with self._lock:
+            item = self._entries.get(user_id)
+            if item is not None:
+                if item[1]["social"] is None:
+                    self._entries.pop(user_id)
+                else:
+                    item[1]["social"].update(fields)
+            if user_id in self._loading:
+                self._loading[user_id] = False
+        self._notify(user_id)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    # Called by the write-behind buffer for every buffered row
+    def _on_row(self, table, row):
+        if table not in ("dynamic_quizzes", "achievements"):
+            return
+        user_id = row.get("user_id")
+        self._notify(user_id)
+        with self._lock:
+            if user_id in self._loading:
+                self._loading[user_id] = False
+            item = self._entries.get(user_id)
+            if item is None:
+                return
+            if table == "dynamic_quizzes":
+                item[1]["quiz_count"] += 1
+            else:
+                item[1]["achievements"].append(row["name"])
+
+    def _notify(self, user_id):
+        for listener in self.listeners:
+            listener(user_id)
+
+    def _load(self, user_id):
+        # Database state and buffered rows are read under the flush lock so nothing is counted twice
+        with self._writes.consistent():
+            user = self._db.fetchone("SELECT username, streak, premium_tier FROM users WHERE user_id = ?", (user_id,))
+            if user is None:
+                return None
+            quiz_count = self._db.fetchval("SELECT COUNT(*) FROM dynamic_quizzes WHERE user_id = ?", (user_id,), 0)
+            # Quizzes older than the retention window only survive as daily rollups
+            quiz_count += self._db.fetchval("SELECT COALESCE(SUM(events), 0) FROM daily_activity WHERE user_id = ? AND source = 'dynamic_quizzes'", (user_id,), 0)
+            achievements = [row[0] for row in self._db.fetchall("SELECT name FROM achievements WHERE user_id = ? ORDER BY id", (user_id,))]
+            social = self._db.fetchone("SELECT social_username, bio, avatar, followers, likes, theme_color FROM social_profiles WHERE user_id = ?", (user_id,))
+            quiz_count += len(self._writes.pending_rows("dynamic_quizzes", user_id))
+            achievements += [row["name"] for row in self._writes.pending_rows("achievements", user_id)]
+        return {
+            "username": user[0],
+            "streak": user[1],
+            "premium_tier": user[2],
+            "quiz_count": quiz_count,
+            "achievements": achievements,
+            "social": None if social is None else {
+                "username": social[0], "bio": social[1], "avatar": social[2],
+                "followers": social[3], "likes": social[4], "theme_color": social[5],
+            },
+        }
+
+
+# Callers get their own copy so incremental updates can't change it under them
+def _copy(entry):
+    social = entry["social"]
+    return dict(entry, achievements=list(entry["achievements"]), social=None if social is None else dict(social))
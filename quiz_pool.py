@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import itertools
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+# Stable fingerprint of a question so re-generated duplicates are recognised
+def question_hash(text):
+    normalized = " ".join(text.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+# Keeps a stock of ready quiz questions per (topic, difficulty) bucket.
+# Questions are served from an in-memory deque mirrored in the quiz_pool table,
+# and a bucket is topped back up to `high` in the background once it drops below `low`.
+# With several workers the table is shared: a question is served by whoever deletes its row,
+# only the leader (`leader()`) generates new ones, and each worker's deques follow the
+# others' through `listeners` (called with (method name, args)) and replay().
+class QuizPool:
+    def __init__(self, db, generate, schedule, topics, difficulties, low=3, high=10, scan=5, leader=lambda: True):
+        self._db = db
+        self._generate = generate  # async (topic, difficulty) -> str or None
+        self._schedule = schedule  # runs a coroutine in the background
+        self._leader = leader
+        self.low = low
+        self.high = max(high, low + 1)
+        self.scan = scan
+        self._buckets = {(t, d): deque() for t in topics for d in difficulties}
+        self._refilling = set()
+        self._lock = threading.Lock()
+        self.listeners = []
+        self._replaying = threading.local()
+
+    def load(self):
+        rows = self._db.fetchall("SELECT id, category, difficulty, questions, question_hash FROM quiz_pool ORDER BY id")
+        with self._lock:
+            for row_id, category, difficulty, text, qhash in rows:
+                bucket = self._buckets.get((category, difficulty))
+                if bucket is not None:
+                    bucket.append((row_id, text, qhash))
+        logger.info(f"Loaded {len(rows)} pooled quiz questions")
+
+    def size(self, topic, difficulty):
+        bucket = self._buckets.get((topic, difficulty))
+        return len(bucket) if bucket is not None else 0
+
+    # Pop a question the user hasn't seen yet; None when the bucket has nothing suitable.
+    # Candidates are picked under the lock; the SQL runs outside it, and the DELETE decides
+    # who gets a question when two takes pick the same one.
+    def take(self, user_id, topic, difficulty):
+        key = (topic, difficulty)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return None
+        picked = None
+        gone = True
+        # Look again while candidates were lost to other takes, since they no longer fill the scan window
+        while picked is None and gone:
+            with self._lock:
+                candidates = list(itertools.islice(bucket, self.scan))
+            seen = self._seen(user_id, [qhash for _, _, qhash in candidates])
+            gone = set()
+            for row_id, text, qhash in candidates:
+                if qhash in seen:
+                    continue
+                # Whoever deletes the row serves the question; another take may have been first
+                gone.add(row_id)
+                if self._claim(user_id, row_id, qhash):
+                    picked = (row_id, text, qhash)
+                    break
+            if gone:
+                with self._lock:
+                    _remove(bucket, gone)
+        if picked:
+            self._notify("taken", topic, difficulty, picked[0])
+        self.ensure_stock(topic, difficulty)
+        return picked[1] if picked else None
+
+    # Record a question served outside the pool (e.g. generated on demand)
+    def mark_seen(self, user_id, text):
+        self._mark_seen(user_id, question_hash(text))
+
+    # Apply a change another worker made, without notifying the listeners again
+    def replay(self, method, args):
+        if method not in ("taken", "stocked"):
+            raise ValueError(f"Unknown quiz pool change {method}")
+        self._replaying.active = True
+        try:
+            topic, difficulty, value = args
+            bucket = self._buckets.get((topic, difficulty))
+            if bucket is None:
+                return
+            with self._lock:
+                if method == "taken":
+                    _remove(bucket, {value})
+                else:
+                    present = {row[0] for row in bucket}
+                    bucket.extend(tuple(row) for row in value if row[0] not in present)
+            if method == "taken":
+                self.ensure_stock(topic, difficulty)
+        finally:
+            self._replaying.active = False
+
+    def _notify(self, method, *args):
+        if self.listeners and not getattr(self._replaying, "active", False):
+            for listener in self.listeners:
+                listener(method, args)
+
+    # Only the leader generates; the others learn about new questions through replay()
+    def ensure_stock(self, topic, difficulty):
+        key = (topic, difficulty)
+        if not self._leader():
+            return
+        with self._lock:
+            if len(self._buckets[key]) >= self.low or key in self._refilling:
+                return
+            self._refilling.add(key)
+        try:
+            self._schedule(self._refill(key))
+        except Exception as e:
+            logger.error(f"Could not schedule quiz pool refill for {key}: {e}")
+            with self._lock:
+                self._refilling.discard(key)
+
+    def refill_all(self):
+        for topic, difficulty in list(self._buckets):
+            self.ensure_stock(topic, difficulty)
+
+    # Runs on the LLM event loop; the database work goes to the default executor
+    async def _refill(self, key):
+        topic, difficulty = key
+        loop = asyncio.get_running_loop()
+        try:
+            # The table is the stock every worker serves from; the deque may lag behind it
+            stocked = await loop.run_in_executor(None, self._db.fetchval,
+                                                 "SELECT COUNT(*) FROM quiz_pool WHERE category = ? AND difficulty = ?", (topic, difficulty), 0)
+            missing = self.high - stocked
+            if missing <= 0:
+                return
+            results = await asyncio.gather(*(self._generate(topic, difficulty) for _ in range(missing)))
+            added = await loop.run_in_executor(None, self._store, key, [text for text in results if text])
+            if added:
+                self._notify("stocked", topic, difficulty, added)
+            logger.info(f"Refilled quiz pool {topic}/{difficulty} with {len(added)} questions")
+        except Exception as e:
+            logger.error(f"Error refilling quiz pool {topic}/{difficulty}: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+    # Insert generated questions and append the new ones to the bucket; returns the new rows
+    def _store(self, key, texts):
+        topic, difficulty = key
+        now = datetime.now().isoformat()
+        added = []
+        with self._db.transaction() as cur:
+            for text in texts:
+                qhash = question_hash(text)
+                row = cur.execute(
+                    "INSERT INTO quiz_pool (category, difficulty, questions, question_hash, created_at) VALUES (?,?,?,?,?) "
+                    "ON CONFLICT(question_hash) DO NOTHING RETURNING id",
+                    (topic, difficulty, text, qhash, now)).fetchone()
+                if row:
+                    added.append((row[0], text, qhash))
+        with self._lock:
+            self._buckets[key].extend(added)
+        return added
+
+    # The hashes among `hashes` the user has already been served, in one query
+    def _seen(self, user_id, hashes):
+        if not hashes:
+            return set()
+        placeholders = ",".join("?" * len(hashes))
+        rows = self._db.fetchall(f"SELECT question_hash FROM quiz_seen WHERE user_id = ? AND question_hash IN ({placeholders})",
+                                 (user_id, *hashes))
+        return {row[0] for row in rows}
+
+    # Delete the pooled row and record the user as having seen it; False when it was already gone
+    def _claim(self, user_id, row_id, qhash):
+        with self._db.transaction() as cur:
+            if cur.execute("DELETE FROM quiz_pool WHERE id = ? RETURNING id", (row_id,)).fetchone() is None:
+                return False
+            cur.execute("INSERT INTO quiz_seen (user_id, question_hash, created_at) VALUES (?,?,?) ON CONFLICT DO NOTHING",
+                        (user_id, qhash, datetime.now().isoformat()))
+        return True
+
+    def _mark_seen(self, user_id, qhash):
+        self._db.execute("INSERT INTO quiz_seen (user_id, question_hash, created_at) VALUES (?,?,?) ON CONFLICT DO NOTHING",
+                         (user_id, qhash, datetime.now().isoformat()))
+
+
+def _remove(bucket, row_ids):
+    if row_ids:
+        kept = [row for row in bucket if row[0] not in row_ids]
+        bucket.clear()
+        bucket.extend(kept)
@@ -0,0 +1,211 @@
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimit:
+    __slots__ = ("limit", "period")
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+
+    def __repr__(self):
+        return f"RateLimit({self.limit}/{self.period}s)"
+
+
+# Parse "newquiz=5/3600,crypto=10/3600" into {command: RateLimit}
+def parse_limits(spec):
+    limits = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        command, _, rule = item.partition("=")
+        limit, _, period = rule.partition("/")
+        limits[command.strip()] = RateLimit(int(limit), float(period or 3600))
+    return limits
+
+
+# Sliding-window counter: the previous window's count is weighted by how much of it
+# still overlaps the sliding window. State is [window_start, prev_count, curr_count].
+def _slide(state, now, period):
+    window = now - now % period
+    if state is None or window - state[0] >= 2 * period:
+        return [window, 0, 0]
+    if window != state[0]:
+        return [window, state[2], 0]
+    return state
+
+
+def _estimate(state, now, period):
+    return state[1] * (1 - (now - state[0]) / period) + state[2]
+
+
+# Seconds until one more hit would be allowed
+def _retry_after(state, now, period, limit):
+    window_end = state[0] + period
+    if state[2] >= limit or state[1] == 0:
+        return window_end - now
+    # Solve prev * (1 - (t - start) / period) + curr < limit for t
+    t = state[0] + period * (1 - (limit - state[2]) / state[1])
+    return max(0.0, min(t, window_end) - now)
+
+
+# In-process limiter; checks are a dict lookup and never touch the database
+class MemoryRateLimiter:
+    def __init__(self, sweep_every=10000):
+        self._state = {}
+        self._periods = {}
+        self._lock = threading.Lock()
+        self._sweep_every = sweep_every
+        self._calls = 0
+
+    def hit(self, key, limit, period, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            state = _slide(self._state.get(key), now, period)
+            if _estimate(state, now, period) >= limit:
+                self._state[key] = state
+                return False, _retry_after(state, now, period, limit)
+            state[2] += 1
+            self._state[key] = state
+            self._periods[key] = period
+            self._calls += 1
+            if self._calls >= self._sweep_every:
+                self._calls = 0
+                self._sweep(now)
+        return True, 0.0
+
+    # Take back an allowed hit whose request was never served
+    def unhit(self, key, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                return
+            state = _slide(state, now, self._periods.get(key, 1))
+            if state[2] > 0:
+                state[2] -= 1
+            elif state[1] > 0:
+                state[1] -= 1
+            self._state[key] = state
+
+    # Drop keys whose counters can no longer affect a decision
+    def _sweep(self, now):
+        expired = [key for key, state in self._state.items() if now - state[0] >= 2 * self._periods.get(key, 0)]
+        for key in expired:
+            del self._state[key]
+            self._periods.pop(key, None)
+
+    def __len__(self):
+        return len(self._state)
+
+
+# Shared limiter for multi-process deployments: one upserted counter row per (user, command).
+# Runs on the shared Database, so it also works when that is backed by PostgreSQL.
+class SQLiteRateLimiter:
+    def __init__(self, db):
+        self._db = db
+
+    def hit(self, key, limit, period, now=None):
+        now = time.time() if now is None else now
+        user_id, command = key
+        with self._db.transaction() as cur:
+            row = cur.execute("SELECT window_start, prev_count, curr_count FROM rate_limit_counters WHERE user_id = ? AND command = ?",
+                              (user_id, command)).fetchone()
+            state = _slide(list(row) if row else None, now, period)
+            allowed = _estimate(state, now, period) < limit
+            if allowed:
+                state[2] += 1
+            cur.execute(
+                "INSERT INTO rate_limit_counters (user_id, command, window_start, prev_count, curr_count) VALUES (?,?,?,?,?) "
+                "ON CONFLICT(user_id, command) DO UPDATE SET window_start = excluded.window_start, "
+                "prev_count = excluded.prev_count, curr_count = excluded.curr_count",
+                (user_id, command, state[0], state[1], state[2]))
+        return (True, 0.0) if allowed else (False, _retry_after(state, now, period, limit))
+
+
+_REDIS_HIT = """
+local now, period, limit = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local window = now - now % period
+local state = redis.call('HMGET', KEYS[1], 'start', 'prev', 'curr')
+local start, prev, curr = tonumber(state[1]), tonumber(state[2]) or 0, tonumber(state[3]) or 0
+if start == nil or window - start >= 2 * period then
+    start, prev, curr = window, 0, 0
+elseif window ~= start then
+    start, prev, curr = window, curr, 0
+end
+local allowed = 0
+if prev * (1 - (now - start) / period) + curr < limit then
+    curr = curr + 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'start', tostring(start), 'prev', prev, 'curr', curr)
+redis.call('PEXPIRE', KEYS[1], math.ceil(2 * period * 1000))
+return {allowed, tostring(start), prev, curr}
+"""
+
+
+# Shared limiter on a Redis-compatible server: the same sliding window, updated atomically
+# by a server-side script in one round trip
+class RedisRateLimiter:
+    def __init__(self, client, prefix="bot:ratelimit:"):
+        self._hit = client.register_script(_REDIS_HIT)
+        self.prefix = prefix
+
+    def hit(self, key, limit, period, now=None):
+        now = time.time() if now is None else now
+        user_id, command = key
+        allowed, start, prev, curr = self._hit(keys=[f"{self.prefix}{user_id}:{command}"], args=[repr(now), repr(float(period)), limit])
+        if allowed:
+            return True, 0.0
+        return False, _retry_after([float(start), int(prev), int(curr)], now, period, limit)
+
+
+# Token bucket for smoothing a steady rate with bursts of up to `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    # Take a token; returns 0 on success, otherwise seconds until one is available
+    def take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    # Give back a token taken for a send that didn't happen
+    def refund(self):
+        self._tokens = min(self.capacity, self._tokens + 1)
+
+
+# Per-command limits on top of a pluggable backend
+class RateLimiter:
+    def __init__(self, backend, limits=None, default=RateLimit(5, 3600)):
+        self.backend = backend
+        self.limits = limits or {}
+        self.default = default
+
+    def check(self, user_id, command):
+        rule = self.limits.get(command, self.default)
+        allowed, retry_after = self.backend.hit((user_id, command), rule.limit, rule.period)
+        if allowed:
+            return True, ""
+        return False, f"Rate limit exceeded. Try again in {_format_wait(retry_after)}."
+
+
+def _format_wait(seconds):
+    if seconds < 60:
+        return f"{max(1, math.ceil(seconds))} seconds"
+    minutes = math.ceil(seconds / 60)
+    return f"{minutes} minute{'s' if minutes != 1 else ''}"
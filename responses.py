@@ -0,0 +1,48 @@
+import hashlib
+
+from fastapi.responses import JSONResponse, Response
+from starlette.middleware.gzip import GZipMiddleware
+
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:  # same output through the standard json module, just slower
+    FastJSONResponse = JSONResponse
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+
+# Brotli for clients that accept it (falling back to gzip) when brotli-asgi is installed,
+# gzip otherwise. Bodies under `minimum_size` bytes are sent as they are.
+def add_compression(app, minimum_size=500):
+    if BrotliMiddleware is not None:
+        app.add_middleware(BrotliMiddleware, minimum_size=minimum_size, gzip_fallback=True)
+        return "br"
+    app.add_middleware(GZipMiddleware, minimum_size=minimum_size)
+    return "gzip"
+
+
+# Weak comparison per RFC 9110: a W/ prefix on either side doesn't matter
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tag = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in header.split(","))
+
+
+# JSON response with an ETag derived from the serialized body; 304 with no body when the
+# client already has it. The body is still built, but nothing is sent over the network.
+def conditional_json(request, content, cache_control="private, max-age=5"):
+    response = FastJSONResponse(content=content)
+    etag = f'W/"{hashlib.blake2b(response.body, digest_size=12).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class Policy:
+    __slots__ = ("table", "days", "mode", "credits_column", "key")
+
+    # mode is "delete" or "rollup"; rolled-up rows are summed into daily_activity first.
+    # key is the column deleted rows are picked by; None for tables without an id column,
+    # which use the row's physical id (rowid, or ctid on PostgreSQL) and can only be deleted
+    def __init__(self, table, days, mode="delete", credits_column=None, key="id"):
+        self.table = table
+        self.days = days
+        self.mode = mode
+        self.credits_column = credits_column
+        self.key = key
+
+    def __repr__(self):
+        return f"Policy({self.table}, {self.days}d, {self.mode})"
+
+
+DEFAULT_POLICIES = (
+    Policy("rate_limits", 2),
+    Policy("spam_logs", 30),
+    Policy("game_joins", 30, "rollup"),
+    Policy("crypto_hacks", 30, "rollup", "credits_earned"),
+    Policy("dynamic_quizzes", 90, "rollup", "credits"),
+    # Questions seen long enough ago may be served to the user again
+    Policy("quiz_seen", 90, key=None),
+)
+
+
+# Apply "table=days,..." overrides to the default policies
+def parse_policies(spec, defaults=DEFAULT_POLICIES):
+    days = {}
+    for item in (spec or "").split(","):
+        table, _, value = item.strip().partition("=")
+        if table and value:
+            days[table] = float(value)
+    return [Policy(p.table, days.get(p.table, p.days), p.mode, p.credits_column, p.key) for p in defaults]
+
+
+# Deletes or rolls up old rows in chunks (one short transaction each, so writers are never
+# blocked for long), then returns free pages to the OS with an incremental VACUUM. A database
+# created before incremental auto-vacuum is only converted offline (`--convert-vacuum`).
+class Retention:
+    def __init__(self, db, policies=DEFAULT_POLICIES, chunk_size=1000, pause=0.05, vacuum_pages=2000):
+        self._db = db
+        self.policies = list(policies)
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self._stopped = threading.Event()
+        self._thread = None
+        # (name, function) maintenance jobs run after the policies on every pass, e.g. counter
+        # reconciliation; the function's return value goes into the report
+        self.jobs = []
+
+    def start(self, interval):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    def run(self, now=None):
+        now = now or datetime.now()
+        started = time.monotonic()
+        before = self._file_size()
+        report = {"tables": {}}
+        for policy in self.policies:
+            if self._stopped.is_set():
+                break
+            cutoff = (now - timedelta(days=policy.days)).isoformat()
+            try:
+                if policy.mode == "rollup":
+                    rows = self._rollup(policy, cutoff)
+                else:
+                    rows = self._delete(policy, cutoff)
+            except Exception as e:
+                logger.error(f"Retention failed for {policy.table}: {e}")
+                continue
+            report["tables"][policy.table] = {"mode": policy.mode, "rows": rows}
+        for name, job in self.jobs:
+            if self._stopped.is_set():
+                break
+            try:
+                report[name] = job()
+            except Exception as e:
+                logger.error(f"Maintenance job {name} failed: {e}")
+        self._vacuum()
+        report["bytes_reclaimed"] = max(0, before - self._file_size())
+        report["seconds"] = round(time.monotonic() - started, 3)
+        logger.info(f"Retention run: {report}")
+        return report
+
+    def _delete(self, policy, cutoff):
+        key = policy.key or ("rowid" if self._db.dialect == "sqlite" else "ctid")
+        total = 0
+        while not self._stopped.is_set():
+            deleted = self._db.execute(f"DELETE FROM {policy.table} WHERE {key} IN "
+                                       f"(SELECT {key} FROM {policy.table} WHERE created_at < ? ORDER BY {key} LIMIT ?)",
+                                       (cutoff, self.chunk_size))
+            total += max(deleted, 0)
+            if deleted < self.chunk_size:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def _rollup(self, policy, cutoff):
+        credits = policy.credits_column or "0"
+        total = 0
+        while not self._stopped.is_set():
+            with self._db.transaction() as cur:
+                rows = cur.execute(f"SELECT id, user_id, created_at, {credits} FROM {policy.table} "
+                                   f"WHERE created_at < ? ORDER BY id LIMIT ?", (cutoff, self.chunk_size)).fetchall()
+                if not rows:
+                    break
+                buckets = defaultdict(lambda: [0, 0])
+                for _, user_id, created_at, amount in rows:
+                    bucket = buckets[(user_id, str(created_at)[:10])]
+                    bucket[0] += 1
+                    bucket[1] += amount or 0
+                cur.executemany("INSERT INTO daily_activity (user_id, source, day, events, credits) VALUES (?,?,?,?,?) "
+                                "ON CONFLICT(user_id, source, day) DO UPDATE SET "
+                                "events = daily_activity.events + excluded.events, credits = daily_activity.credits + excluded.credits",
+                                [(user_id, policy.table, day, events, amount) for (user_id, day), (events, amount) in buckets.items()])
+                cur.execute(f"DELETE FROM {policy.table} WHERE id IN ({','.join('?' * len(rows))})", tuple(row[0] for row in rows))
+            total += len(rows)
+            if len(rows) < self.chunk_size:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def _vacuum(self):
+        if self._db.dialect != "sqlite":
+            return
+        try:
+            if self._db.fetchval("PRAGMA auto_vacuum") != 2:
+                # A full VACUUM would hold the write lock for the whole rewrite; that is left to
+                # convert_to_incremental_vacuum(), run offline
+                logger.warning("Database isn't in incremental auto-vacuum mode; skipping the vacuum. "
+                               "Run `python retention.py --convert-vacuum` with the bot stopped to switch it over.")
+                return
+            for _ in range(1000):
+                if self._stopped.is_set() or not self._db.fetchval("PRAGMA freelist_count"):
+                    break
+                # Each step of the pragma frees one page, so it has to be run to completion
+                self._db.fetchall(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+                time.sleep(self.pause)
+        except Exception as e:
+            logger.error(f"Incremental vacuum failed: {e}")
+
+    # Databases created before auto_vacuum=INCREMENTAL need one full VACUUM to switch over.
+    # It rewrites the whole file under an exclusive lock, so run it with the bot stopped.
+    def convert_to_incremental_vacuum(self):
+        if self._db.dialect != "sqlite" or self._db.fetchval("PRAGMA auto_vacuum") == 2:
+            return False
+        logger.info("Converting database to incremental auto-vacuum")
+        self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._db.execute("VACUUM")
+        return True
+
+    def _file_size(self):
+        if self._db.dialect != "sqlite":
+            return 0
+        return self._db.fetchval("PRAGMA page_count") * self._db.fetchval("PRAGMA page_size")
+
+    def _loop(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.run()
+            except Exception as e:
+                logger.error(f"Retention run failed: {e}")
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    from db import Database
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = Database.from_env()
+    retention = Retention(db, parse_policies(os.getenv("RETENTION_DAYS")))
+    if "--convert-vacuum" in sys.argv:
+        retention.convert_to_incremental_vacuum()
+    retention.run()
+    db.close()
@@ -0,0 +1,222 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:  # only needed for STATE_BACKEND=redis
+    redis = None
+
+
+# State shared between the workers of a deployment, behind one small interface:
+#   claim(key, ttl) / release(key)   set-if-absent with expiry (update dedup)
+#   lease(name, owner, ttl)          acquire or renew an expiring lock (shard ownership)
+#   push(name, payloads) / pop(name, timeout, limit)   FIFO queues (updates routed to a shard);
+#                                    a timeout of 0 returns at once when the queue is empty
+#   publish(events) / events(cursor, timeout)          broadcast log (cache invalidation)
+# `shared` is False for the in-process backend, where there is nobody to tell.
+
+# Single process: everything lives in this process
+class MemoryState:
+    shared = False
+
+    def __init__(self):
+        self._claims = {}
+        self._leases = {}
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            if self._claims.get(key, 0) > now:
+                return False
+            self._claims[key] = now + ttl
+            if len(self._claims) > 100000:
+                self._claims = {k: expires for k, expires in self._claims.items() if expires > now}
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._claims.pop(key, None)
+
+    def lease(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            holder = self._leases.get(name)
+            if holder is not None and holder[0] != owner and holder[1] > now:
+                return False
+            self._leases[name] = (owner, now + ttl)
+            return True
+
+    def push(self, name, payloads):
+        with self._lock:
+            q = self._queues.setdefault(name, queue.Queue())
+        for payload in payloads:
+            q.put(payload)
+
+    def pop(self, name, timeout, limit=100):
+        with self._lock:
+            q = self._queues.setdefault(name, queue.Queue())
+        try:
+            items = [q.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(items) < limit:
+            try:
+                items.append(q.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def publish(self, events):
+        pass
+
+    def events(self, cursor, timeout):
+        time.sleep(timeout)
+        return cursor, []
+
+
+# Tables in the app database (migration 7): shared by every worker on the host with SQLite,
+# and by every node with PostgreSQL. Readers poll; nothing here holds a lock for long.
+class DatabaseState:
+    shared = True
+
+    def __init__(self, db, retention=300):
+        self._db = db
+        self.retention = retention
+        self._claims = 0
+
+    def claim(self, key, ttl):
+        now = time.time()
+        with self._db.transaction() as cur:
+            cur.execute("INSERT INTO shared_claims (key, expires) VALUES (?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET expires = excluded.expires WHERE shared_claims.expires < ?",
+                        (key, now + ttl, now))
+            claimed = cur.rowcount == 1
+        self._claims += 1
+        if self._claims % 1000 == 0:
+            self._db.execute("DELETE FROM shared_claims WHERE expires < ?", (now,))
+        return claimed
+
+    def release(self, key):
+        self._db.execute("DELETE FROM shared_claims WHERE key = ?", (key,))
+
+    def lease(self, name, owner, ttl):
+        now = time.time()
+        with self._db.transaction() as cur:
+            cur.execute("INSERT INTO shared_leases (name, owner, expires) VALUES (?, ?, ?) "
+                        "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                        "WHERE shared_leases.owner = excluded.owner OR shared_leases.expires < ?",
+                        (name, owner, now + ttl, now))
+            return cur.rowcount == 1
+
+    def push(self, name, payloads):
+        self._db.executemany("INSERT INTO shared_queue (name, payload) VALUES (?, ?)", [(name, payload) for payload in payloads])
+
+    # One consumer per queue (the shard owner), so reading and deleting needs no row locks
+    def pop(self, name, timeout, limit=100):
+        rows = self._db.fetchall("SELECT id, payload FROM shared_queue WHERE name = ? ORDER BY id LIMIT ?", (name, limit))
+        if not rows:
+            if timeout > 0:
+                time.sleep(timeout)
+            return []
+        self._db.execute("DELETE FROM shared_queue WHERE name = ? AND id <= ?", (name, rows[-1][0]))
+        return [row[1] for row in rows]
+
+    def publish(self, events):
+        now = time.time()
+        with self._db.transaction() as cur:
+            cur.executemany("INSERT INTO shared_events (origin, kind, payload, created) VALUES (?, ?, ?, ?)",
+                            [(origin, kind, json.dumps(args), now) for origin, kind, args in events])
+            cur.execute("DELETE FROM shared_events WHERE created < ?", (now - self.retention,))
+
+    # Events after `cursor` (None: start from the current end) as (new cursor, [(origin, kind, args)])
+    def events(self, cursor, timeout):
+        if cursor is None:
+            return self._db.fetchval("SELECT MAX(id) FROM shared_events", (), 0) or 0, []
+        rows = self._db.fetchall("SELECT id, origin, kind, payload FROM shared_events WHERE id > ? ORDER BY id LIMIT 1000", (cursor,))
+        if not rows:
+            time.sleep(timeout)
+            return cursor, []
+        return rows[-1][0], [(origin, kind, json.loads(payload)) for _, origin, kind, payload in rows]
+
+
+_RENEW_LEASE = """
+local holder = redis.call('GET', KEYS[1])
+if holder == false or holder == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+# Any Redis-compatible server (Redis, Valkey, KeyDB, a local redis-server in tests).
+# Queues are lists, the event log is a capped stream.
+class RedisState:
+    shared = True
+
+    def __init__(self, url, prefix="bot:", stream_length=10000):
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND=redis needs the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.stream_length = stream_length
+        self._renew = self.client.register_script(_RENEW_LEASE)
+
+    def claim(self, key, ttl):
+        return bool(self.client.set(self.prefix + key, 1, nx=True, px=int(ttl * 1000)))
+
+    def release(self, key):
+        self.client.delete(self.prefix + key)
+
+    def lease(self, name, owner, ttl):
+        return bool(self._renew(keys=[self.prefix + "lease:" + name], args=[owner, int(ttl * 1000)]))
+
+    def push(self, name, payloads):
+        if payloads:
+            self.client.rpush(self.prefix + "queue:" + name, *payloads)
+
+    def pop(self, name, timeout, limit=100):
+        key = self.prefix + "queue:" + name
+        if timeout <= 0:
+            return [item.decode() for item in self.client.lpop(key, limit) or []]
+        first = self.client.blpop([key], timeout=max(1, int(timeout)))
+        if first is None:
+            return []
+        rest = self.client.lpop(key, limit - 1) if limit > 1 else None
+        return [item.decode() for item in [first[1]] + (rest or [])]
+
+    def publish(self, events):
+        pipe = self.client.pipeline(transaction=False)
+        for origin, kind, args in events:
+            pipe.xadd(self.prefix + "events", {"origin": origin, "kind": kind, "payload": json.dumps(args)},
+                      maxlen=self.stream_length, approximate=True)
+        pipe.execute()
+
+    def events(self, cursor, timeout):
+        key = self.prefix + "events"
+        if cursor is None:
+            last = self.client.xrevrange(key, count=1)
+            return (last[0][0].decode() if last else "0-0"), []
+        reply = self.client.xread({key: cursor}, count=1000, block=int(timeout * 1000))
+        if not reply:
+            return cursor, []
+        entries = reply[0][1]
+        events = [(fields[b"origin"].decode(), fields[b"kind"].decode(), json.loads(fields[b"payload"])) for _, fields in entries]
+        return entries[-1][0].decode(), events
+
+
+def create_state(backend, db=None, url=None):
+    if backend == "memory":
+        return MemoryState()
+    if backend in ("sqlite", "database"):
+        return DatabaseState(db)
+    if backend == "redis":
+        return RedisState(url)
+    raise ValueError(f"Unknown state backend {backend}")
@@ -0,0 +1,122 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from achievements import AchievementEngine, award_ref
+from db import Database
+from ledger import Ledger
+from migrations import run_migrations
+from write_behind import WriteBehindBuffer
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    run_migrations(db)
+    for user_id in (1, 2):
+        db.execute("INSERT INTO users (user_id, username, credits, streak) VALUES (?, ?, 0, 0)", (user_id, f"u{user_id}"))
+    yield db
+    db.close()
+
+
+# Stands in for the profile cache: what the database says, plus quizzes counted by the test
+class Source:
+    def __init__(self, db):
+        self.db = db
+        self.quizzes = {}
+        self.loads = 0
+
+    def __call__(self, user_id):
+        self.loads += 1
+        streak, credits = self.db.fetchone("SELECT streak, credits FROM users WHERE user_id = ?", (user_id,))
+        names = [row[0] for row in self.db.fetchall("SELECT name FROM achievements WHERE user_id = ? ORDER BY id", (user_id,))]
+        counters = {"streak": streak or 0, "quizzes": self.quizzes.get(user_id, 0), "credits": credits or 0, "followers": 0}
+        return counters, names
+
+
+def engine(db, source, **kwargs):
+    return AchievementEngine(db, WriteBehindBuffer(db, mode="sync"), source, **kwargs)
+
+
+def awards(db, user_id):
+    return [row[0] for row in db.fetchall("SELECT name FROM achievements WHERE user_id = ? ORDER BY id", (user_id,))]
+
+
+def credits(db, user_id):
+    return db.fetchval("SELECT credits FROM users WHERE user_id = ?", (user_id,))
+
+
+def test_award_reached_across_an_evict_and_reload_is_granted_once(db):
+    source = Source(db)
+    achievements = engine(db, source, capacity=1)
+    for _ in range(9):
+        source.quizzes[1] = source.quizzes.get(1, 0) + 1
+        assert achievements.add(1, quizzes=1) == []
+    # User 2 pushes user 1 out; the reload already includes the 10th quiz
+    achievements.add(2, quizzes=1)
+    source.quizzes[1] = 10
+    assert [rule.name for rule in achievements.add(1, quizzes=1)] == ["Quiz Rookie"]
+    assert source.loads == 3
+    # Evicted again after the award: reloading sees it in the achievements table
+    achievements.forget(1)
+    source.quizzes[1] = 11
+    assert achievements.add(1, quizzes=1) == []
+    assert awards(db, 1) == ["Quiz Rookie"]
+    assert credits(db, 1) == 25
+
+
+def test_two_workers_racing_on_one_user_award_once(db):
+    db.execute("UPDATE users SET streak = 5 WHERE user_id = 1")
+    engines = [engine(db, Source(db)) for _ in range(2)]
+    start = threading.Barrier(2)
+    results = []
+
+    def run(achievements):
+        start.wait()
+        results.append([rule.name for rule in achievements.add(1, {"streak": 5})])
+
+    threads = [threading.Thread(target=run, args=(achievements,)) for achievements in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Both may believe they awarded it; the database only takes it once
+    assert ["Quiz Streaker"] in results
+    assert awards(db, 1) == ["Quiz Streaker"]
+    assert credits(db, 1) == 50
+    assert Ledger(db).verify() == []
+
+
+def test_a_reset_streak_does_not_award_again(db):
+    achievements = engine(db, Source(db))
+    for streak in range(1, 6):
+        db.execute("UPDATE users SET streak = ? WHERE user_id = 1", (streak,))
+        result = achievements.add(1, {"streak": streak})
+    assert [rule.name for rule in result] == ["Quiz Streaker"]
+    # A missed day starts the streak over; climbing back to 5 earns nothing new
+    for streak in range(1, 6):
+        assert achievements.add(1, {"streak": streak}) == []
+    assert awards(db, 1) == ["Quiz Streaker"]
+
+
+def test_backfill_grants_missing_awards_only(db):
+    db.execute("UPDATE users SET streak = 31 WHERE user_id = 1")
+    db.execute("UPDATE users SET streak = 2 WHERE user_id = 2")
+    # Quiz Streaker was awarded before the backfill ran
+    engine(db, Source(db)).add(1, {"streak": 5})
+    assert awards(db, 1) == ["Quiz Streaker", "Unstoppable"]
+    db.execute("DELETE FROM achievements WHERE name = 'Unstoppable'")
+    db.execute("DELETE FROM credit_ledger WHERE ref = ?", (award_ref(1, "Unstoppable"),))
+    db.execute("UPDATE users SET credits = 50 WHERE user_id = 1")
+    achievements = engine(db, Source(db))
+    assert achievements.backfill(batch=1) == 1
+    assert sorted(awards(db, 1)) == ["Quiz Streaker", "Unstoppable"]
+    assert credits(db, 1) == 350
+    assert achievements.backfill() == 0
+    assert credits(db, 1) == 350
+    assert awards(db, 2) == []
+    assert Ledger(db).verify() == []
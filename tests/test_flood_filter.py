@@ -0,0 +1,97 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from flood_filter import ALLOWED, CHAT_FLOOD, DUPLICATE, MUTED, USER_FLOOD, FloodFilter, parse_mutes
+from migrations import run_migrations
+from rate_limiter import RateLimit
+from write_behind import WriteBehindBuffer
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    run_migrations(db)
+    for user_id in (1, 2):
+        db.execute("INSERT INTO users (user_id, username, credits) VALUES (?, ?, 0)", (user_id, f"u{user_id}"))
+    yield db
+    db.close()
+
+
+def spam_logs(db):
+    return db.fetchall("SELECT user_id, count FROM spam_logs ORDER BY user_id")
+
+
+def test_parse_mutes():
+    assert parse_mutes("30, 300,1800") == (30.0, 300.0, 1800.0)
+    assert parse_mutes("") == (30.0,)
+
+
+def test_user_flood_mutes_with_longer_strikes():
+    flood = FloodFilter(user_limit=RateLimit(3, 10), mutes=(30, 300))
+    for i in range(3):
+        assert flood.check(1, 1, f"hello {i}", now=100) == (ALLOWED, 0)
+    assert flood.check(1, 1, "hello 3", now=100) == (USER_FLOOD, 30)
+    # Only the message that earned the mute reports it
+    assert flood.check(1, 1, "hello 4", now=120) == (MUTED, 0)
+    assert flood.is_muted(1, now=120)
+    assert flood.check(1, 1, "hello 5", now=131) == (ALLOWED, 0)
+    for i in range(2):
+        flood.check(1, 1, f"again {i}", now=131)
+    assert flood.check(1, 1, "again 2", now=131) == (USER_FLOOD, 300)
+
+
+def test_repeated_text_is_a_duplicate_but_commands_are_not():
+    flood = FloodFilter(duplicate_limit=RateLimit(2, 60))
+    for _ in range(5):
+        assert flood.check(1, 1, "/quiz", now=100)[0] == ALLOWED
+    assert flood.check(1, 1, "Buy now", now=100)[0] == ALLOWED
+    assert flood.check(1, 1, "buy   NOW", now=101)[0] == ALLOWED
+    assert flood.check(1, 1, "buy now", now=102) == (DUPLICATE, 30)
+
+
+def test_busy_group_drops_without_a_strike():
+    flood = FloodFilter(chat_limit=RateLimit(2, 10))
+    assert flood.check(1, -5, "a", now=100)[0] == ALLOWED
+    assert flood.check(2, -5, "b", now=100)[0] == ALLOWED
+    assert flood.check(1, -5, "c", now=100) == (CHAT_FLOOD, 0)
+    assert not flood.is_muted(1, now=100)
+
+
+def test_refund_takes_back_an_allowed_message():
+    flood = FloodFilter(user_limit=RateLimit(1, 10), duplicate_limit=RateLimit(1, 60))
+    assert flood.check(1, 1, "hi", now=100)[0] == ALLOWED
+    flood.refund(1, 1, "hi", now=100)
+    # The redelivery counts once, not as a second message or a repeat
+    assert flood.check(1, 1, "hi", now=100)[0] == ALLOWED
+
+
+def test_exempt_users_are_never_limited():
+    flood = FloodFilter(user_limit=RateLimit(1, 10), exempt=(1,))
+    for _ in range(5):
+        assert flood.check(1, 1, "same", now=100) == (ALLOWED, 0)
+
+
+def test_check_never_writes_and_logs_are_flushed_by_one_caller(db):
+    writes = WriteBehindBuffer(db, mode="sync")
+    flood = FloodFilter(writes, user_limit=RateLimit(1, 10), log_interval=60)
+    flood._logged = 0
+    flood.check(1, 1, "a", now=100)
+    for text in ("b", "c", "d"):
+        flood.check(1, 1, text, now=100)
+    flood.check(2, 2, "a", now=100)
+    flood.check(2, 2, "b", now=100)
+    # In sync mode a write is SQL on the caller's thread, so check() leaves it to flush_logs()
+    assert spam_logs(db) == []
+    assert flood.logs_due(now=100)
+    assert not flood.logs_due(now=101)
+    flood.flush_logs(now=100)
+    assert spam_logs(db) == [(1, 3), (2, 1)]
+    assert flood.dropped[USER_FLOOD] == 2 and flood.dropped[MUTED] == 2
+    flood.flush_logs(now=100)
+    assert spam_logs(db) == [(1, 3), (2, 1)]
+    assert flood.logs_due(now=160)
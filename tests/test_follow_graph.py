@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from follow_graph import FollowGraph
+from migrations import run_migrations
+from retention import Retention
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    run_migrations(db)
+    for user_id in (1, 2, 3):
+        db.execute("INSERT INTO users (user_id, username, credits) VALUES (?, ?, 0)", (user_id, f"u{user_id}"))
+    yield db
+    db.close()
+
+
+def followers(db, user_id):
+    return db.fetchval("SELECT followers FROM social_profiles WHERE user_id = ?", (user_id,))
+
+
+def test_follow_moves_the_counter_once(db):
+    graph = FollowGraph(db)
+    assert graph.follow(1, 2) is True
+    assert graph.follow(1, 2) is False
+    assert graph.follow(3, 2) is True
+    assert graph.counts(2) == (2, 0)
+    assert graph.unfollow(1, 2) is True
+    assert graph.unfollow(1, 2) is False
+    assert followers(db, 2) == 1
+
+
+def test_follow_of_an_unknown_user_creates_nothing(db):
+    graph = FollowGraph(db)
+    assert graph.follow(1, 42) is None
+    assert followers(db, 42) is None
+    assert not graph.is_following(1, 42)
+
+
+def test_reconcile_repairs_drifted_counters_from_the_retention_pass(db):
+    graph = FollowGraph(db)
+    graph.follow(1, 2)
+    graph.follow(3, 2)
+    graph.follow(2, 3)
+    db.execute("UPDATE social_profiles SET followers = 7 WHERE user_id = 2")
+    db.execute("UPDATE social_profiles SET followers = 0 WHERE user_id = 3")
+    retention = Retention(db, policies=())
+    retention.jobs.append(("follower_counters", graph.reconcile))
+    assert retention.run()["follower_counters"] == 2
+    assert (followers(db, 2), followers(db, 3)) == (2, 1)
+    assert graph.reconcile([2, 3]) == 0
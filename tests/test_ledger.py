@@ -0,0 +1,97 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from ledger import APPLIED, DUPLICATE, INSUFFICIENT, Ledger
+from migrations import run_migrations
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    run_migrations(db)
+    for user_id in (1, 2):
+        db.execute("INSERT INTO users (user_id, username, credits) VALUES (?, ?, 0)", (user_id, f"u{user_id}"))
+    yield db
+    db.close()
+
+
+def balance(db, user_id):
+    return db.fetchval("SELECT credits FROM users WHERE user_id = ?", (user_id,))
+
+
+def test_concurrent_debits_never_overdraw(db):
+    ledger = Ledger(db)
+    assert ledger.apply(1, 150, "test", "seed") == (APPLIED, 150)
+    results = []
+    start = threading.Barrier(10)
+
+    def buy(i):
+        start.wait()
+        results.append(ledger.apply(1, -60, "script_purchase", f"order-{i}")[0])
+
+    threads = [threading.Thread(target=buy, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [APPLIED] * 2 + [INSUFFICIENT] * 8
+    assert balance(db, 1) == 30
+    assert ledger.verify() == []
+
+
+def test_duplicate_reason_and_ref_applies_once(db):
+    ledger = Ledger(db)
+    assert ledger.apply(1, 20, "daily_quiz", "1:5") == (APPLIED, 20)
+    assert ledger.apply(1, 20, "daily_quiz", "1:5") == (DUPLICATE, None)
+    assert ledger.apply(1, 20, "crypto_hacks", "1:5")[0] == APPLIED
+    assert ledger.apply(1, -10, "script_purchase", "o1")[0] == APPLIED
+    assert ledger.apply(1, -10, "script_purchase", "o1") == (DUPLICATE, None)
+    assert balance(db, 1) == 30
+    assert len(ledger.history(1)) == 3
+
+
+def test_debit_of_an_unknown_user_is_insufficient(db):
+    assert Ledger(db).apply(99, -1, "script_purchase", "o1") == (INSUFFICIENT, None)
+
+
+def test_grant_many_skips_duplicates_and_credits_the_rest(db):
+    ledger = Ledger(db)
+    ledger.apply(1, 10, "achievement", "1:Quiz Rookie")
+    skipped = ledger.grant_many([
+        (1, 10, "achievement", "1:Quiz Rookie"),
+        (1, 5, "daily_quiz", "1:7"),
+        (2, 7, "daily_quiz", "2:8"),
+        (2, 7, "daily_quiz", "2:8"),
+        (2, 3, "bonus", None),
+        (2, 3, "bonus", None),
+    ])
+    assert skipped == [(1, 10, "achievement", "1:Quiz Rookie"), (2, 7, "daily_quiz", "2:8")]
+    assert (balance(db, 1), balance(db, 2)) == (15, 13)
+    assert ledger.verify() == []
+
+
+def test_verify_finds_drift_and_rebuild_repairs_it(db):
+    ledger = Ledger(db)
+    ledger.apply(1, 40, "test", "a")
+    ledger.apply(2, 5, "test", "b")
+    db.execute("UPDATE users SET credits = 1000 WHERE user_id = 1")
+    assert ledger.verify() == [(1, 1000, 40)]
+    assert ledger.rebuild() == 1
+    assert ledger.verify() == []
+    assert balance(db, 1) == 40
+    assert ledger.rebuild() == 0
+
+
+def test_open_balances_records_pre_ledger_credits_once(db):
+    db.execute("UPDATE users SET credits = 70 WHERE user_id = 2")
+    ledger = Ledger(db)
+    assert ledger.verify() == [(2, 70, 0)]
+    assert ledger.open_balances() == 1
+    assert ledger.open_balances() == 0
+    assert ledger.verify() == []
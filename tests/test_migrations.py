@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from migrations import MIGRATIONS, check_query_plans, run_migrations, schema_is_current
+
+
+def test_every_query_shape_uses_an_index(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    try:
+        run_migrations(db)
+        assert schema_is_current(db)
+        assert check_query_plans(db) == []
+    finally:
+        db.close()
+
+
+def test_migrations_are_idempotent(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    try:
+        run_migrations(db)
+        run_migrations(db)
+        versions = [row[0] for row in db.fetchall("SELECT version FROM schema_migrations ORDER BY version")]
+        assert versions == [version for version, _, _ in MIGRATIONS]
+    finally:
+        db.close()
+
+
+def test_unused_indexes_are_dropped(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    try:
+        run_migrations(db)
+        indexes = {row[0] for row in db.fetchall("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert "idx_users_credits" not in indexes
+        assert "idx_rate_limits_user_command_created" not in indexes
+    finally:
+        db.close()
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import FakeUpstream
+from outbox import Outbox
+
+
+@pytest.fixture
+def upstream():
+    upstream = FakeUpstream(0, 0)
+    upstream.start()
+    yield upstream
+    upstream.stop()
+
+
+@pytest.fixture
+def make_outbox(upstream):
+    outboxes = []
+
+    def make(**kwargs):
+        outbox = Outbox("TOKEN", upstream.url, **kwargs)
+        outbox.start()
+        outboxes.append(outbox)
+        return outbox
+
+    yield make
+    for outbox in outboxes:
+        outbox.stop(timeout=5)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_each_chat_gets_its_messages_in_order(upstream, make_outbox):
+    outbox = make_outbox(senders=2, global_rate=1000, chat_rate=1000, chat_burst=1000)
+    for i in range(20):
+        for chat_id in (1, 2, 3):
+            assert outbox.send(chat_id, f"{chat_id}:{i}")
+    wait_for(lambda: len(upstream.messages) == 60)
+    for chat_id in (1, 2, 3):
+        texts = [text for _, chat, text in upstream.messages if chat == chat_id]
+        assert texts == [f"{chat_id}:{i}" for i in range(20)]
+    assert outbox.sent == 60
+
+
+def test_429_is_retried_after_retry_after(upstream, make_outbox):
+    outbox = make_outbox(senders=1, global_rate=1000, chat_rate=1000, chat_burst=1000)
+    upstream.rate_limits.append(0.5)
+    started = time.perf_counter()
+    outbox.send(1, "first")
+    outbox.send(1, "second")
+    wait_for(lambda: len(upstream.messages) == 2)
+    (first_at, _, first), (_, _, second) = upstream.messages
+    assert (first, second) == ("first", "second")
+    assert first_at - started >= 0.5
+    assert upstream.calls["sendMessage 429"] == 1
+    assert (outbox.sent, outbox.failed) == (2, 0)
+
+
+def test_a_chat_is_shaped_to_its_rate_after_the_burst(upstream, make_outbox):
+    outbox = make_outbox(senders=1, global_rate=1000, chat_rate=10, chat_burst=2)
+    started = time.perf_counter()
+    for i in range(6):
+        outbox.send(1, str(i))
+    wait_for(lambda: len(upstream.messages) == 6)
+    assert upstream.messages[-1][0] - started >= 0.35
+
+
+def test_global_rate_shapes_all_chats_together(upstream, make_outbox):
+    outbox = make_outbox(senders=3, global_rate=20, chat_rate=1000, chat_burst=1000)
+    started = time.perf_counter()
+    for chat_id in range(30):
+        outbox.send(chat_id, "hi")
+    wait_for(lambda: len(upstream.messages) == 30)
+    assert upstream.messages[-1][0] - started >= 0.45
+
+
+# Waiting on the global budget must not spend the chat's own token: with one chat token
+# every 20 seconds, a burned token would hold the second chat's message back that long
+def test_global_wait_keeps_the_chat_token(upstream, make_outbox):
+    outbox = make_outbox(senders=1, global_rate=1, chat_rate=0.05, chat_burst=1)
+    outbox.send(1, "drains the global bucket")
+    outbox.send(2, "waits for the global bucket")
+    wait_for(lambda: len(upstream.messages) == 2, timeout=5)
@@ -0,0 +1,123 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from migrations import run_migrations
+from rate_limiter import (MemoryRateLimiter, RateLimit, RateLimiter, SQLiteRateLimiter, TokenBucket, _estimate,
+                          _format_wait, _retry_after, _slide, parse_limits)
+
+KEY = (1, "newquiz")
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    run_migrations(db)
+    yield db
+    db.close()
+
+
+def test_slide_starts_carries_and_resets_windows():
+    assert _slide(None, 1003, 10) == [1000, 0, 0]
+    assert _slide([1000, 2, 5], 1009.9, 10) == [1000, 2, 5]
+    # The next window starts with the current count as its "previous"
+    assert _slide([1000, 2, 5], 1010, 10) == [1010, 5, 0]
+    # Two or more periods later nothing overlaps any more
+    assert _slide([1000, 2, 5], 1020, 10) == [1020, 0, 0]
+
+
+def test_estimate_weights_the_previous_window_by_its_overlap():
+    assert _estimate([1000, 10, 0], 1000, 10) == 10
+    assert _estimate([1000, 10, 3], 1002.5, 10) == pytest.approx(10.5)
+    assert _estimate([1000, 10, 3], 1010, 10) == pytest.approx(3)
+
+
+def test_retry_after_is_the_first_moment_a_hit_fits():
+    # The current window alone is full: wait for it to end
+    assert _retry_after([1000, 0, 4], 1003, 10, 4) == pytest.approx(7)
+    # Otherwise wait until the previous window's share drops below the remaining room
+    state = [1000, 8, 2]
+    wait = _retry_after(state, 1001, 10, 4)
+    assert _estimate(state, 1001 + wait, 10) == pytest.approx(4 - 1e-9, abs=1e-6)
+    assert _estimate(state, 1001 + wait - 0.01, 10) > 4 - 1
+
+
+def test_memory_limiter_allows_limit_hits_per_window_and_says_when_to_retry():
+    limiter = MemoryRateLimiter()
+    assert [limiter.hit(KEY, 3, 10, 1000 + i)[0] for i in range(4)] == [True, True, True, False]
+    allowed, retry = limiter.hit(KEY, 3, 10, 1004)
+    assert not allowed and retry == pytest.approx(6)
+    # Other keys have their own counters
+    assert limiter.hit((2, "newquiz"), 3, 10, 1004)[0]
+    # Retrying after the advertised wait succeeds once the old hits have slid out
+    assert limiter.hit(KEY, 3, 10, 1010 + 10 * (1 - 2 / 3))[0]
+
+
+def test_unhit_gives_back_an_allowed_hit():
+    limiter = MemoryRateLimiter()
+    for i in range(3):
+        limiter.hit(KEY, 3, 10, 1000 + i)
+    assert not limiter.hit(KEY, 3, 10, 1003)[0]
+    limiter.unhit(KEY, 1003)
+    assert limiter.hit(KEY, 3, 10, 1003)[0]
+    # After the window rolls over the hit is taken back from the previous window's count
+    limiter.unhit(KEY, 1011)
+    limiter.unhit((9, "unknown"), 1011)
+    assert limiter.hit(KEY, 3, 10, 1011)[0]
+
+
+def test_sweep_forgets_idle_keys():
+    limiter = MemoryRateLimiter(sweep_every=2)
+    limiter.hit(KEY, 3, 10, 1000)
+    limiter.hit((2, "crypto"), 3, 10, 1030)
+    assert len(limiter) == 1
+
+
+def test_sqlite_limiter_matches_the_memory_limiter(db):
+    shared, local = SQLiteRateLimiter(db), MemoryRateLimiter()
+    for offset in (0, 1, 2, 3, 4, 9, 10.5, 12, 15, 19.9, 21, 40):
+        for key in (KEY, (2, "newquiz")):
+            expected = local.hit(key, 4, 10, 1000 + offset)
+            allowed, retry = shared.hit(key, 4, 10, 1000 + offset)
+            assert allowed == expected[0]
+            assert retry == pytest.approx(expected[1])
+
+
+def test_sqlite_limiter_is_shared_between_instances(db):
+    first, second = SQLiteRateLimiter(db), SQLiteRateLimiter(db)
+    assert first.hit(KEY, 2, 10, 1000)[0]
+    assert second.hit(KEY, 2, 10, 1001)[0]
+    assert not first.hit(KEY, 2, 10, 1002)[0]
+
+
+def test_rate_limiter_uses_per_command_limits_and_formats_the_wait():
+    limiter = RateLimiter(MemoryRateLimiter(), parse_limits("newquiz=1/120, crypto=5/10"), default=RateLimit(2, 60))
+    assert limiter.check(1, "newquiz") == (True, "")
+    allowed, message = limiter.check(1, "newquiz")
+    assert not allowed and message.startswith("Rate limit exceeded. Try again in ")
+    assert limiter.check(1, "profile")[0] and limiter.check(1, "profile")[0]
+    assert not limiter.check(1, "profile")[0]
+
+
+def test_waits_are_rounded_up_for_users():
+    assert _format_wait(1.2) == "2 seconds"
+    assert _format_wait(59.1) == "60 seconds"
+    assert _format_wait(61) == "2 minutes"
+    assert _format_wait(60) == "1 minute"
+
+
+def test_token_bucket_bursts_refills_and_refunds():
+    bucket = TokenBucket(2, 3)
+    now = bucket._updated
+    assert [bucket.take(now) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(now) == pytest.approx(0.5)
+    assert bucket.take(now + 0.5) == 0
+    bucket.refund()
+    assert bucket.take(now + 0.5) == 0
+    for _ in range(10):
+        bucket.refund()
+    assert [bucket.take(now + 0.5) for _ in range(4)][-1] > 0
@@ -0,0 +1,37 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from migrations import run_migrations
+from retention import DEFAULT_POLICIES, Retention, parse_policies
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    run_migrations(db)
+    db.execute("INSERT INTO users (user_id, username, credits) VALUES (1, 'u1', 0)")
+    yield db
+    db.close()
+
+
+def test_parse_policies_overrides_days_only():
+    policies = {p.table: p for p in parse_policies("quiz_seen=30, spam_logs=7")}
+    assert policies["quiz_seen"].days == 30 and policies["quiz_seen"].key is None
+    assert policies["spam_logs"].days == 7
+    assert len(policies) == len(DEFAULT_POLICIES)
+
+
+def test_old_seen_questions_are_deleted_in_chunks(db):
+    now = datetime(2026, 6, 1)
+    old, recent = (now - timedelta(days=120)).isoformat(), (now - timedelta(days=10)).isoformat()
+    db.executemany("INSERT INTO quiz_seen (user_id, question_hash, created_at) VALUES (1, ?, ?)",
+                   [(f"old{i}", old) for i in range(5)] + [(f"new{i}", recent) for i in range(2)])
+    report = Retention(db, chunk_size=2, pause=0).run(now)
+    assert report["tables"]["quiz_seen"] == {"mode": "delete", "rows": 5}
+    assert sorted(row[0] for row in db.fetchall("SELECT question_hash FROM quiz_seen")) == ["new0", "new1"]
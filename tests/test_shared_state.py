@@ -0,0 +1,129 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cluster import Cluster
+from db import Database
+from migrations import run_migrations
+from rate_limiter import MemoryRateLimiter, RedisRateLimiter
+from shared_state import DatabaseState, RedisState
+
+
+# A throwaway Redis-compatible server on a free port; skipped when none is installed
+@pytest.fixture(scope="module")
+def redis_url():
+    pytest.importorskip("redis")
+    server = shutil.which(os.getenv("REDIS_SERVER", "redis-server"))
+    if server is None:
+        pytest.skip("no redis-server binary")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen([server, "--port", str(port), "--bind", "127.0.0.1", "--save", "", "--appendonly", "no"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"redis://127.0.0.1:{port}/0"
+    try:
+        import redis
+        client = redis.Redis.from_url(url)
+        for _ in range(100):
+            try:
+                client.ping()
+                break
+            except redis.ConnectionError:
+                time.sleep(0.05)
+        yield url
+    finally:
+        process.terminate()
+        process.wait(5)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    run_migrations(db)
+    yield db
+    db.close()
+
+
+@pytest.fixture(params=["database", "redis"])
+def state(request, db):
+    if request.param == "database":
+        return DatabaseState(db)
+    url = request.getfixturevalue("redis_url")
+    state = RedisState(url, prefix=f"test:{request.node.name}:")
+    state.client.flushdb()
+    return state
+
+
+def test_claim_and_release(state):
+    assert state.claim("update:1", 60)
+    assert not state.claim("update:1", 60)
+    state.release("update:1")
+    assert state.claim("update:1", 60)
+
+
+def test_lease_is_exclusive_until_it_expires(state):
+    assert state.lease("shard:0", "a", 60)
+    assert state.lease("shard:0", "a", 60)
+    assert not state.lease("shard:0", "b", 60)
+    assert state.lease("shard:1", "b", 0.05)
+    time.sleep(0.1)
+    assert state.lease("shard:1", "a", 60)
+
+
+def test_queue_is_fifo_and_pop_without_timeout_returns_at_once(state):
+    assert state.pop("updates:0", 0) == []
+    state.push("updates:0", ["1", "2"])
+    state.push("updates:0", ["3"])
+    assert state.pop("updates:0", 0, limit=2) == ["1", "2"]
+    assert state.pop("updates:0", 0.1) == ["3"]
+    started = time.monotonic()
+    assert state.pop("updates:0", 0) == []
+    assert time.monotonic() - started < 0.05
+
+
+def test_events_start_at_the_end_and_follow_publishes(state):
+    state.publish([("w1", "old", [0])])
+    cursor, events = state.events(None, 0.1)
+    assert events == []
+    state.publish([("w1", "leaderboard", ["apply_delta", [1, 5, True]]), ("w2", "profile", [7])])
+    cursor, events = state.events(cursor, 0.1)
+    assert events == [("w1", "leaderboard", ["apply_delta", [1, 5, True]]), ("w2", "profile", [7])]
+    assert state.events(cursor, 0.1)[1] == []
+
+
+def test_redis_rate_limiter_matches_the_memory_limiter(redis_url):
+    import redis
+    client = redis.Redis.from_url(redis_url)
+    client.flushdb()
+    shared, local = RedisRateLimiter(client), MemoryRateLimiter()
+    now = 1_000_000.0
+    for offset in (0, 1, 2, 3, 4, 9, 10.5, 12, 15, 19.9, 21, 40):
+        for _ in range(3):
+            expected = local.hit((1, "newquiz"), 4, 10, now + offset)
+            allowed, retry = shared.hit((1, "newquiz"), 4, 10, now + offset)
+            assert allowed == expected[0]
+            assert retry == pytest.approx(expected[1])
+
+
+# Two workers sharing one database: a chat's update forwarded by the other worker must not
+# be overtaken by a later update the owner receives itself
+def test_owner_submits_queued_updates_before_its_own(db):
+    submitted = []
+    owner, other = Cluster(DatabaseState(db), shards=2), Cluster(DatabaseState(db), shards=2)
+    for cluster, shard in ((owner, 0), (other, 1)):
+        cluster.shard = shard
+        cluster._submit = lambda item: submitted.append(item) or True
+        cluster._prepare = lambda payload: f"forwarded {payload}"
+    assert other.dispatch(2, "1", "local 1")
+    assert submitted == []
+    assert owner.dispatch(2, "2", "local 2")
+    assert submitted == ["forwarded 1", "local 2"]
+    assert (other.forwarded, owner.received) == (1, 1)
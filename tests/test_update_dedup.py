@@ -0,0 +1,89 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from migrations import run_migrations
+from shared_state import DatabaseState
+from update_dedup import UpdateDeduplicator
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    run_migrations(db)
+    yield db
+    db.close()
+
+
+def restarted(db, **kwargs):
+    dedup = UpdateDeduplicator(db, **kwargs)
+    dedup.load()
+    return dedup
+
+
+def test_redelivery_is_dropped(db):
+    dedup = restarted(db)
+    assert dedup.claim(5)
+    assert dedup.seen(5)
+    assert not dedup.claim(5)
+
+
+def test_watermark_survives_a_restart(db):
+    dedup = restarted(db)
+    for update_id in (10, 11, 12):
+        assert dedup.claim(update_id)
+    dedup.save()
+    dedup = restarted(db)
+    assert not dedup.claim(12)
+    assert dedup.claim(13)
+
+
+def test_update_that_never_arrived_is_not_below_the_watermark(db):
+    dedup = restarted(db)
+    for update_id in (10, 11, 12):
+        dedup.claim(update_id)
+    dedup.release(11)
+    dedup.defer(9)
+    dedup.save()
+    dedup = restarted(db)
+    assert dedup.floor == 8
+    assert not dedup.claim(8)
+    assert dedup.claim(9)
+    assert dedup.claim(11)
+
+
+def test_released_update_is_accepted_again_and_lifts_the_watermark(db):
+    dedup = restarted(db)
+    for update_id in (10, 11, 12):
+        dedup.claim(update_id)
+    dedup.release(11)
+    dedup.save()
+    assert restarted(db).floor == 10
+    assert dedup.claim(11)
+    dedup.save()
+    assert restarted(db).floor == 12
+
+
+def test_saves_only_when_due(db):
+    dedup = restarted(db, save_every=3)
+    dedup.claim(1)
+    dedup.claim(2)
+    dedup.save_if_due()
+    assert restarted(db).floor == 0
+    dedup.claim(3)
+    dedup.save_if_due()
+    assert restarted(db).floor == 3
+
+
+def test_shared_claims_span_workers_without_a_watermark(db):
+    first, second = restarted(db, state=DatabaseState(db)), restarted(db, state=DatabaseState(db))
+    assert first.claim(7)
+    assert not second.claim(7)
+    first.release(7)
+    assert second.claim(7)
+    first.save()
+    assert db.fetchval("SELECT value FROM bot_state WHERE key = 'update_high_water'") is None
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+_STATE_KEY = "update_high_water"
+
+
+# Idempotency key for rows written on behalf of a message; a redelivered update carries
+# the same message, so it maps to the same key
+def message_key(message):
+    return f"{message.chat.id}:{message.message_id}"
+
+
+# Drops redelivered Telegram updates before any handler runs. Recently accepted update ids
+# live in a bounded ring plus a set (O(1) checks). A single worker also keeps a watermark in
+# bot_state (saved by save_if_due(), off the request path): the highest accepted id with no
+# update below it still waiting for Telegram's retry, so after a restart everything at or
+# below it is known to be handled while a rejected update's retry still gets through.
+# With a shared state backend (several workers), a claim must also win there, so a
+# redelivery that lands on another worker is dropped too; those claims outlive a restart
+# for `ttl` seconds, so no watermark is kept.
+class UpdateDeduplicator:
+    def __init__(self, db, capacity=10000, save_every=100, state=None, ttl=3600):
+        self._db = db
+        self._state = state if state is not None and state.shared else None
+        self.ttl = ttl
+        self.capacity = capacity
+        self.save_every = save_every
+        self._ring = deque()
+        self._seen = set()
+        # update_id -> when it was turned away; Telegram will deliver it again
+        self._deferred = {}
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self._saved = 0
+        self.floor = 0
+        self.duplicates = 0
+
+    def load(self):
+        if self._state is not None:
+            return
+        self.floor = self._saved = self._db.fetchval("SELECT value FROM bot_state WHERE key = ?", (_STATE_KEY,), 0) or 0
+        logger.info(f"Update watermark is {self.floor}")
+
+    # True when this worker has already accepted the update; memory only, so it can run before
+    # anything else looks at the update. claim() still has the final word.
+    def seen(self, update_id):
+        with self._lock:
+            if update_id <= self.floor or update_id in self._seen:
+                self.duplicates += 1
+                return True
+        return False
+
+    # True when the update is new and now claimed; False for a duplicate
+    def claim(self, update_id):
+        with self._lock:
+            if update_id <= self.floor or update_id in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen.add(update_id)
+            self._ring.append(update_id)
+            if len(self._ring) > self.capacity:
+                self._seen.discard(self._ring.popleft())
+            self._deferred.pop(update_id, None)
+            self._unsaved += 1
+        if self._state is not None and not self._state.claim(f"update:{update_id}", self.ttl):
+            with self._lock:
+                self._seen.discard(update_id)
+                self.duplicates += 1
+            return False
+        return True
+
+    # An update turned away before it was claimed (e.g. 503 while starting); memory only.
+    # The watermark stays below it until Telegram's retry is claimed or `ttl` passes.
+    def defer(self, update_id):
+        with self._lock:
+            self._deferred[update_id] = time.time()
+
+    # Forget a claim whose update was not accepted, so Telegram's retry is processed
+    def release(self, update_id):
+        with self._lock:
+            self._seen.discard(update_id)
+            self._deferred[update_id] = time.time()
+        if self._state is not None:
+            self._state.release(f"update:{update_id}")
+
+    # Persist the watermark once `save_every` updates were claimed since the last save. Called
+    # from a background thread (the write-behind flush), never from claim(), which runs on the
+    # event loop.
+    def save_if_due(self):
+        with self._lock:
+            due = self._unsaved >= self.save_every
+        if due:
+            self.save()
+
+    def save(self):
+        if self._state is not None:
+            return
+        with self._lock:
+            high = self._watermark()
+            self._unsaved = 0
+        if high <= 0 or high == self._saved:
+            return
+        try:
+            # Overwritten rather than maxed: a deferred update can move the watermark back down
+            self._db.execute("INSERT INTO bot_state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                             (_STATE_KEY, high))
+            self._saved = high
+        except Exception as e:
+            logger.error(f"Failed to save update watermark: {e}")
+
+    # Highest accepted id with no deferred update at or below it; call with the lock held
+    def _watermark(self):
+        now = time.time()
+        for update_id in [u for u, when in self._deferred.items() if now - when > self.ttl]:
+            del self._deferred[update_id]
+        high = max(self._seen, default=self._saved)
+        if self._deferred:
+            high = min(high, min(self._deferred) - 1)
+        return high
@@ -0,0 +1,192 @@
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from ledger import Ledger
+
+logger = logging.getLogger(__name__)
+
+
+# Write-behind buffer for credit grants and append-only log rows.
+# Rows are grouped per table and grants go through the ledger as one batch, all in a single
+# transaction every `interval` seconds or once `max_rows` are pending.
+# In "sync" mode every call is written through immediately instead.
+# Rows with a message_key column are idempotent: a row whose key is already stored is
+# skipped, and its grant (ledger ref = message_key) is skipped with it. Tables listed in
+# unique_keys skip rows that hit that unique constraint instead.
+class WriteBehindBuffer:
+    def __init__(self, db, interval=0.5, max_rows=200, mode="buffered"):
+        self._db = db
+        self.interval = interval
+        self.max_rows = max_rows
+        self.mode = mode
+        self._credits = defaultdict(int)
+        self._rows = defaultdict(list)
+        self._row_count = 0
+        self._touches = {}
+        self._grants = []
+        self._ledger = Ledger(db)
+        self._inflight = {}
+        self._inflight_rows = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        # Called with (user_id, delta) for every buffered credit change, and with (table, row)
+        # for every buffered row. Both run under the buffer lock, atomically with the buffering,
+        # so they must be quick and must not call back into the buffer.
+        self.listeners = []
+        self.row_listeners = []
+        # Called with (reason, user_id, credits) after a flush skipped a duplicate grant
+        self.duplicate_listeners = []
+        # Called with no arguments on the write-behind thread after every interval, so other
+        # state that is persisted lazily can be saved off the request path
+        self.flush_listeners = []
+        # table -> columns of a unique constraint that makes repeated rows no-ops
+        self.unique_keys = {}
+
+    def start(self):
+        if self.mode != "buffered" or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    # Buffer a credit grant and/or a row for `table`; `flush=True` writes it out before returning.
+    # The ledger reason defaults to the table name, the ref to the row's message_key.
+    def record(self, user_id=None, credits=0, table=None, row=None, flush=False, reason=None, ref=None):
+        if ref is None and row:
+            ref = row.get("message_key")
+        with self._lock:
+            if credits:
+                self._credits[user_id] += credits
+                self._grants.append((user_id, credits, reason or table or "grant", ref))
+            if table is not None:
+                self._rows[(table, tuple(row))].append(tuple(row.values()))
+                self._row_count += 1
+            full = self._row_count >= self.max_rows
+            if credits:
+                for listener in self.listeners:
+                    listener(user_id, credits)
+            if table is not None:
+                for listener in self.row_listeners:
+                    listener(table, row)
+        if flush or self.mode != "buffered":
+            self.flush()
+        elif full:
+            self._wakeup.set()
+
+    # Coalesced last_login bookkeeping; only the latest timestamp per user is written
+    def touch(self, user_id, when):
+        with self._lock:
+            self._touches[user_id] = when
+        if self.mode != "buffered":
+            self.flush()
+
+    # Credits not yet visible in users.credits (buffered or being written)
+    def pending_credits(self, user_id):
+        with self._lock:
+            return self._credits.get(user_id, 0) + self._inflight.get(user_id, 0)
+
+    # Buffered rows plus users with unflushed credits
+    def depth(self):
+        return self._row_count + len(self._credits)
+
+    # Rows for `table` and `user_id` that are not yet visible in the database
+    def pending_rows(self, table, user_id):
+        with self._lock:
+            sources = [self._rows]
+            if self._inflight_rows:
+                sources.append(self._inflight_rows)
+            pending = []
+            for rows in sources:
+                for (name, columns), values in rows.items():
+                    if name != table or "user_id" not in columns:
+                        continue
+                    index = columns.index("user_id")
+                    pending.extend(dict(zip(columns, v)) for v in values if v[index] == user_id)
+            return pending
+
+    # Hold while reading users.credits so a flush can't land between the read and pending_credits()
+    @contextmanager
+    def consistent(self):
+        with self._flush_lock:
+            yield
+
+    def balance(self, user_id):
+        with self.consistent():
+            credits = self._db.fetchval("SELECT credits FROM users WHERE user_id = ?", (user_id,), 0)
+            return credits + self.pending_credits(user_id)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._credits and not self._rows and not self._touches:
+                    return
+                credits, rows, touches, grants = self._credits, self._rows, self._touches, self._grants
+                self._credits, self._rows, self._row_count, self._touches, self._grants = defaultdict(int), defaultdict(list), 0, {}, []
+                self._inflight = dict(credits)
+                self._inflight_rows = rows
+            try:
+                with self._db.transaction() as cur:
+                    for (table, columns), values in rows.items():
+                        placeholders = ",".join("?" * len(columns))
+                        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+                        if "message_key" in columns:
+                            sql += " ON CONFLICT(message_key) DO NOTHING"
+                        elif table in self.unique_keys:
+                            sql += f" ON CONFLICT({self.unique_keys[table]}) DO NOTHING"
+                        cur.executemany(sql, values)
+                    duplicates = self._ledger.grant_many(grants, cur) if grants else []
+                    if touches:
+                        cur.executemany("UPDATE users SET last_login = ? WHERE user_id = ?", [(when, user_id) for user_id, when in touches.items()])
+            except Exception as e:
+                logger.error(f"Write-behind flush failed, will retry: {e}")
+                self._requeue(credits, rows, touches, grants)
+                return
+            finally:
+                with self._lock:
+                    self._inflight = {}
+                    self._inflight_rows = None
+            for user_id, amount, reason, ref in duplicates:
+                logger.warning(f"Skipped duplicate {reason} grant {ref} for user {user_id}")
+                for listener in self.duplicate_listeners:
+                    listener(reason, user_id, amount)
+            logger.debug(f"Flushed {sum(len(v) for v in rows.values())} rows and {len(credits)} credit deltas")
+
+    def _requeue(self, credits, rows, touches, grants):
+        with self._lock:
+            self._grants[:0] = grants
+            for user_id, when in touches.items():
+                self._touches.setdefault(user_id, when)
+            self._inflight = {}
+            self._inflight_rows = None
+            for user_id, delta in credits.items():
+                self._credits[user_id] += delta
+            for key, values in rows.items():
+                self._rows[key][:0] = values
+                self._row_count += len(values)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush error: {e}")
+            for listener in self.flush_listeners:
+                try:
+                    listener()
+                except Exception as e:
+                    logger.error(f"Write-behind flush listener error: {e}")